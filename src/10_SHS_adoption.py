@@ -0,0 +1,122 @@
+"""
+Estimate each contract's SHS adoption month from a drop in its grid
+consumption (adoption.py), and cross-check it against the SHS years from
+imagery (has_shs, 5b) and the registration start year (start_year, 5c).
+
+Reads the contract-major series of stage 9; contract ranges run in parallel.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from adoption import detect_drops, first_year, seasonal_profile
+from buckets import bucket_path, list_buckets, map_buckets
+from household_series import HouseholdSeries
+from months import BASE_YEAR
+from storage import FINAL_FORMAT, pl_write
+from telemetry import Telemetry
+
+# Paths
+SERIES_DIR = "output/9_out/household_series"
+PANEL_DIR = "output/7_out/combined_merged"      # contract_ID hash buckets (registration start_year)
+OUTPUT_FILE = "output/10_out/shs_adoption.parquet"
+
+# Set up
+ROWS_PER_RANGE = 2_000_000   # contract-months per parallel task
+
+telemetry = Telemetry("10")
+
+# Every worker maps the same arrays; the seasonal profile is a pass over two columns
+store = HouseholdSeries(SERIES_DIR)
+profile = seasonal_profile(store.columns["month_idx"], store.columns["kwh"])
+
+#######################################
+# Detect drops in one range of contracts
+
+def contract_ranges(offsets, rows_per_range=ROWS_PER_RANGE):
+    """(first, last + 1) contract of ranges of about rows_per_range rows."""
+    n_ranges = max(1, int(np.ceil(offsets[-1] / rows_per_range)))
+    bounds = np.unique(np.searchsorted(offsets, np.linspace(0, offsets[-1], n_ranges + 1)))
+    bounds[-1] = len(offsets) - 1
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+@telemetry.timed("range")
+def process_range(bounds):
+    """Change points and first SHS year of the contracts first..last. Returns a polars frame."""
+    first, last = bounds
+    start, end = store.offsets[first], store.offsets[last]
+    offsets = store.offsets[first:last + 1] - start
+    month_idx = store.columns["month_idx"][start:end]
+
+    result = detect_drops(offsets, month_idx, store.columns["kwh"][start:end], profile)
+    telemetry.lap("detect", rows_in=int(end - start), rows_out=last - first)
+    return pl.DataFrame({
+        "contract_ID": np.char.decode(store.contracts[first:last], "utf-8"),
+        **result,
+        "shs_year": first_year(offsets, month_idx, store.columns["has_shs"][start:end]),
+    })
+
+#######################################
+# Cross-check
+
+def registration_years():
+    """Earliest registration start_year of each registered contract (from the final panel)."""
+    return (
+        pl.scan_parquet([bucket_path(PANEL_DIR, b) for b in list_buckets(PANEL_DIR)])
+        .select(pl.col("contract_ID").cast(pl.String), "start_year")
+        .drop_nulls("start_year")
+        .group_by("contract_ID").agg(pl.col("start_year").min().cast(pl.Int64))
+        .collect()
+    )
+
+
+def agreement(df, reference):
+    """Detection rate and year difference against a reference year column (-1/null = no reference)."""
+    has_ref = df[reference].fill_null(-1) >= 0
+    with_ref, without_ref = df.filter(has_ref), df.filter(~has_ref)
+    detected = with_ref.filter(pl.col("detected"))
+    lag = (detected["adoption_year"] - detected[reference]).to_pandas()
+    return pd.Series({
+        "contracts": with_ref.height,
+        "detected_%": 100 * detected.height / max(with_ref.height, 1),
+        "detected_without_%": 100 * without_ref["detected"].sum() / max(without_ref.height, 1),
+        "within_1_year_%": 100 * (lag.abs() <= 1).mean() if len(lag) else np.nan,
+        "median_lag_years": lag.median() if len(lag) else np.nan,
+    })
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    ranges = contract_ranges(store.offsets)
+    print(f"{len(store):,} contract series in {len(ranges)} ranges")
+
+    df = pl.concat(map_buckets(process_range, ranges))
+    df = df.join(registration_years(), on="contract_ID", how="left", maintain_order="left").with_columns(
+        pl.when(pl.col("adoption_month_idx") >= 0)
+          .then(pl.col("adoption_month_idx") // 12 + BASE_YEAR)
+          .alias("adoption_year"),
+        pl.when(pl.col("shs_year") >= 0).then(pl.col("shs_year")).alias("shs_year"),
+        pl.when(pl.col("adoption_month_idx") >= 0).then(pl.col("adoption_month_idx")).alias("adoption_month_idx"),
+    )
+    telemetry.lap("cross_check", rows_out=df.height)
+
+    print(f"\nDrops detected in {df['detected'].sum():,} of {df.height:,} contracts "
+          f"({100 * df['detected'].mean():.1f}%)")
+    checks = pd.DataFrame({
+        "imagery (has_shs)": agreement(df, "shs_year"),
+        "registration (start_year)": agreement(df, "start_year"),
+    }).T
+    print("\nAgreement with the SHS years (detected_without_%: contracts without that evidence):")
+    print(checks.round(1).to_string())
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    pl_write(df, OUTPUT_FILE, FINAL_FORMAT)
+    print(f"\nSaved adoption estimates to {OUTPUT_FILE}")
+    telemetry.finish(rows_out=df.height, detected=int(df["detected"].sum()))
@@ -9,16 +9,25 @@ import os
 import pandas as pd
 from datetime import datetime
 
+from chunking import ChunkPlanner
+from months import month_index, month_index_of, month_string
+from sampling import sample_frame
+from schema import to_categorical
+from telemetry import Telemetry
+
 # Paths
 prepaid_folder = "data/old_prepaid"
 postpaid_folder = "data/postpaid"
 output_path = "output/1_out/combined_electricity_data.parquet"
+meters_path = "output/1_out/account_meters.parquet"   # account/meter serial pairs (household keys in 2b)
 os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
 # Date of files for old prepaid transactions
 startdate = datetime(2020, 1, 1)
 cutoff = datetime(2021, 3, 1)
 
+telemetry = Telemetry("1a")
+
 #######################################
 # PREPAID IMPORT
 print("=== Importing Prepaid Files ===")
@@ -30,6 +39,7 @@ prepaid_rename = {
 }
 
 prepaid_dfs = []
+meter_dfs = []
 
 for filename in os.listdir(prepaid_folder):
     if filename.startswith("prepaid-electricity-purchases-") and filename.endswith(".csv"):
@@ -43,26 +53,40 @@ for filename in os.listdir(prepaid_folder):
                 print(f"Importing: {filename}")
 
                 df = pd.read_csv(file_path, usecols=prepaid_use_cols)
+                df = sample_frame(df, "contract_account_hashed")   # fast runs: sampled contracts only
                 df = df.rename(columns=prepaid_rename)
                 df["transaction_timestamp"] = pd.to_datetime(df["transaction_timestamp"], errors="coerce")
 
-                # Keep only month and year (YYYY-MM)
-                df["month_year"] = df["transaction_timestamp"].dt.strftime("%Y-%m")
+                # Keep only the month (months since 2000-01)
+                df["month_idx"] = month_index_of(df["transaction_timestamp"])
                 df["Type"] = "prepaid"
 
-                df = df[["contract_account_hashed", "totalunits", "month_year", "transaction_timestamp", "Type"]]
+                meter_dfs.append(df[["contract_account_hashed", "meter_serial_number_hashed"]].drop_duplicates())
+                df = df[["contract_account_hashed", "totalunits", "month_idx", "transaction_timestamp", "Type"]]
                 prepaid_dfs.append(df)
         except Exception as e:
             print(f"Skipping {filename} due to error: {e}")
 
 prepaid_combined = pd.concat(prepaid_dfs, ignore_index=True) if prepaid_dfs else pd.DataFrame()
 prepaid_combined = prepaid_combined.drop_duplicates()
+telemetry.lap("load_prepaid", rows_out=len(prepaid_combined), files=len(prepaid_dfs))
+
+# Meters each account bought for, linking accounts of one household across eras (2b)
+account_meters = (
+    pd.concat(meter_dfs, ignore_index=True).drop_duplicates()
+    if meter_dfs else pd.DataFrame(columns=["contract_account_hashed", "meter_serial_number_hashed"])
+)
+account_meters.astype("string").to_parquet(meters_path, index=False)
+print(f"Saved {len(account_meters):,} account/meter pairs to {meters_path}")
 
 #######################################
 # POSTPAID IMPORT
 print("\n=== Importing Postpaid Files (Filtered for units = W) ===")
+# (not sampled in fast runs: a bill's contract_ID comes from its location, joined in 2b)
 
 postpaid_dfs = []
+# Chunk size from the memory budget (a chunk and its filtered copy)
+planner = ChunkPlanner("1a", working_factor=2)
 
 for filename in os.listdir(postpaid_folder):
     if filename.endswith(".csv"):
@@ -79,10 +103,9 @@ for filename in os.listdir(postpaid_folder):
                 "unit_of_measure_code"
             ]
 
-            chunks = pd.read_csv(
+            chunks = planner.read_csv(
                 file_path,
                 usecols=lambda c: c in use_columns,
-                chunksize=200000,
                 dtype={
                     "contract_hashed": "string",
                     "billing_period_start_month": "Int64",
@@ -126,11 +149,11 @@ for filename in os.listdir(postpaid_folder):
                 "quantity_billed": "totalunits"
             })
 
-            # Create unified month_year column
-            df["month_year"] = df["year"].astype(str).str.zfill(2) + "-" + df["month"].astype(str) 
+            # Create unified month column (months since 2000-01)
+            df["month_idx"] = month_index(df["year"], df["month"])
             df["Type"] = "postpaid"
 
-            df = df[["contract_hashed", "totalunits", "month_year", "Type", "rate_category"]]
+            df = df[["contract_hashed", "totalunits", "month_idx", "Type", "rate_category"]]
             postpaid_dfs.append(df)
 
         except Exception as e:
@@ -138,6 +161,7 @@ for filename in os.listdir(postpaid_folder):
 
 postpaid_combined = pd.concat(postpaid_dfs, ignore_index=True) if postpaid_dfs else pd.DataFrame()
 postpaid_combined = postpaid_combined.drop_duplicates()
+telemetry.lap("load_postpaid", rows_out=len(postpaid_combined), files=len(postpaid_dfs))
 
 #######################################
 # COMBINE PREPAID & POSTPAID
@@ -146,14 +170,20 @@ print("\n=== Combining Prepaid and Postpaid Data ===")
 if not prepaid_combined.empty or not postpaid_combined.empty:
     combined = pd.concat([prepaid_combined, postpaid_combined], ignore_index=True)
     combined = combined.drop_duplicates()
+    telemetry.lap("combine", rows_in=len(prepaid_combined) + len(postpaid_combined), rows_out=len(combined))
     print(f"\n Combined dataset created with {len(combined):,} total rows.")
     print(f"   Prepaid rows:  {len(prepaid_combined):,}")
     print(f"   Postpaid rows: {len(postpaid_combined):,}")
-    print(f"   Date range: {combined['month_year'].min()} → {combined['month_year'].max()}")
+    first_month, last_month = month_string([combined['month_idx'].min(), combined['month_idx'].max()])
+    print(f"   Date range: {first_month} → {last_month}")
 
     
     # SAVE FINAL COMBINED DATA
-    combined.to_parquet(output_path, index=False)
+    to_categorical(combined).to_parquet(output_path, index=False)
+    telemetry.lap("save", rows_out=len(combined))
     print(f"\n Saved combined dataset to: {output_path}")
 else:
+    combined = pd.DataFrame()
     print("\n No data imported from either source.")
+
+telemetry.finish(rows_out=len(combined))
@@ -7,23 +7,30 @@ Date: February 2026
 
 import polars as pl
 import os
-from time import time
 import pandas as pd
 
+from buckets import write_polars_buckets
+from months import BASE_YEAR
+from sampling import pl_in_sample
+from schema import pl_categorical
+from telemetry import Telemetry
+
 # Paths
 parquet_path = "data/prepaid_parquet"  # folder with raw Parquet files
 output_dir = "output/1_out"            # save output here
 os.makedirs(output_dir, exist_ok=True)
 final_file = os.path.join(output_dir, "final_monthly_new.parquet")
+intervals_dir = os.path.join(output_dir, "transaction_intervals")   # contract hash buckets (used by 8)
 
 # Set up
 use_columns = ["totalunits", "trfname", "transaction_timestamp", "contract_account_hashed"]
 
+telemetry = Telemetry("1b")
+
 #######################################
 # MAIN
 
 if __name__ == "__main__":
-    start = time()
     print("[INFO] Processing entire dataset...")
 
     #######################################
@@ -32,6 +39,7 @@ if __name__ == "__main__":
     df = (
         pl.scan_parquet(os.path.join(parquet_path, "*.parquet"))
         .select(use_columns)
+        .filter(pl_in_sample("contract_account_hashed"))   # fast runs: sampled contracts only
         .with_columns(
             pl.col("transaction_timestamp").str.strptime(pl.Datetime, "%Y-%m-%d %H:%M:%S", strict=False)
         )
@@ -39,6 +47,7 @@ if __name__ == "__main__":
     ).collect()
 
     print(f"[INFO] Loaded {df.height:,} rows after deduplication")
+    telemetry.lap("load", rows_out=df.height)
 
     #######################################
     # Clean
@@ -57,6 +66,19 @@ if __name__ == "__main__":
     # Remove last transaction (since no next_timestamp)
     df = df.filter(pl.col("next_timestamp").is_not_null())
 
+    #######################################
+    # Save transaction intervals (purchase to next purchase), bucketed like 2b so
+    # bucket b holds the same contracts as every later stage's bucket b
+    
+    n_buckets = write_polars_buckets(
+        df.select(["contract_account_hashed", "trfname", "transaction_timestamp", "next_timestamp", "totalunits"]),
+        intervals_dir,
+        key="contract_account_hashed",
+        sorted_by=["contract_account_hashed", "transaction_timestamp"]
+    )
+    print(f"[INFO] Saved transaction intervals to {intervals_dir} ({n_buckets} buckets)")
+    telemetry.lap("save_intervals", rows_out=df.height, buckets=n_buckets)
+
     #######################################
     # Compute days_between and daily rate
 
@@ -86,8 +108,10 @@ if __name__ == "__main__":
     df = df.with_columns([
         pl.int_ranges(pl.col("start_month"), pl.col("end_month") + 1).alias("months_array")
     ]).explode("months_array")
+    telemetry.lap("expand_months", rows_out=df.height)
 
     df = df.with_columns([
+        (pl.col("months_array") - BASE_YEAR * 12).cast(pl.Int16).alias("month_idx"),
         (pl.col("months_array") // 12).cast(pl.Int32).alias("year"),
         (pl.col("months_array") % 12 + 1).cast(pl.Int32).alias("month"),
         pl.datetime(
@@ -130,25 +154,31 @@ if __name__ == "__main__":
     # Monthly aggregation
 
     monthly = (
-        df.group_by(["contract_account_hashed", "trfname", "month_start"])
+        df.group_by(["contract_account_hashed", "trfname", "month_idx"])
           .agg([
               pl.col("kwh").sum(),
               pl.len().alias("num_transactions")
           ])
-          .with_columns(pl.col("month_start").dt.strftime("%Y-%m").alias("month_year"))
-          .select(["contract_account_hashed", "trfname", "month_year", "kwh", "num_transactions"])
+          .select(["contract_account_hashed", "trfname", "month_idx", "kwh", "num_transactions"])
     )
+    telemetry.lap("aggregate", rows_in=df.height, rows_out=monthly.height)
 
     #######################################
     # Save parquet
     
-    monthly.write_parquet(final_file)
+    pl_categorical(monthly).write_parquet(final_file)
     print(f"Final merged file saved: {final_file}")
+    telemetry.lap("save", rows_out=monthly.height)
 
     #######################################
     # Final checks
     
-    raw_total = pl.scan_parquet(os.path.join(parquet_path, "*.parquet")).select("totalunits").collect()["totalunits"].sum()
+    raw_total = (
+        pl.scan_parquet(os.path.join(parquet_path, "*.parquet"))
+        .filter(pl_in_sample("contract_account_hashed"))   # same contracts as the panel
+        .select("totalunits")
+        .collect()["totalunits"].sum()
+    )
     processed_kwh = monthly["kwh"].sum()
     diff = raw_total - processed_kwh
     diff_pct = diff / raw_total * 100
@@ -162,5 +192,6 @@ if __name__ == "__main__":
         print("[WARNING] Significant discrepancy detected!")
     else:
         print("Sanity check passed!")
+    telemetry.lap("check", diff_pct=diff_pct)
 
-    print(f"Total runtime: {time() - start:.1f}s")
+    telemetry.finish(rows_out=monthly.height)
@@ -7,18 +7,21 @@ Date: February 2026
 
 import polars as pl
 import os
-from time import time
+
+from months import pl_month_start
+from schema import pl_categorical
+from telemetry import Telemetry
 
 # Paths
-parquet_file = "data/1_out/combined_electricity_data.parquet"
+parquet_file = "output/1_out/combined_electricity_data.parquet"   # from 1a
 output_dir = "output/1_out"
 final_file = os.path.join(output_dir, "final_monthly_old_efficient.parquet")
 os.makedirs(output_dir, exist_ok=True)
 
 # Set up
-use_columns = ["totalunits", "month_year", "contract_account_hashed", "contract_hashed", "Type", "rate_category"]
+use_columns = ["totalunits", "month_idx", "contract_account_hashed", "contract_hashed", "Type", "rate_category"]
 
-t0 = time()
+telemetry = Telemetry("1c")
 print("Loading data lazily...")
 
 #######################################
@@ -33,16 +36,10 @@ df = df.with_columns([
     pl.coalesce(["contract_account_hashed", "contract_hashed"]).alias("account_id")
 ])
 
-# Parse month/year to timestamp
-split_col = pl.col("month_year").str.split_exact("-", 1)
-df = df.with_columns([
-    split_col.struct.field("field_0").alias("year_str"),
-    split_col.struct.field("field_1").str.zfill(2).alias("month_str")
-])
+# Month index to timestamp (first day of the month)
 df = df.with_columns([
-    (pl.col("year_str") + "-" + pl.col("month_str")).str.strptime(pl.Date, "%Y-%m").alias("timestamp_assume")
+    pl_month_start(pl.col("month_idx")).alias("timestamp_assume")
 ])
-df = df.drop(["year_str", "month_str"])
 
 # Sort accounts
 df = df.sort(["account_id", "timestamp_assume"]).with_columns(
@@ -71,29 +68,20 @@ df = df.with_columns([
     (pl.col("totalunits") / pl.col("days_between_safe")).alias("daily_kwh")
 ])
 
-# Aggregate to monthly totals
-df = df.with_columns([
-    pl.col("timestamp_assume").dt.year().alias("year"),
-    pl.col("timestamp_assume").dt.month().alias("month"),
-    pl.datetime(pl.col("timestamp_assume").dt.year(), pl.col("timestamp_assume").dt.month(), 1).alias("month_start")
-])
-
+# Aggregate to monthly totals (timestamp_assume is the first of month_idx, so group on the index)
 monthly = (
-    df.group_by(["account_id", "contract_account_hashed", "contract_hashed", "Type", "month_start", "rate_category"])
+    df.group_by(["account_id", "contract_account_hashed", "contract_hashed", "Type", "month_idx", "rate_category"])
       .agg([
           (pl.col("daily_kwh") * pl.col("days_between_safe")).sum().alias("kwh"),  # total kWh for the month
           pl.sum("days_between_safe").alias("num_days")
       ])
-      .with_columns([
-          pl.col("month_start").dt.strftime("%Y-%m").alias("month_year")
-      ])
       .select([
           "account_id",
           "contract_account_hashed",
           "rate_category",
           "contract_hashed",
           "Type",
-          "month_year",
+          "month_idx",
           "kwh",
           "num_days"
       ])
@@ -102,9 +90,11 @@ monthly = (
 #######################################
 # Save
 
-monthly.collect().write_parquet(final_file)
+# (the lazy plan runs here, so load, process and save are one step)
+monthly_df = pl_categorical(monthly).collect()
+monthly_df.write_parquet(final_file)
 print(f"Final merged file saved: {final_file}")
-print(f"Total runtime: {time() - t0:.1f}s")
+telemetry.lap("process_save", rows_out=monthly_df.height)
 
 #######################################
 # Final checks
@@ -127,3 +117,6 @@ sanity_df = raw_by_type.join(processed_by_type, on="Type", how="full").with_colu
 
 print("\n Sanity Check by Type:")
 print(sanity_df)
+telemetry.lap("check")
+
+telemetry.finish(rows_out=monthly_df.height)
@@ -9,15 +9,24 @@ import os
 import pandas as pd
 from datetime import datetime
 
+from chunking import ChunkPlanner
+from sampling import SAMPLING, in_sample
+from schema import to_categorical
+from telemetry import Telemetry
+
 # Paths
 location_folder = "data/ContractLocations"
 output_path = "output/2a_out/new_location_total.parquet"
 
+telemetry = Telemetry("2a")
+
 #######################################
 # Import location files
 print("\n=== Importing Location Files (Filtered for TSES) ===")
 
 locations_dfs = []
+# Chunk size from the memory budget (a chunk and its filtered copy)
+planner = ChunkPlanner("2a", working_factor=2)
 
 for filename in os.listdir(location_folder):
     if filename.endswith(".csv"):
@@ -59,10 +68,9 @@ for filename in os.listdir(location_folder):
                 "business_area": "string"
                 }
 
-            chunks = pd.read_csv(
+            chunks = planner.read_csv(
                 file_path,
                 usecols=valid_cols,
-                chunksize=200000,
                 dtype={k: v for k, v in dtypes.items() if k in valid_cols},
                 low_memory=True
             )
@@ -84,6 +92,12 @@ for filename in os.listdir(location_folder):
                     if col not in filtered.columns:
                         filtered[col] = pd.NA
 
+                # Fast runs: locations of sampled accounts, and of sampled contracts (a postpaid
+                # contract takes its contract_ID from its location's account; 2b keeps exact IDs)
+                if SAMPLING:
+                    filtered = filtered[in_sample(filtered["contract_account_hashed"])
+                                        | in_sample(filtered["contract_hashed"])]
+
                 filtered_chunks.append(filtered[use_columns])
 
 
@@ -101,8 +115,13 @@ locations_dfs = [df for df in locations_dfs if not df.empty and df.dropna(how='a
 #######################################
 # Combine
 location_combined = pd.concat(locations_dfs, ignore_index=True) if locations_dfs else pd.DataFrame()
+telemetry.lap("load", rows_out=len(location_combined), files=len(locations_dfs))
 
 #######################################
-# Save
-location_combined.to_parquet(output_path, index=False)
+# Save (chunks with different categories concatenate to plain strings, so re-categorize)
+os.makedirs(os.path.dirname(output_path), exist_ok=True)
+to_categorical(location_combined).to_parquet(output_path, index=False)
 print(f"✅ Final dataset saved to: {output_path}")
+telemetry.lap("save", rows_out=len(location_combined))
+
+telemetry.finish(rows_out=len(location_combined))
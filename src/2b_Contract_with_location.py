@@ -9,23 +9,57 @@ import pandas as pd
 from datetime import datetime
 import os
 import polars as pl
+import pyarrow.parquet as pq
+
+from buckets import PANEL_ORDER, write_buckets
+from household_keys import HOUSEHOLD_KEY, household_keys, with_household
+from incremental import dirty_contracts, record_dirty, replace_buckets
+from interchange import CopyLedger, from_pandas, from_polars, to_pandas, to_polars
+from months import month_index_of, month_start
+from prefilter import key_filter
+from sampling import SAMPLING, pl_in_sample
+from schema import project_columns
+from telemetry import Telemetry
 
 # Paths
 locations_path = "output/2a_out/new_location_total.parquet"
 monthly_path = "output/1_out/final_monthly_new.parquet"
 devices_path = "data/devices_total.parquet"
+meters_path = "output/1_out/account_meters.parquet"
 old_path = "output/1_out/final_monthly_old_efficient.parquet"
-output_path = "output/2b_out/out_contract_with_location.parquet"
+output_path = "output/2b_out/out_contract_with_location"  # contract_ID hash buckets
+keys_path = "output/2b_out/household_keys.parquet"       # household_ID of every identifier
 
-os.makedirs(os.path.dirname(output_path), exist_ok=True)
+os.makedirs(output_path, exist_ok=True)
+
+# Columns read from the monthly panels (stage 1b and 1c outputs)
+monthly_columns = ['contract_account_hashed', 'month_idx', 'trfname', 'kwh']
+old_columns = ['Type', 'month_idx', 'kwh', 'contract_account_hashed', 'contract_hashed', 'rate_category']
+# Identifier columns of the location records (household keys)
+location_id_columns = ['contract_account_hashed', 'contract_hashed', 'device_serial_number_hashed']
+
+# Changed contracts (PIPELINE_DIRTY_CONTRACTS); None = rebuild every contract
+dirty = dirty_contracts()
+
+telemetry = Telemetry("2b")
 
 #######################################
 # Load data
 
-locations_df = pd.read_parquet(locations_path)
-devices_df = pd.read_parquet(devices_path)
-monthly_df = pd.read_parquet(monthly_path)
-old_df = pd.read_parquet(old_path)
+monthly_df = pd.read_parquet(monthly_path, columns=project_columns(monthly_path, monthly_columns))
+old_df = pd.read_parquet(old_path, columns=project_columns(old_path, old_columns))
+
+# Semi-join: only the locations of accounts and contracts in the panels are read in full
+# (the identifier columns of every location still go into the household keys)
+locations_df = pd.read_parquet(locations_path, filters=key_filter(
+    contract_account_hashed=pd.concat([monthly_df["contract_account_hashed"], old_df["contract_account_hashed"]]),
+    contract_hashed=old_df["contract_hashed"],
+))
+location_ids_pl = pl.read_parquet(locations_path, columns=location_id_columns)
+print(f"Locations of panel contracts: {len(locations_df):,} of {pq.ParquetFile(locations_path).metadata.num_rows:,} rows")
+devices_pl = pl.read_parquet(devices_path)
+meters_pl = pl.read_parquet(meters_path)
+telemetry.lap("load", rows_out=len(monthly_df) + len(old_df), locations=len(locations_df))
 
 #######################################
 # Baseline reference counts
@@ -58,8 +92,8 @@ print("="*80)
 #######################################
 # Combine data
 
-required_monthly_cols = ['contract_ID', 'Type', 'month_year', 'trfname', 'kwh', 'contract_account_hashed']
-required_old_cols = ['Type', 'month_year', 'kwh', 'contract_account_hashed', 'contract_hashed', 'rate_category']
+required_monthly_cols = ['contract_ID', 'Type', 'month_idx', 'trfname', 'kwh', 'contract_account_hashed']
+required_old_cols = ['Type', 'month_idx', 'kwh', 'contract_account_hashed', 'contract_hashed', 'rate_category']
 
 before_concat = len(monthly_df) + len(old_df)
 df_combined = pd.concat([
@@ -74,12 +108,11 @@ print(f"\nAfter concatenation: {len(df_combined):,} rows "
 print("="*80)
 
 #######################################
-# Fix dates
+# Check dates (month_idx is already an integer month from stage 1)
 
-df_combined["month_year"] = pd.to_datetime(df_combined["month_year"], format="%Y-%m", errors="coerce")
-valid_dates = df_combined["month_year"].notna().sum()
-invalid_dates = df_combined["month_year"].isna().sum()
-print(f"Date conversion: {valid_dates:,} valid, {invalid_dates:,} invalid "
+valid_dates = df_combined["month_idx"].notna().sum()
+invalid_dates = df_combined["month_idx"].isna().sum()
+print(f"Valid months: {valid_dates:,} valid, {invalid_dates:,} invalid "
       f"({valid_dates/baseline_rows*100:.1f}% of baseline rows)")
 print("="*80)
 
@@ -98,91 +131,104 @@ if mask_bad.any():
     print(f"⚠️ Fixing {mask_bad.sum():,} rows where move_out < move_in")
     locations_df.loc[mask_bad, "move_out_timestamp"] = pd.Timestamp(datetime.today().date())
 
+# Move-in/out as month indexes: a month counts if its first day is within
+# [move_in, move_out], i.e. move_in_idx <= month_idx <= move_out_idx
+locations_df["move_in_idx"] = month_index_of(locations_df["move_in_timestamp"])
+locations_df["move_in_idx"] += (locations_df["move_in_timestamp"] > month_start(locations_df["move_in_idx"])).astype("Int16")
+locations_df["move_out_idx"] = month_index_of(locations_df["move_out_timestamp"])
+
 print(f"Cleaned locations_df: {len(locations_df):,} rows (was {before_loc:,}), "
       f"unique contracts: {locations_df['contract_account_hashed'].nunique():,} "
       f"({locations_df['contract_account_hashed'].nunique()/baseline_contracts*100:.1f}% of baseline)")
 print("="*80)
+telemetry.lap("clean", rows_out=len(df_combined), locations=len(locations_df))
 
 #######################################
 # Merge contract data with locations
 
-df_combined_pl = pl.from_pandas(df_combined)
-locations_pl = pl.from_pandas(locations_df)
+# Hand-offs go through Arrow; the ledger records how many bytes each one copies
+ledger = CopyLedger("2b")
+df_combined_pl = to_polars(from_pandas(df_combined, ledger), ledger)
+locations_pl = to_polars(from_pandas(locations_df, ledger), ledger)
 
 #######################################
-# Prepare col names for merge
-
-locations_pl_account = (
-    locations_pl.with_columns([
-        pl.col("contract_account_hashed").alias("contract_account_hashed_loc")
-    ])
-)
-
-locations_pl_contract = (
-    locations_pl.with_columns([
-        pl.col("contract_account_hashed").alias("contract_account_hashed_loc"),
-        pl.col("contract_hashed").alias("contract_hashed_loc")
-    ])
-)
+# Household keys: accounts, contracts, devices and meters named together in the
+# location records, the device list, the old prepaid purchases or the panels
+
+keys = household_keys([
+    (location_ids_pl, {"account": "contract_account_hashed", "contract": "contract_hashed",
+                       "device": "device_serial_number_hashed"}),
+    (devices_pl, {"account": "contract_account_hashed", "device": "device_serial_number_hashed"}),
+    (meters_pl, {"account": "contract_account_hashed", "meter": "meter_serial_number_hashed"}),
+    (df_combined_pl, {"account": "contract_account_hashed", "contract": "contract_hashed"}),
+])
+keys.write_parquet(keys_path)
+telemetry.lap("household_keys", rows_out=len(keys), households=keys[HOUSEHOLD_KEY].n_unique())
 
 #######################################
-# Merge: New data (with contract_account_hashed)
-
-df1 = (
-    df_combined_pl.join(
-        locations_pl_account,
-        left_on="contract_account_hashed",
-        right_on="contract_account_hashed_loc",
-        how="inner"
-    )
-    .filter(
-        (pl.col("month_year") >= pl.col("move_in_timestamp")) &
-        (pl.col("month_year") <= pl.col("move_out_timestamp"))
-    )
+# Merge: join each row to the locations of its own account (new data) or contract
+# (postpaid data) that cover its month. Joining on the household instead would pair
+# every row with every location of its household; the household_ID rides along.
+
+locations_own = locations_pl.rename({
+    "contract_account_hashed": "contract_account_hashed_right",
+    "contract_hashed": "contract_hashed_right",
+})
+panel_pl = with_household(df_combined_pl, keys)
+in_window = (pl.col("month_idx") >= pl.col("move_in_idx")) & (pl.col("month_idx") <= pl.col("move_out_idx"))
+
+by_account = (
+    panel_pl.join(locations_own, left_on="contract_account_hashed", right_on="contract_account_hashed_right",
+                  how="inner", coalesce=False)
+    .filter(in_window)
     .with_columns(pl.lit("account_match").alias("match_type"))
 )
-print(f"After account join: {df1.height:,} rows")
 
-#######################################
-# Merge: Postpaid data (with contract_hashed)
-
-df2 = (
-    df_combined_pl.join(
-        locations_pl_contract,
-        left_on="contract_hashed",
-        right_on="contract_hashed_loc",
-        how="inner"
-    )
-    .filter(
-        (pl.col("month_year") >= pl.col("move_in_timestamp")) &
-        (pl.col("month_year") <= pl.col("move_out_timestamp"))
-    )
+# A location matching both the row's account and contract counts once, as an account match
+by_contract = (
+    panel_pl.join(locations_own, left_on="contract_hashed", right_on="contract_hashed_right",
+                  how="inner", coalesce=False)
+    .filter(in_window)
+    .filter((pl.col("contract_account_hashed") != pl.col("contract_account_hashed_right")).fill_null(True))
     .with_columns(pl.lit("contract_match").alias("match_type"))
 )
-print(f"After contract join: {df2.height:,} rows")
-
-#######################################
-# Combine merges
-
-df_merged = pl.concat([df1, df2], how="diagonal_relaxed")
 
-#######################################
-# Combine the two 'contract_account_hashed' sources into one
-
-df_merged = df_merged.with_columns(
+df_merged = pl.concat([by_account, by_contract]).with_columns(
+    # Postpaid rows take the account of their location
     pl.coalesce([
-        pl.col("contract_account_hashed"),          # original
-        pl.col("contract_account_hashed_loc"),      # from merge 1
+        pl.col("contract_account_hashed"),
+        pl.col("contract_account_hashed_right"),
     ]).alias("contract_account_hashed")
 )
+print(f"After location join: {df_merged.height:,} rows "
+      f"({df_merged.filter(pl.col('match_type') == 'account_match').height:,} by account, "
+      f"{df_merged.filter(pl.col('match_type') == 'contract_match').height:,} by contract)")
 
-cols_to_drop = [c for c in ["contract_account_hashed_loc", "contract_hashed_loc", "contract_account_hashed_device"] if c in df_merged.columns]
+cols_to_drop = [c for c in ["contract_account_hashed_loc", "contract_hashed_loc", "contract_account_hashed_device",
+                            "move_in_idx", "move_out_idx"] if c in df_merged.columns]
 df_merged = df_merged.drop(cols_to_drop)
 
+# Fast run: only the sampled contracts (1a postpaid and 2a keep a superset, as the
+# contract_ID of a postpaid bill is only known after the location join)
+if SAMPLING:
+    df_merged = df_merged.filter(pl_in_sample(pl.coalesce(["contract_account_hashed", "contract_hashed"])))
+    print(f"Fast run: {df_merged.height:,} rows of sampled contracts")
+
+# Incremental run: only the dirty contracts go on to the pandas steps and the buckets
+if dirty is not None:
+    df_merged = df_merged.filter(
+        pl.coalesce(["contract_account_hashed", "contract_hashed"]).is_in(sorted(dirty))
+    )
+    print(f"Incremental run: {df_merged.height:,} rows of {len(dirty):,} dirty contracts")
+
 #######################################
 # Convert to pandas
 
-df_merged = df_merged.to_pandas()
+df_merged = to_pandas(from_polars(df_merged, ledger), ledger)
+ledger.report()
+ledger.save()
+telemetry.lap("join", rows_in=len(df_combined), rows_out=len(df_merged),
+              bytes_copied=int(ledger.summary()["bytes_copied"].sum()))
 
 df_merged["contract_ID"] = df_merged["contract_account_hashed"].combine_first(df_merged["contract_hashed"])
 
@@ -191,29 +237,30 @@ df_merged["contract_ID"] = df_merged["contract_account_hashed"].combine_first(df
 
 loc_cols = ["ward2021", "move_in_timestamp", "move_out_timestamp", "wkt"]
 loc_cols = [c for c in loc_cols if c in df_merged.columns]
-df_merged = df_merged.sort_values(["contract_ID", "month_year"])
+df_merged = df_merged.sort_values(PANEL_ORDER)
 df_merged[loc_cols] = df_merged.groupby("contract_ID")[loc_cols].ffill()
 df_merged[loc_cols] = df_merged.groupby("contract_ID")[loc_cols].bfill()
 
 print(f"Missing location values after fill: {df_merged[loc_cols].isna().sum().to_dict()} "
       f"({df_merged['wkt'].notna().mean()*100:.1f}% rows have location)")
+telemetry.lap("fill", rows_out=len(df_merged))
 
 #######################################
 # Fix duplicates
 
 print("\nResolving duplicates...")
-df_merged = df_merged.sort_values("wkt", na_position="last")
-dup_before = df_merged.duplicated(subset=["contract_ID", "month_year"], keep=False).sum()
+dup_before = df_merged.duplicated(subset=["contract_ID", "month_idx"], keep=False).sum()
 print(f"Duplicate month/account combos before drop: {dup_before:,}")
 #contracts pay on more than one tariff each month
 
-# Drop duplicates
+# Drop duplicates (keeps the first of each, so the rows stay in PANEL_ORDER)
 df_merged = df_merged.drop_duplicates()
-dup_after = df_merged.duplicated(subset=["contract_ID", "month_year"]).sum()
+dup_after = df_merged.duplicated(subset=["contract_ID", "month_idx"]).sum()
 print(f"Duplicate month/account combos after drop: {dup_after:,}")
 print(f"Remaining rows: {len(df_merged):,} ({len(df_merged)/baseline_rows*100:.1f}% of baseline)")
 print(f"Remaining unique contracts: {df_merged['contract_ID'].nunique():,} "
       f"({df_merged['contract_ID'].nunique()/baseline_contracts*100:.1f}% of baseline)")
+telemetry.lap("dedup", rows_out=len(df_merged), duplicates_before=int(dup_before))
  
 #######################################
 # Summarize location coverage
@@ -222,11 +269,11 @@ contracts_with_wkt = df_merged.loc[df_merged["wkt"].notna(), ["contract_ID", "Ty
 contracts_total = df_merged[["contract_ID", "Type"]].drop_duplicates()
 
 summary = (
-    contracts_total.groupby("Type")
+    contracts_total.groupby("Type", observed=True)
     .agg(total_contracts=("contract_ID", "count"))
     .reset_index()
     .merge(
-        contracts_with_wkt.groupby("Type").agg(with_location=("contract_ID", "count")).reset_index(),
+        contracts_with_wkt.groupby("Type", observed=True).agg(with_location=("contract_ID", "count")).reset_index(),
         on="Type",
         how="left"
     )
@@ -241,9 +288,16 @@ print("="*80)
 #######################################
 # Save
 
-df_merged.to_parquet(output_path, index=False)
-print(f"\n Saved final dataset to: {output_path}")
+if dirty is None:
+    n_written = write_buckets(df_merged, output_path, sorted_by=PANEL_ORDER)
+else:
+    n_written = replace_buckets(df_merged, output_path, dirty)
+record_dirty(output_path, dirty)
+telemetry.lap("save", rows_out=len(df_merged), buckets=n_written)
+print(f"\n Saved final dataset to: {output_path} ({n_written} buckets)")
 print(f"Final rows: {len(df_merged):,} ({len(df_merged)/baseline_rows*100:.1f}% of baseline)")
 print(f"Final unique contracts: {df_merged['contract_ID'].nunique():,} "
       f"({df_merged['contract_ID'].nunique()/baseline_contracts*100:.1f}% of baseline)")
 print("="*80)
+
+telemetry.finish(rows_in=baseline_rows, rows_out=len(df_merged))
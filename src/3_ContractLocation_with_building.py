@@ -8,162 +8,226 @@ Date: February 2026
 from shapely import wkt
 import geopandas as gpd
 import pandas as pd
-import os
+
+from buckets import bucket_path, list_buckets, map_buckets, read_bucket, read_bucket_table
+from incremental import dirty_contracts, plan_buckets, record_dirty, save_bucket, save_empty_bucket
+from prefilter import OccupancyGrid, read_buildings, wkt_points
+from schema import require_columns
+from settings import CONTRACT_BUILDING_MAX_DISTANCE_M
+from storage import sort_order
+from telemetry import Telemetry
 
 
 # Paths
-MERGED_PATH = "output/2b_out/out_contract_with_location.parquet"
+MERGED_PATH = "output/2b_out/out_contract_with_location"             # contract_ID hash buckets
 BUILDINGS_PATH = "data/capetown_buildings2.parquet"
-OUTPUT_PATH = "output/3_out/out_contractlocation_with_building.parquet"
+OUTPUT_PATH = "output/3_out/out_contractlocation_with_building"      # contract_ID hash buckets
 
-os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+# Set up
+NEAREST_MAX_DISTANCE_M = CONTRACT_BUILDING_MAX_DISTANCE_M   # unassigned contracts go to the nearest building within this distance
+# Margin around the contracts' bounding box when subsetting buildings (degrees, about twice
+# the search distance at Cape Town's latitude), so each contract finds the same nearest
+# building whatever other contracts share its bucket (or fast-run sample)
+BBOX_MARGIN_DEG = NEAREST_MAX_DISTANCE_M / 50_000
 
-#######################################
-# Load contract location+transactions data and filter WKT
-
-merged_df = pd.read_parquet(MERGED_PATH)
-
-# Total unique contracts before filtering
-total_unique_contracts_all = merged_df['contract_ID'].nunique()
-print(f"🔢 Total unique contracts (ALL, before WKT filter): {total_unique_contracts_all:,}")
-
-# Unique contracts by Type
-unique_contracts_by_type = (
-    merged_df.groupby("Type")["contract_ID"].nunique().reset_index(name="unique_contracts")
-)
-print("Unique contracts by Type:")
-print(unique_contracts_by_type.to_string(index=False))
-
-# Keep only rows with valid WKT
-merged_df = merged_df.loc[
-    merged_df["wkt"].notna() &
-    (merged_df["wkt"] != "") &
-    (merged_df["wkt"] != "<NA>") &
-    (merged_df["wkt"].str.len() > 10)
-]
-print(f"[Step 1] Rows with WKT: {len(merged_df):,}")
-
-# Count unique contracts with WKT by Type
-contracts_with_wkt_by_type = (
-    merged_df.groupby("Type")["contract_ID"].nunique().reset_index(name="contracts_with_wkt")
-)
-print("Unique contracts with WKT by Type:")
-print(contracts_with_wkt_by_type.to_string(index=False))
+# Columns this stage uses (all other panel columns are carried through unchanged)
+input_required = ["contract_ID", "Type", "wkt"]
+# Columns this stage adds: building index and Overture building id
+output_added = ["index__building", "id"]
 
-#######################################
-# Convert WKT to geometry
+# Contracts changed upstream (recorded by 2b); None = full run
+dirty = dirty_contracts(MERGED_PATH)
 
-merged_df["wkt"] = merged_df["wkt"].astype(str)
-merged_gdf = gpd.GeoDataFrame(
-    merged_df,
-    geometry=gpd.GeoSeries.from_wkt(merged_df["wkt"]),
-    crs="EPSG:4326"
-)
-print(f"✅ Geometry conversion successful. Rows remaining: {len(merged_gdf):,}")
+telemetry = Telemetry("3")
 
 #######################################
-# Load building data
+# Load building data (shared by all buckets): only buildings near a contract
 
-buildings_gdf = gpd.read_parquet(BUILDINGS_PATH)
-print(f"[Step 2] Loaded buildings_gdf with {len(buildings_gdf):,} rows")
+# Occupancy grid of the contract locations (cells within the search margin of one);
+# contract_ID is read for the dirty-contract filter of incremental runs
+contract_lon, contract_lat = wkt_points(pd.concat([
+    read_bucket_table(MERGED_PATH, b, columns=["contract_ID", "wkt"], contracts=dirty).column("wkt").unique().to_pandas()
+    for b in list_buckets(MERGED_PATH)
+]))
+grid = OccupancyGrid(contract_lon, contract_lat, BBOX_MARGIN_DEG)
+telemetry.lap("grid", rows_out=grid.n_points, share_occupied=round(grid.share_occupied, 4))
+
+buildings_gdf = read_buildings(BUILDINGS_PATH, grid)
+print(f"[Step 2] Loaded buildings_gdf with {len(buildings_gdf):,} rows near {grid.n_points:,} contract locations "
+      f"({grid.share_occupied:.0%} of the grid's cells)")
 
 # Ensure CRS match
-if buildings_gdf.crs != merged_gdf.crs:
-    buildings_gdf = buildings_gdf.to_crs(merged_gdf.crs)
-    print(f"[Step 3] Reprojected buildings_gdf to {merged_gdf.crs}")
+if buildings_gdf.crs != "EPSG:4326":
+    buildings_gdf = buildings_gdf.to_crs("EPSG:4326")
+    print("[Step 3] Reprojected buildings_gdf to EPSG:4326")
+telemetry.lap("load_buildings", rows_out=len(buildings_gdf))
 
 #######################################
-#  Spatial join: put contract in building
-
-# Filter buildings to bounding box
-minx, miny, maxx, maxy = merged_gdf.total_bounds
-buildings_subset = buildings_gdf.cx[minx:maxx, miny:maxy][['id', 'geometry']]
-
-joined_gdf = gpd.sjoin(
-    merged_gdf,
-    buildings_subset,
-    how="left",
-    predicate="within",
-    rsuffix="_building" #does this allow multiple household rows (bc diff tariffs) to match to a building
-)
-print(f"[Step 4] Spatial join complete — rows: {len(joined_gdf):,}")
-
-# Contracts without a building assigned
-contracts_unassigned = joined_gdf[joined_gdf['id'].isna()].copy()
-print(f"Contracts without a building assigned: {len(contracts_unassigned):,}")
+# Process one bucket of contracts
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Assign the contracts of one hash bucket to buildings and save the bucket. Returns counts."""
+    merged_df = read_bucket(MERGED_PATH, bucket, required=input_required, contracts=dirty)
+    # The joins below keep the rows in input order, so the bucket keeps 2b's sort order
+    order = sort_order(bucket_path(MERGED_PATH, bucket))
+    telemetry.lap("load", rows_out=len(merged_df))
+    stats = {
+        "contracts_all": merged_df['contract_ID'].nunique(),
+        "contracts_by_type": merged_df.groupby("Type", observed=True)["contract_ID"].nunique(),
+    }
+
+    # Keep only rows with valid WKT
+    merged_df = merged_df.loc[
+        merged_df["wkt"].notna() &
+        (merged_df["wkt"] != "") &
+        (merged_df["wkt"] != "<NA>") &
+        (merged_df["wkt"].str.len() > 10)
+    ]
+    stats["rows_with_wkt"] = len(merged_df)
+    stats["contracts_with_wkt_by_type"] = merged_df.groupby("Type", observed=True)["contract_ID"].nunique()
+
+    # No locations to join (e.g. an incremental run's bucket without any dirty contract)
+    if merged_df.empty:
+        save_empty_bucket(OUTPUT_PATH, bucket, dirty)
+        none = stats["contracts_with_wkt_by_type"]
+        return {**stats, "rows_joined": 0, "rows_unassigned": 0, "unmatched_contracts": 0,
+                "unmatched_by_type": none, "matched_by_type": none, "matched_contracts": 0}
+
+    #######################################
+    # Convert WKT to geometry
+
+    merged_df["wkt"] = merged_df["wkt"].astype(str)
+    merged_gdf = gpd.GeoDataFrame(
+        merged_df,
+        geometry=gpd.GeoSeries.from_wkt(merged_df["wkt"]),
+        crs="EPSG:4326"
+    )
+
+    #######################################
+    #  Spatial join: put contract in building
+
+    # Filter buildings to bounding box (plus the nearest-building search distance)
+    minx, miny, maxx, maxy = merged_gdf.total_bounds
+    buildings_subset = buildings_gdf.cx[minx - BBOX_MARGIN_DEG:maxx + BBOX_MARGIN_DEG,
+                                        miny - BBOX_MARGIN_DEG:maxy + BBOX_MARGIN_DEG][['id', 'geometry']]
+
+    joined_gdf = gpd.sjoin(
+        merged_gdf,
+        buildings_subset,
+        how="left",
+        predicate="within",
+        rsuffix="_building" #does this allow multiple household rows (bc diff tariffs) to match to a building
+    )
+    stats["rows_joined"] = len(joined_gdf)
+    telemetry.lap("join", rows_in=stats["rows_with_wkt"], rows_out=len(joined_gdf))
+
+    # Contracts without a building assigned
+    contracts_unassigned = joined_gdf[joined_gdf['id'].isna()].copy()
+    stats["rows_unassigned"] = len(contracts_unassigned)
+
+    #######################################
+    # Assign nearest building within NEAREST_MAX_DISTANCE_M for unassigned contracts
+
+    # Reproject for distance calculation
+    contracts_unassigned = contracts_unassigned.to_crs(32734)
+    buildings_subset = buildings_subset.to_crs(32734)
+
+    # Find nearest building
+    nearest = gpd.sjoin_nearest(
+        contracts_unassigned,
+        buildings_subset,
+        how='left',
+        distance_col='dist_m',
+        max_distance=NEAREST_MAX_DISTANCE_M
+    )
+
+    # Only assign where a nearest building exists
+    assigned_nearest = nearest[nearest["id_right"].notna()]
+    contracts_unassigned.loc[assigned_nearest.index, "id"] = assigned_nearest["id_right"]
+
+    telemetry.lap("nearest", rows_in=stats["rows_unassigned"], rows_out=len(assigned_nearest))
+
+    # Free memory
+    del nearest, assigned_nearest, buildings_subset
+
+    #######################################
+    # Step 4b: Update main dataframe and drop geometry
+
+    joined_df = joined_gdf.drop(columns="geometry").copy()
+    joined_df.update(contracts_unassigned)
+
+    # Free memory
+    del joined_gdf, contracts_unassigned, merged_gdf
+
+    #######################################
+    # Find remaining unmatched UNIQUE contracts
+
+    stats["unmatched_contracts"] = joined_df.loc[joined_df["id"].isna(), "contract_ID"].nunique()
+    stats["unmatched_by_type"] = (
+        joined_df.loc[joined_df["id"].isna()]
+        .groupby("Type", observed=True)["contract_ID"]
+        .nunique()
+    )
+
+    #######################################
+    # Keep only rows with assigned building
+
+    joined_df = joined_df[joined_df["id"].notna()]
+    stats["matched_by_type"] = joined_df.groupby('Type', observed=True)['contract_ID'].nunique()
+    stats["matched_contracts"] = joined_df['contract_ID'].nunique()
+
+    #######################################
+    # Save
+
+    require_columns(joined_df.columns, output_added, OUTPUT_PATH)
+    save_bucket(joined_df, OUTPUT_PATH, bucket, dirty, sorted_by=order)
+    telemetry.lap("save", rows_out=len(joined_df))
+    return stats
+
+
+def sum_by_type(results, key, name):
+    """Add up per-bucket counts by Type (contracts never span buckets, so sums are exact)."""
+    counts = pd.concat([r[key] for r in results]).groupby(level=0).sum()
+    return counts.rename(name).reset_index()
 
 #######################################
-# Assign nearest building within 100m for unassigned contracts
+# MAIN
 
-# Reproject for distance calculation
-contracts_unassigned = contracts_unassigned.to_crs(32734)
-buildings_subset = buildings_subset.to_crs(32734)
+if __name__ == "__main__":
+    buckets = plan_buckets(MERGED_PATH, OUTPUT_PATH, dirty)
+    print(f"Found {len(buckets)} contract buckets in {MERGED_PATH}")
 
-# Find nearest building
-nearest = gpd.sjoin_nearest(
-    contracts_unassigned,
-    buildings_subset,
-    how='left',
-    distance_col='dist_m',
-    max_distance=100
-)
+    results = map_buckets(process_bucket, buckets)
+    record_dirty(OUTPUT_PATH, dirty)
 
-# Only assign where a nearest building exists
-assigned_nearest = nearest[nearest["id_right"].notna()]
-contracts_unassigned.loc[assigned_nearest.index, "id"] = assigned_nearest["id_right"]
+    total_unique_contracts_all = sum(r["contracts_all"] for r in results)
+    print(f"🔢 Total unique contracts (ALL, before WKT filter): {total_unique_contracts_all:,}")
+    print("Unique contracts by Type:")
+    print(sum_by_type(results, "contracts_by_type", "unique_contracts").to_string(index=False))
 
-# Free memory
-del nearest, assigned_nearest, buildings_subset
+    print(f"[Step 1] Rows with WKT: {sum(r['rows_with_wkt'] for r in results):,}")
+    print("Unique contracts with WKT by Type:")
+    print(sum_by_type(results, "contracts_with_wkt_by_type", "contracts_with_wkt").to_string(index=False))
 
-#######################################
-# Step 4b: Update main dataframe and drop geometry
+    print(f"[Step 4] Spatial join complete — rows: {sum(r['rows_joined'] for r in results):,}")
+    print(f"Contracts without a building assigned: {sum(r['rows_unassigned'] for r in results):,}")
 
-joined_df = joined_gdf.drop(columns="geometry").copy()
-joined_df.update(contracts_unassigned)
+    print(f"Remaining unmatched UNIQUE contracts: {sum(r['unmatched_contracts'] for r in results):,}")
+    print("Remaining unmatched UNIQUE contracts by Type:")
+    print(sum_by_type(results, "unmatched_by_type", "unmatched_unique_contracts").to_string(index=False))
 
-# Free memory
-del joined_gdf, contracts_unassigned, merged_gdf, buildings_gdf
-
-#######################################
-# Find remaining unmatched UNIQUE contracts
+    print("Unique contracts (by Type) that merged with buildings:")
+    print(sum_by_type(results, "matched_by_type", "unique_contracts_merged").to_string(index=False))
 
-unmatched_unique_contracts = joined_df.loc[joined_df["id"].isna(), "contract_ID"].nunique()
-print(f"Remaining unmatched UNIQUE contracts: {unmatched_unique_contracts:,}")
+    #######################################
+    # Percent matched
 
-unmatched_by_type = (
-    joined_df.loc[joined_df["id"].isna()]
-    .groupby("Type")["contract_ID"]
-    .nunique()
-    .reset_index(name="unmatched_unique_contracts")
-)
-print("Remaining unmatched UNIQUE contracts by Type:")
-print(unmatched_by_type.to_string(index=False))
-
-#######################################
-# Keep only rows with assigned building
-
-joined_df = joined_df[joined_df["id"].notna()]
-
-# Unique contracts matched by Type
-type_counts_merged = (
-    joined_df.groupby('Type')['contract_ID']
-    .nunique()
-    .reset_index(name='unique_contracts_merged')
-)
-print("Unique contracts (by Type) that merged with buildings:")
-print(type_counts_merged.to_string(index=False))
-
-#######################################
-# Percent matched
-
-matched_unique_contracts = joined_df['contract_ID'].nunique()
-percent_matched = 100 * matched_unique_contracts / total_unique_contracts_all
-print(f"\n📊 Percent of ALL unique contracts matched with a building: {percent_matched:.2f}%")
-print(f"   🔹 Total unique contracts (ALL): {total_unique_contracts_all:,}")
-print(f"   🔹 Unique contracts matched: {matched_unique_contracts:,}")
-
-#######################################
-# Save
+    matched_unique_contracts = sum(r["matched_contracts"] for r in results)
+    percent_matched = 100 * matched_unique_contracts / max(total_unique_contracts_all, 1)
+    print(f"\n📊 Percent of ALL unique contracts matched with a building: {percent_matched:.2f}%")
+    print(f"   🔹 Total unique contracts (ALL): {total_unique_contracts_all:,}")
+    print(f"   🔹 Unique contracts matched: {matched_unique_contracts:,}")
 
-joined_df.to_parquet(output_path, engine="pyarrow", index=False)
-print(f"[Step 5] ✅ Saved merged data with building assignments to {output_path}")
+    print(f"[Step 5] ✅ Saved merged data with building assignments to {OUTPUT_PATH}")
+    telemetry.finish(buckets=len(buckets), matched_contracts=matched_unique_contracts)
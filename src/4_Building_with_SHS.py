@@ -6,13 +6,21 @@ Date: February 2026
 """
 import pandas as pd
 import geopandas as gpd
+import glob
+import hashlib
+import json
+import numpy as np
 import os
-import time
+
+from chunking import ChunkPlanner
+from prefilter import OccupancyGrid, read_buildings
+from settings import SHS_BUILDING_MAX_DISTANCE_M, SHS_MIN_AREA_M2
+from telemetry import Telemetry
 
 # Base directories
 DATA_DIR = "data" 
 BUILDINGS_DIR = "data"     
-OUTPUT_DIR = "output" 
+OUTPUT_DIR = "output/4_out"   # read by 5a
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
@@ -27,18 +35,16 @@ CSV_PATHS = {
 BUILDINGS_PATH = os.path.join(BUILDINGS_DIR, "capetown_buildings2.parquet")
 
 # Set up
-CHUNK_SIZE = 50_000
-LOG_FILE = os.path.join(OUTPUT_DIR, "merge_log.txt")
-
-#######################################
-# Logging helper
+# Chunk size is planned from the memory budget; a chunk is copied several times
+# (filter, points, sjoin, reprojection for the nearest-building fallback)
+CHUNK_WORKING_FACTOR = 8
+# Margin around a chunk's bounding box when subsetting buildings (degrees, about twice the
+# nearest-building distance at Cape Town's latitude)
+BBOX_MARGIN_DEG = SHS_BUILDING_MAX_DISTANCE_M / 50_000
 
-def log(msg):
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    full_msg = f"[{ts}] {msg}"
-    print(full_msg)
-    with open(LOG_FILE, "a") as f:
-        f.write(full_msg + "\n")
+# Messages and step measurements go to the pipeline telemetry (settings.TELEMETRY_FILE)
+telemetry = Telemetry("4")
+log = telemetry.log
 
 #######################################
 # Clean col names
@@ -53,16 +59,75 @@ def clean_columns(df):
     df.columns = new_cols
     return df
 
+#######################################
+# Checkpoints
+
+def run_key(csv_path):
+    """
+    Digest of what a year's chunks depend on: this script, the settings, and the
+    size and modification time of the year's CSV and the buildings file. A
+    checkpoint with another key belongs to a different run and is not resumed.
+    """
+    with open(__file__, "rb") as f:
+        code = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    inputs = {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in (csv_path, BUILDINGS_PATH)}
+    payload = {"code": code, "inputs": inputs,
+               "settings": {"SHS_MIN_AREA_M2": SHS_MIN_AREA_M2,
+                            "SHS_BUILDING_MAX_DISTANCE_M": SHS_BUILDING_MAX_DISTANCE_M}}
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+#######################################
+# GPS coordinates
+
+def gps_column(chunk):
+    """Name of the PV centroid column ("polygon_centroid_GPS..."), or None."""
+    return next((c for c in chunk.columns if "polygon_centroid_GPS" in c), None)
+
+
+def parse_gps(values):
+    """(lat, lon) numeric Series from "(lat, lon)" strings (NaN where invalid)."""
+    # Remove brackets/parentheses, strip spaces
+    coord_clean = values.str.replace(r"[\(\)\[\]]", "", regex=True).str.strip()
+
+    # Split on comma into two columns
+    gps = coord_clean.str.split(",", expand=True)
+    return pd.to_numeric(gps[0].str.strip(), errors="coerce"), pd.to_numeric(gps[1].str.strip(), errors="coerce")
+
+#######################################
+# Occupancy grid of the PV predictions kept below (every year), so only
+# buildings near a prediction are loaded
+
+log("Locating PV predictions...")
+grid_planner = ChunkPlanner("4 grid", working_factor=2)
+grid_lon, grid_lat = [], []
+for year, csv_path in CSV_PATHS.items():
+    for chunk in grid_planner.read_csv(
+        csv_path, low_memory=False,
+        usecols=lambda c: c in ("label", "area_m2") or "polygon_centroid_GPS" in c,
+    ):
+        chunk = chunk[chunk["label"] == "PV_normal"]
+        if "area_m2" in chunk.columns:
+            chunk = chunk[chunk["area_m2"] >= SHS_MIN_AREA_M2]
+        if gps_column(chunk) and len(chunk):
+            lat, lon = parse_gps(chunk[gps_column(chunk)])
+            grid_lat.append(lat.to_numpy(dtype=float))
+            grid_lon.append(lon.to_numpy(dtype=float))
+grid = OccupancyGrid(np.concatenate(grid_lon or [[]]), np.concatenate(grid_lat or [[]]), BBOX_MARGIN_DEG)
+telemetry.lap("grid", rows_out=grid.n_points, share_occupied=round(grid.share_occupied, 4))
+
 #######################################
 # Load buildings
 
 log("Loading building polygons...")
-start = time.time()
-buildings_gdf = gpd.read_parquet(BUILDINGS_PATH)
+buildings_gdf = read_buildings(BUILDINGS_PATH, grid)
 if buildings_gdf.crs != "EPSG:4326":
     buildings_gdf = buildings_gdf.to_crs("EPSG:4326")
 _ = buildings_gdf.sindex  # build spatial index
-log(f"Loaded {len(buildings_gdf):,} polygons in {time.time() - start:.1f}s")
+record = telemetry.lap("load_buildings", rows_out=len(buildings_gdf))
+log(f"Loaded {len(buildings_gdf):,} polygons near {grid.n_points:,} PV predictions in {record['wall_s']:.1f}s")
+
+# Made after loading the buildings, so their memory is not counted as free for chunks
+planner = ChunkPlanner("4", working_factor=CHUNK_WORKING_FACTOR)
 
 #######################################
 # MAIN
@@ -70,21 +135,39 @@ log(f"Loaded {len(buildings_gdf):,} polygons in {time.time() - start:.1f}s")
 for year, csv_path in CSV_PATHS.items():
     log(f"\n--- Starting year {year} ---")
 
+    # Checkpoint: a line "key=<run_key>", then a line "chunk,first_row,rows" per saved chunk.
+    # Chunk sizes follow the memory budget, so a resumed year continues after the last CSV
+    # row done. Only an interrupted run with the same key is resumed.
     checkpoint_file = os.path.join(OUTPUT_DIR, f"{year}_done_chunks.txt")
-    done_chunks = set()
+    key = run_key(csv_path)
+    done_chunks = []
     if os.path.exists(checkpoint_file):
         with open(checkpoint_file) as f:
-            done_chunks = set(int(line.strip()) for line in f if line.strip().isdigit())
+            lines = f.read().splitlines()
+        if lines and lines[0] == f"key={key}":
+            done_chunks = [tuple(map(int, line.split(","))) for line in lines[1:] if line.count(",") == 2]
+    if done_chunks:
         log(f"Resuming — {len(done_chunks)} chunks already completed.")
+    else:
+        # Starting the year over: drop the chunks of an earlier or interrupted run (other
+        # inputs, settings or code, or an older checkpoint format)
+        for old_file in glob.glob(os.path.join(OUTPUT_DIR, f"{year}_chunk*.parquet")) + [checkpoint_file]:
+            if os.path.exists(old_file):
+                os.remove(old_file)
+        with open(checkpoint_file, "w") as f:
+            f.write(f"key={key}\n")
+    first_chunk = max((c for c, _, _ in done_chunks), default=0) + 1
+    next_row = max((first + rows for _, first, rows in done_chunks), default=0)
 
     # Year-level counters
     total_start_pv = total_dropped_area = total_dropped_nomatch = total_matched = 0
 
-    for i, chunk in enumerate(pd.read_csv(csv_path, chunksize=CHUNK_SIZE, low_memory=False), start=1):
-        if i in done_chunks:
-            log(f"Skipping chunk {i} (already done).")
-            continue
+    chunks = planner.read_csv(csv_path, skip_rows=next_row, low_memory=False)
+    for i, chunk in enumerate(chunks, start=first_chunk):
+        first_row, next_row = next_row, next_row + len(chunk)
 
+        telemetry.context = {"year": year, "chunk": i}
+        telemetry.lap("read", rows_out=len(chunk))
         log(f"Processing chunk {i} ({len(chunk):,} rows)...")
 
         # Filter only PV_normal
@@ -93,13 +176,13 @@ for year, csv_path in CSV_PATHS.items():
         total_start_pv += start_pv
         log(f"Initial PV_normal rows: {start_pv:,}")
 
-        # Drop small area_m2 < 1.7
+        # Drop small area_m2 < SHS_MIN_AREA_M2
         if "area_m2" in chunk.columns:
             before_area = len(chunk)
-            chunk = chunk[chunk["area_m2"] >= 1.7]
+            chunk = chunk[chunk["area_m2"] >= SHS_MIN_AREA_M2]
             dropped_area = before_area - len(chunk)
             total_dropped_area += dropped_area
-            log(f"Dropped {dropped_area:,} rows (area_m2 < 1.7). Remaining: {len(chunk):,}")
+            log(f"Dropped {dropped_area:,} rows (area_m2 < {SHS_MIN_AREA_M2:g}). Remaining: {len(chunk):,}")
         else:
             log("No 'area_m2' column found — skipping area filter.")
 
@@ -107,21 +190,13 @@ for year, csv_path in CSV_PATHS.items():
             log(f"Chunk {i}: No PV_normal rows left after filtering, skipping.")
             continue
 
-        gps_cols = [c for c in chunk.columns if "polygon_centroid_GPS" in c]
-        if gps_cols:
-            gps_col = gps_cols[0]
-        else:
+        gps_col = gps_column(chunk)
+        if gps_col is None:
             log(f"ERROR: Missing GPS column for {year}, chunk {i}")
             continue
 
-        # Remove brackets/parentheses, strip spaces
-        coord_clean = chunk[gps_col].str.replace(r"[\(\)\[\]]", "", regex=True).str.strip()
-
-        # Split on comma into two columns
-        gps = coord_clean.str.split(",", expand=True)
         chunk = chunk.copy()
-        chunk["lat"] = pd.to_numeric(gps[0].str.strip(), errors="coerce")
-        chunk["lon"] = pd.to_numeric(gps[1].str.strip(), errors="coerce")
+        chunk["lat"], chunk["lon"] = parse_gps(chunk[gps_col])
 
         # Drop rows with invalid coordinates
         chunk = chunk.dropna(subset=["lat", "lon"])
@@ -135,22 +210,22 @@ for year, csv_path in CSV_PATHS.items():
             geometry=gpd.points_from_xy(chunk["lon"], chunk["lat"]),
             crs="EPSG:4326"
         )
+        telemetry.lap("filter", rows_in=start_pv, rows_out=len(gdf))
 
-
-        # Subset buildings for speed
+        # Subset buildings for speed (plus the nearest-building search distance)
         minx, miny, maxx, maxy = gdf.total_bounds
-        b_subset = buildings_gdf.cx[minx:maxx, miny:maxy]
+        b_subset = buildings_gdf.cx[minx - BBOX_MARGIN_DEG:maxx + BBOX_MARGIN_DEG,
+                                    miny - BBOX_MARGIN_DEG:maxy + BBOX_MARGIN_DEG]
         log(f"Spatial join subset: {len(b_subset):,} buildings")
 
         if b_subset.empty:
             log(f"No buildings in spatial subset for chunk {i}, skipping.")
             continue
 
-        # Spatial join
-        start_join = time.time()
-        merged = gpd.sjoin(gdf, b_subset, how="left", predicate="within")
-        join_time = time.time() - start_join
-        log(f"Join done in {join_time:.1f}s — {len(merged):,} rows")
+        # Spatial join (building geometry only, so the prediction columns keep their names)
+        merged = gpd.sjoin(gdf, b_subset[["geometry"]], how="left", predicate="within")
+        join = telemetry.lap("join", rows_in=len(gdf), rows_out=len(merged))
+        log(f"Join done in {join['wall_s']:.1f}s — {len(merged):,} rows")
 
         matched_rows = merged["index_right"].notna().sum()
         total_rows = len(merged)
@@ -193,7 +268,7 @@ for year, csv_path in CSV_PATHS.items():
                     distance_col='dist_m'
                 )
 
-                max_distance = 100
+                max_distance = SHS_BUILDING_MAX_DISTANCE_M
                 nearest_within = nearest[nearest['dist_m'] <= max_distance].copy()
                 merged.loc[nearest_within.index, 'index_right'] = nearest_within['building_index']
 
@@ -208,27 +283,29 @@ for year, csv_path in CSV_PATHS.items():
 
                 # Update 'merged'
                 merged.loc[nearest_within.index, 'index_right'] = nearest_within['building_index']
+                telemetry.lap("nearest", rows_in=len(unmatched), rows_out=len(nearest_within))
 
-                # Continue processing
-                merged["year"] = year
-                merged = clean_columns(merged)
-
+        # Continue processing
+        merged["year"] = year
+        merged = clean_columns(merged)
 
         # Save
         chunk_parquet = os.path.join(OUTPUT_DIR, f"{year}_chunk{i}.parquet")
         merged.to_parquet(chunk_parquet)
         log(f"Saved chunk {i} → {chunk_parquet}")
+        telemetry.lap("save", rows_out=len(merged), matched=int(matched_rows))
 
         with open(checkpoint_file, "a") as f:
-            f.write(f"{i}\n")
+            f.write(f"{i},{first_row},{next_row - first_row}\n")
 
         del gdf, merged, b_subset
 
     # Yearly summary
+    telemetry.context = {"year": year}
     total_remaining = total_matched
     log(f"\n=== YEAR {year} SUMMARY ===")
     log(f"Total starting PV_normal rows: {total_start_pv:,}")
-    log(f"Total dropped (area < 1.7): {total_dropped_area:,}")
+    log(f"Total dropped (area < {SHS_MIN_AREA_M2:g}): {total_dropped_area:,}")
     log(f"Total dropped (no building match): {total_dropped_nomatch:,}")
     log(f"Total remaining matched: {total_remaining:,}")
     # Avoid division by zero
@@ -238,6 +315,9 @@ for year, csv_path in CSV_PATHS.items():
         log("Retention rate: N/A (total_start_pv is zero)")
     else:
         log(f"Retention rate: {retention_rate:.2f}%")
-    log("=============================\n")
+    log("=============================\n", start_pv=total_start_pv, dropped_area=total_dropped_area,
+        dropped_no_match=total_dropped_nomatch, matched=total_remaining)
+    telemetry.context = {}
 
 log("All years processed successfully.")
+telemetry.finish()
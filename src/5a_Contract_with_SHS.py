@@ -8,45 +8,37 @@ Date: February 2026
 import os
 import glob
 import duckdb
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+from buckets import bucket_path, map_buckets, read_bucket_table
+from incremental import dirty_contracts, plan_buckets, record_dirty, save_bucket
+from interchange import duckdb_arrow
+from months import BASE_YEAR
+from schema import require_columns
+from storage import sort_order
+from telemetry import Telemetry
 
 # Base directories
-DATA_DIR = "data"           
+DATA_DIR = "data"
 BUILD_SHS_DIR = "output/4_out"
-CONTRACT_BUILD_FILE = "output/3_out/out_contractlocation_with_building.parquet"
-OUTPUT_DIR = "output/5a_out"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+CONTRACT_BUILD_DIR = "output/3_out/out_contractlocation_with_building"   # contract_ID hash buckets
+OUTPUT_DIR = "output/5a_out/merged_contract_SHS"                        # contract_ID hash buckets
 
 # Set up
 YEARS = [2020, 2021, 2022, 2023]
 
-#######################################
-# Load contract data
-
-print(f"Loading contract_build: {CONTRACT_BUILD_FILE}")
-contract_build = pd.read_parquet(CONTRACT_BUILD_FILE)
+# Columns this stage uses (all other panel columns are carried through unchanged)
+input_required = ["contract_account_hashed", "month_idx"]
+# Columns this stage adds
+output_added = ["year", "month", "shs_id", "shs_image_id", "shs_prediction_id",
+                "shs_label", "shs_area_m2", "shs_gps", "matched"]
 
-# Make sure 'building_id' column exists
-if 'index__building' in contract_build.columns:
-    contract_build = contract_build.rename(columns={'index__building': 'building_id'})
-elif 'building_id' not in contract_build.columns:
-    raise ValueError("Contract_build does not have 'index__building' or 'building_id' column!")
+# Contracts changed upstream (recorded by 3); None = full run
+dirty = dirty_contracts(CONTRACT_BUILD_DIR)
 
-# Filter out contracts with missing building_id (cannot match SHS)
-contract_build = contract_build[contract_build['building_id'].notna()]
-
-# Extract year and month
-contract_build["year"] = contract_build["month_year"].dt.year
-contract_build["month"] = contract_build["month_year"].dt.month
-
-# Diagnostics
-print(f"Total rows in contract_build: {len(contract_build):,}")
-print(f"Unique contracts: {contract_build['contract_account_hashed'].nunique():,}")
-print(f"Unique buildings: {contract_build['building_id'].nunique():,}")
-
-# Save temporary parquet for DuckDB
-TEMP_CONTRACT_PARQUET = "/tmp/contract_build_temp.parquet"
-contract_build.to_parquet(TEMP_CONTRACT_PARQUET, index=False)
+telemetry = Telemetry("5a")
 
 #######################################
 # Find SHS data
@@ -56,84 +48,113 @@ all_shs_files.sort()
 print(f"Found {len(all_shs_files)} SHS parquet files total")
 
 #######################################
-# Process per year
+# Load SHS and deduplicate per building and year (largest area)
 
+shs_selects = []
 for year in YEARS:
-    print(f"\n Processing year {year}")
-    output_file = os.path.join(OUTPUT_DIR, f"merged_contract_SHS_{year}.parquet")
-    if os.path.exists(output_file):
-        os.remove(output_file)
-
-    con = duckdb.connect(database=":memory:")
-
-    # Load contract_build for this year
-    con.execute(f"""
-        CREATE TABLE contract_build AS
-        SELECT *
-        FROM read_parquet('{TEMP_CONTRACT_PARQUET}')
-        WHERE year = {year}
-    """)
-
-    # Contract diagnostics per year
-    result_contract = con.execute("""
-        SELECT COUNT(*) AS total_rows,
-               COUNT(DISTINCT building_id) AS unique_buildings,
-               COUNT(DISTINCT contract_account_hashed) AS unique_contracts
-        FROM contract_build
-    """).fetchdf()
-    print(f"Contract rows for {year}: {result_contract['total_rows'][0]:,}")
-    print(f"Unique buildings: {result_contract['unique_buildings'][0]:,}")
-    print(f"Unique contracts: {result_contract['unique_contracts'][0]:,}")
-
-    # Filter SHS files for this year
     year_shs_files = [f for f in all_shs_files if f"{year}_" in os.path.basename(f)]
     if not year_shs_files:
-        print(f"No SHS files found for year {year}. Saving contract_build as-is.")
-        con.execute(f"COPY contract_build TO '{output_file}' (FORMAT PARQUET)")
-        con.close()
+        print(f"No SHS files found for year {year}. Contracts keep no SHS match.")
         continue
-
     print(f"SHS files for {year}: {len(year_shs_files)}")
     year_pattern = os.path.join(BUILD_SHS_DIR, f"{year}_*.parquet")
-
-    # Load SHS and deduplicate per building (largest area)
-    con.execute(f"""
-        CREATE TABLE shs_raw AS
-        SELECT 
+    shs_selects.append(f"""
+        SELECT
             id AS shs_id,
             image_id AS shs_image_id,
             prediction_id AS shs_prediction_id,
             label AS shs_label,
             area_m2 AS shs_area_m2,
             polygon_centroid_GPS_lat_lon_ AS shs_gps,
-            index_right AS building_id
+            index_right AS building_id,
+            {year} AS year
         FROM read_parquet('{year_pattern}')
         WHERE index_right IS NOT NULL
     """)
 
+con = duckdb.connect(database=":memory:")
+if shs_selects:
+    con.execute(f"CREATE TABLE shs_raw AS {' UNION ALL '.join(shs_selects)}")
+else:
     con.execute("""
-        CREATE TABLE shs AS
-        SELECT *
-        FROM (
-            SELECT *,
-                   ROW_NUMBER() OVER (PARTITION BY building_id ORDER BY shs_area_m2 DESC) AS rn
-            FROM shs_raw
-        ) WHERE rn = 1
+        CREATE TABLE shs_raw (shs_id VARCHAR, shs_image_id VARCHAR, shs_prediction_id VARCHAR,
+                              shs_label VARCHAR, shs_area_m2 DOUBLE, shs_gps VARCHAR,
+                              building_id DOUBLE, year INTEGER)
     """)
 
-    # Diagnostics
-    result_shs = con.execute("""
-        SELECT COUNT(*) AS total_rows,
-               COUNT(DISTINCT building_id) AS unique_buildings
-        FROM shs
-    """).fetchdf()
-    print(f"SHS rows: {result_shs['total_rows'][0]:,}")
-    print(f"Unique buildings in SHS: {result_shs['unique_buildings'][0]:,}")
+con.execute("""
+    CREATE TABLE shs AS
+    SELECT *
+    FROM (
+        SELECT *,
+               ROW_NUMBER() OVER (PARTITION BY year, building_id ORDER BY shs_area_m2 DESC) AS rn
+        FROM shs_raw
+    ) WHERE rn = 1
+""")
+
+# Diagnostics
+result_shs = con.execute("""
+    SELECT year,
+           COUNT(*) AS total_rows,
+           COUNT(DISTINCT building_id) AS unique_buildings
+    FROM shs
+    GROUP BY year
+    ORDER BY year
+""").fetchdf()
+print("SHS rows and unique buildings per year:")
+print(result_shs.to_string(index=False))
+
+# Arrow table: DuckDB scans it in every bucket without a pandas round trip
+shs_table = duckdb_arrow(con, "SELECT * EXCLUDE (rn) FROM shs")
+con.close()
+telemetry.lap("load_shs", rows_out=shs_table.num_rows)
+
+#######################################
+# Process one bucket of contracts
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """LEFT JOIN one contract bucket with the SHS table on building and year. Returns per-year counts."""
+    # Read as Arrow: DuckDB scans the table in place (no pandas conversion)
+    contract_table = read_bucket_table(CONTRACT_BUILD_DIR, bucket, required=input_required, contracts=dirty)
+    telemetry.lap("load", rows_out=contract_table.num_rows)
+
+    # Make sure 'building_id' column exists
+    if 'index__building' in contract_table.column_names:
+        contract_table = contract_table.rename_columns(
+            ['building_id' if c == 'index__building' else c for c in contract_table.column_names]
+        )
+    elif 'building_id' not in contract_table.column_names:
+        raise ValueError("Contract_build does not have 'index__building' or 'building_id' column!")
+
+    # The join does not keep row order: number the rows of a sorted input so the
+    # output can be put back in its order (one integer sort, instead of a sort in 5b and 5c)
+    order = sort_order(bucket_path(CONTRACT_BUILD_DIR, bucket))
+    if order:
+        contract_table = contract_table.append_column(
+            "_input_row", pa.array(np.arange(contract_table.num_rows, dtype=np.int64)))
+
+    con = duckdb.connect(database=":memory:")
+    con.register("contract_table", contract_table)
+    con.register("shs", shs_table)
+
+    # Extract year and month from the month index; drop contracts with missing
+    # building_id (cannot match SHS) and years without SHS data
+    con.execute(f"""
+        CREATE VIEW contract_build AS
+        SELECT * FROM (
+            SELECT *,
+                   CAST({BASE_YEAR} + month_idx // 12 AS INTEGER) AS year,
+                   CAST(month_idx % 12 + 1 AS INTEGER) AS month
+            FROM contract_table
+            WHERE building_id IS NOT NULL
+        ) WHERE year IN ({', '.join(str(y) for y in YEARS)})
+    """)
 
     # LEFT JOIN contract_build and SHS on building_id
     con.execute("""
         CREATE TABLE merged AS
-        SELECT 
+        SELECT
             c.*,
             s.shs_id,
             s.shs_image_id,
@@ -144,37 +165,54 @@ for year in YEARS:
             CASE WHEN s.shs_id IS NOT NULL THEN 1 ELSE 0 END AS matched
         FROM contract_build c
         LEFT JOIN shs s
-        ON c.building_id = s.building_id
+        ON c.building_id = s.building_id AND c.year = s.year
     """)
 
-    # Check merged table columns
-    cols = con.execute("PRAGMA table_info(merged)").fetchdf()
-    print(cols[['name', 'type']])
-
-    # Count unique contracts matched/unmatched
+    # Count rows and unique contracts matched/unmatched per year
     result = con.execute("""
-        SELECT 
+        SELECT
+            year,
+            COUNT(*) AS total_rows,
             COUNT(DISTINCT contract_account_hashed) AS total_unique_contracts,
             COUNT(DISTINCT CASE WHEN matched = 1 THEN contract_account_hashed END) AS matched_unique_contracts,
             COUNT(DISTINCT CASE WHEN matched = 0 THEN contract_account_hashed END) AS unmatched_unique_contracts
         FROM merged
+        GROUP BY year
     """).fetchdf()
-
-    total_unique_contracts = int(result['total_unique_contracts'][0])
-    matched_unique_contracts = int(result['matched_unique_contracts'][0])
-    unmatched_unique_contracts = int(result['unmatched_unique_contracts'][0])
-    match_pct = 100 * matched_unique_contracts / total_unique_contracts if total_unique_contracts else 0
+    telemetry.lap("join", rows_in=contract_table.num_rows, rows_out=int(result["total_rows"].sum()))
 
     # Save
-    con.execute(f"COPY merged TO '{output_file}' (FORMAT PARQUET)")
-
-    print(f"\n Year {year} summary (unique contracts):")
-    print(f"   🔹 Total unique contracts: {total_unique_contracts:,}")
-    print(f"   🔹 Matched unique contracts: {matched_unique_contracts:,}")
-    print(f"   🔹 Unmatched unique contracts: {unmatched_unique_contracts:,}")
-    print(f"   🔹 Percent matched: {match_pct:.2f}%")
-    print("----------------------------------------------------\n")
-
+    require_columns([c[0] for c in con.execute("DESCRIBE merged").fetchall()], output_added, OUTPUT_DIR)
+    query = "SELECT * EXCLUDE (_input_row) FROM merged ORDER BY _input_row" if order else "SELECT * FROM merged"
+    save_bucket(duckdb_arrow(con, query), OUTPUT_DIR, bucket, dirty, sorted_by=order)
     con.close()
+    telemetry.lap("save", rows_out=int(result["total_rows"].sum()))
+    return result
 
-print("All years processed successfully.")
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    buckets = plan_buckets(CONTRACT_BUILD_DIR, OUTPUT_DIR, dirty)
+    print(f"Found {len(buckets)} contract buckets in {CONTRACT_BUILD_DIR}")
+
+    # Contracts never span buckets, so per-bucket counts add up exactly
+    summary = pd.concat(map_buckets(process_bucket, buckets)).groupby("year").sum()
+    record_dirty(OUTPUT_DIR, dirty)
+
+    for year, row in summary.iterrows():
+        total_unique_contracts = int(row['total_unique_contracts'])
+        matched_unique_contracts = int(row['matched_unique_contracts'])
+        unmatched_unique_contracts = int(row['unmatched_unique_contracts'])
+        match_pct = 100 * matched_unique_contracts / total_unique_contracts if total_unique_contracts else 0
+
+        print(f"\n Year {year} summary (unique contracts):")
+        print(f"   🔹 Contract rows: {int(row['total_rows']):,}")
+        print(f"   🔹 Total unique contracts: {total_unique_contracts:,}")
+        print(f"   🔹 Matched unique contracts: {matched_unique_contracts:,}")
+        print(f"   🔹 Unmatched unique contracts: {unmatched_unique_contracts:,}")
+        print(f"   🔹 Percent matched: {match_pct:.2f}%")
+        print("----------------------------------------------------\n")
+
+    print("All years processed successfully.")
+    telemetry.finish(rows_out=int(summary["total_rows"].sum()), buckets=len(buckets))
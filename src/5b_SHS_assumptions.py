@@ -6,88 +6,47 @@ Date: February 2026
 """
 
 import pandas as pd
-import glob
-import os
 import numpy as np
 
+from buckets import PANEL_ORDER, bucket_path, map_buckets, read_bucket
+from incremental import dirty_contracts, plan_buckets, record_dirty, save_bucket, save_empty_bucket
+from months import month_parts
+from schema import select_columns
+from settings import SHS_YEAR_RULES
+from storage import is_sorted_by
+from telemetry import Telemetry
+
 # Paths
-parquet_dir = "output/5a_out"
-parquet_out = "output/5b_out"
-
-# Find all parquet files
-parquet_files = glob.glob(os.path.join(parquet_dir, "*.parquet"))
-print(f"Found {len(parquet_files)} parquet files")
-
-# Read and combine
-dfs = []
-for f in parquet_files:
-    print(f"🔹 Loading {os.path.basename(f)} ...")
-    df = pd.read_parquet(f)
-    print(f"   → {len(df):,} rows, {len(df.columns)} columns")
-    dfs.append(df)
-
-if dfs:
-    combined_df = pd.concat(dfs, ignore_index=True)
-    print(f"\n✅ Combined DataFrame: {len(combined_df):,} total rows, {len(combined_df.columns)} columns")
-else:
-    raise ValueError("No Parquet files found in the directory.")
-
-# Clean wkt
-combined_df = combined_df.loc[
-    combined_df["wkt"].notna() &
-    (combined_df["wkt"] != "") &
-    (combined_df["wkt"] != "<NA>") &
-    (combined_df["wkt"].str.len() > 10)
-]
-
-# Unique contracts
-if "contract_ID" in combined_df.columns:
-    unique_contracts = combined_df["contract_ID"].nunique()
-    print(f"Total unique contracts: {unique_contracts:,}")
-if "Type" in combined_df.columns:
-    unique_by_type = combined_df.groupby("Type")["contract_ID"].nunique().reset_index()
-    print("\n Unique contracts by Type:")
-    for _, row in unique_by_type.iterrows():
-        print(f"   {row['Type']}: {row['contract_ID']:,}")
+parquet_dir = "output/5a_out/merged_contract_SHS"   # contract_ID hash buckets
+parquet_out = "output/5b_out/combined"              # contract_ID hash buckets
 
-# Ensure datetime and extract year
-combined_df['month_year'] = pd.to_datetime(combined_df['month_year'], errors='coerce')
-combined_df['year'] = combined_df['month_year'].dt.year
+# Columns read from 5a: the ones used here plus the ones 5c keeps
+input_columns = ['contract_ID', 'contract_account_hashed', 'contract_hashed', 'Type', 'month_idx',
+                 'trfname', 'rate_category', 'kwh', 'wkt', 'building_id', 'month',
+                 'shs_label', 'shs_area_m2', 'shs_gps', 'matched']
+output_columns = input_columns + ['year', 'has_shs', 'shs_source', 'shs_label_edit',
+                                  'shs_area_m2_edit', 'shs_imputed']
 
-#######################################
-# Collapse to contract-year
-
-shs_years = (
-    combined_df
-    .groupby(['contract_ID', 'year'], as_index=False)
-    .agg(
-        has_shs=('shs_label', lambda x: (x == "PV_normal").any()),
-        shs_area_m2=('shs_area_m2', 'first'),  # make sure column exists
-        shs_label=('shs_label', 'first')
-    )
-)
+# Year rules of fix_shs_years (settings.SHS_YEAR_RULES picks which apply)
+YEAR_RULES = ["drop_isolated", "fill_gaps", "forward_extend"]
+unknown_rules = set(SHS_YEAR_RULES) - set(YEAR_RULES)
+if unknown_rules:
+    raise ValueError(f"Unknown SHS year rules {sorted(unknown_rules)} (known: {YEAR_RULES})")
 
-#######################################
-# Create source flag (observed)
-# -----------------------------
-shs_years['shs_source'] = np.where(
-    shs_years['has_shs'],
-    'observed',
-    pd.NA
-)
+# Contracts changed upstream (recorded by 5a); None = full run
+dirty = dirty_contracts(parquet_dir)
 
-# Keep a copy of original state
-shs_years['has_shs_original'] = shs_years['has_shs']
+telemetry = Telemetry("5b")
 
 #######################################
 # Define function to implement SHS assumptions
 
-def fix_shs_years(df):
+def fix_shs_years(df, rules=SHS_YEAR_RULES):
     # years where SHS was observed
     observed_years = set(df.loc[df['shs_source'] == 'observed', 'year'])
 
     # RULE 1: DELETE single isolated year (except 2023)
-    if len(observed_years) == 1:
+    if len(observed_years) == 1 and "drop_isolated" in rules:
         only_year = next(iter(observed_years))
         if only_year != 2023:
             df[['has_shs', 'shs_area_m2', 'shs_label', 'shs_source']] = [False, np.nan, np.nan, pd.NA]
@@ -96,7 +55,7 @@ def fix_shs_years(df):
             return df
 
     # RULE 2: Fill gaps between observed years
-    if observed_years:
+    if observed_years and "fill_gaps" in rules:
         min_y, max_y = min(observed_years), max(observed_years)
         for y in range(min_y, max_y + 1):
             if y not in observed_years:
@@ -104,98 +63,185 @@ def fix_shs_years(df):
                 df.loc[df['year'] == y, 'shs_source'] = 'gap_filled'
 
     # RULE 3: Forward-extend into 2023
-    if 2023 not in observed_years and any(y in observed_years for y in [2020, 2021, 2022]):
+    if "forward_extend" in rules and 2023 not in observed_years and any(y in observed_years for y in [2020, 2021, 2022]):
         df.loc[df['year'] == 2023, 'has_shs'] = True
         df.loc[df['year'] == 2023, 'shs_source'] = 'forward_extended'
 
     return df
 
 #######################################
-# Apply function at contract level
+# Process one bucket of contracts
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Apply the SHS assumptions to one hash bucket of contracts and save it. Returns counts."""
+    combined_df = read_bucket(parquet_dir, bucket, columns=input_columns, contracts=dirty)
+    stats = {"rows_loaded": len(combined_df)}
+    telemetry.lap("load", rows_out=len(combined_df))
+
+    # Clean wkt
+    combined_df = combined_df.loc[
+        combined_df["wkt"].notna() &
+        (combined_df["wkt"] != "") &
+        (combined_df["wkt"] != "<NA>") &
+        (combined_df["wkt"].str.len() > 10)
+    ]
+
+    # Unique contracts
+    stats["unique_contracts"] = combined_df["contract_ID"].nunique()
+    stats["unique_by_type"] = combined_df.groupby("Type", observed=True)["contract_ID"].nunique()
+
+    # An incremental run can plan a bucket that holds none of the dirty contracts
+    if combined_df.empty:
+        save_empty_bucket(parquet_out, bucket, dirty)
+        empty = pd.Series(dtype="int64")
+        return {**stats, "contracts_by_year_source": empty, "contracts_per_year": empty,
+                "pv_contracts_per_year": empty, "months_per_contract": empty}
+
+    # Extract year from the month index
+    combined_df['year'] = month_parts(combined_df['month_idx'])[0]
+
+    #######################################
+    # Collapse to contract-year
+
+    shs_years = (
+        combined_df
+        .groupby(['contract_ID', 'year'], as_index=False)
+        .agg(
+            has_shs=('shs_label', lambda x: (x == "PV_normal").any()),
+            shs_area_m2=('shs_area_m2', 'first'),  # make sure column exists
+            shs_label=('shs_label', 'first')
+        )
+    )
+
+    #######################################
+    # Create source flag (observed)
+    # -----------------------------
+    shs_years['shs_source'] = np.where(
+        shs_years['has_shs'],
+        'observed',
+        pd.NA
+    )
 
-shs_years = (
-    shs_years
-    .groupby('contract_ID', group_keys=False)
-    .apply(fix_shs_years) 
-)
+    # Keep a copy of original state
+    shs_years['has_shs_original'] = shs_years['has_shs']
 
-#######################################
-# Merge back into monthly data
+    #######################################
+    # Apply function at contract level
+    # (select every column explicitly: pandas 3 drops the grouping column from apply's groups)
 
-combined_df = combined_df.drop(columns=['shs_area_m2', 'shs_label'], errors='ignore')
+    shs_years = (
+        shs_years
+        .groupby('contract_ID', group_keys=False)[shs_years.columns.tolist()]
+        .apply(fix_shs_years)
+    )
+    telemetry.lap("fix_years", rows_out=len(shs_years))
 
-combined_df = combined_df.merge(
-    shs_years[['contract_ID', 'year', 'has_shs', 'shs_area_m2', 'shs_label', 'shs_source']],
-    on=['contract_ID', 'year'],
-    how='left'
-)
+    #######################################
+    # Merge back into monthly data
 
-combined_df['shs_label_edit'] = combined_df['shs_label']
-combined_df['shs_area_m2_edit'] = combined_df['shs_area_m2']
+    combined_df = combined_df.drop(columns=['shs_area_m2', 'shs_label'], errors='ignore')
 
-#######################################
-# Remove SHS info where SHS doesn't exist
+    combined_df = combined_df.merge(
+        shs_years[['contract_ID', 'year', 'has_shs', 'shs_area_m2', 'shs_label', 'shs_source']],
+        on=['contract_ID', 'year'],
+        how='left'
+    )
 
-combined_df.loc[~combined_df['has_shs'], ['shs_label_edit', 'shs_area_m2_edit']] = np.nan
+    combined_df['shs_label_edit'] = combined_df['shs_label']
+    combined_df['shs_area_m2_edit'] = combined_df['shs_area_m2']
 
-#######################################
-# Forward-fill SHS attributes within contract
+    #######################################
+    # Remove SHS info where SHS doesn't exist
 
-combined_df = combined_df.sort_values(['contract_ID', 'month_year'])
-combined_df[['shs_label_edit', 'shs_area_m2_edit']] = (
-    combined_df
-    .groupby('contract_ID')[['shs_label_edit', 'shs_area_m2_edit']]
-    .ffill()
-)
+    combined_df.loc[~combined_df['has_shs'], ['shs_label_edit', 'shs_area_m2_edit']] = np.nan
 
-#######################################
-# Create binary imputed flag (imputed)
+    #######################################
+    # Forward-fill SHS attributes within contract
+    # (the left merge keeps the input's row order, so a sorted input needs no sort)
+
+    if not is_sorted_by(bucket_path(parquet_dir, bucket), PANEL_ORDER):
+        combined_df = combined_df.sort_values(PANEL_ORDER)
+    combined_df[['shs_label_edit', 'shs_area_m2_edit']] = (
+        combined_df
+        .groupby('contract_ID')[['shs_label_edit', 'shs_area_m2_edit']]
+        .ffill()
+    )
+    telemetry.lap("fill", rows_out=len(combined_df))
+
+    #######################################
+    # Create binary imputed flag (imputed)
+
+    combined_df['shs_imputed'] = combined_df['shs_source'].isin(['gap_filled', 'forward_extended'])
 
-combined_df['shs_imputed'] = combined_df['shs_source'].isin(['gap_filled', 'forward_extended'])
+    stats["contracts_by_year_source"] = combined_df.groupby(['year', 'shs_source'], observed=True)['contract_ID'].nunique()
+
+    # -----------------------------------------------------------------------------------
+    # Summary:
+    # - Each contract-year/month has a consistent SHS status.
+    # - Missing SHS years between observed years are filled (gap_filled).
+    # - 2023 is populated if SHS existed in prior years (forward_extended).
+    # - Single-year SHS is only allowed in 2023.
+    # - shs_source and shs_imputed flags allow distinguishing observed vs gap-filled vs forward-extended data.
+    # -----------------------------------------------------------------------------------
+
+    combined_df['shs_label_edit'] = np.where(
+        combined_df['has_shs'] & combined_df['shs_label_edit'].isna(),
+        'PV_normal',
+        combined_df['shs_label_edit']
+    )
+
+    # Count unique contracts per year, overall and among PV households
+    stats["contracts_per_year"] = combined_df.groupby('year')['contract_ID'].nunique()
+    pv_df = combined_df[combined_df['shs_label_edit'] == "PV_normal"]
+    stats["pv_contracts_per_year"] = pv_df.groupby('year')['contract_ID'].nunique()
+    stats["months_per_contract"] = combined_df.groupby('contract_ID')['month_idx'].nunique()
+
+    # Save
+    save_bucket(select_columns(combined_df, output_columns, parquet_out), parquet_out, bucket, dirty,
+                sorted_by=PANEL_ORDER)
+    telemetry.lap("save", rows_out=len(combined_df))
+    return stats
+
+
+def sum_counts(results, key):
+    """Add up per-bucket unique-contract counts (contracts never span buckets, so sums are exact)."""
+    counts = [r[key] for r in results if len(r[key])]
+    if not counts:
+        return pd.Series(dtype="int64")
+    return pd.concat(counts).groupby(level=list(range(counts[0].index.nlevels))).sum()
 
 #######################################
-# Check
-
-print(
-    combined_df.groupby(['year', 'shs_source'])['contract_ID']
-    .nunique()
-)
-
-# -----------------------------------------------------------------------------------
-# Summary:
-# - Each contract-year/month has a consistent SHS status.
-# - Missing SHS years between observed years are filled (gap_filled).
-# - 2023 is populated if SHS existed in prior years (forward_extended).
-# - Single-year SHS is only allowed in 2023.
-# - shs_source and shs_imputed flags allow distinguishing observed vs gap-filled vs forward-extended data.
-# -----------------------------------------------------------------------------------
-
-combined_df['shs_label_edit'] = np.where(
-    combined_df['has_shs'] & combined_df['shs_label_edit'].isna(),
-    'PV_normal',
-    combined_df['shs_label_edit']
-)
-
-# Count unique contracts per year
-unique_contracts_per_year = combined_df.groupby('year')['contract_ID'].nunique().reset_index()
-unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
-print("\n Unique contracts by year:")
-print(unique_contracts_per_year)
-
-# Filter for households with SHS
-pv_df = combined_df[combined_df['shs_label_edit'] == "PV_normal"]
-
-# Count unique contracts per year among PV households
-unique_contracts_per_year = pv_df.groupby('year')['contract_ID'].nunique().reset_index()
-unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
-
-print("\n Unique PV_normal contracts by year:")
-print(unique_contracts_per_year)
-
-months_per_contract = combined_df.groupby('contract_ID')['month_year'].nunique()
-print(months_per_contract.describe())
-
-# Save
-output_file = os.path.join(parquet_out, "combined.parquet")
-combined_df.to_parquet(output_file, index=False)
-print(f"\n Saved combined parquet to {output_file}")
+# MAIN
+
+if __name__ == "__main__":
+    buckets = plan_buckets(parquet_dir, parquet_out, dirty)
+    print(f"Found {len(buckets)} contract buckets in {parquet_dir}")
+    if not buckets:
+        raise ValueError("No Parquet files found in the directory.")
+
+    results = map_buckets(process_bucket, buckets)
+    record_dirty(parquet_out, dirty)
+    print(f"\n✅ Processed {sum(r['rows_loaded'] for r in results):,} total rows")
+
+    print(f"Total unique contracts: {sum(r['unique_contracts'] for r in results):,}")
+    print("\n Unique contracts by Type:")
+    for contract_type, n in sum_counts(results, "unique_by_type").items():
+        print(f"   {contract_type}: {n:,}")
+
+    #######################################
+    # Check
+
+    print(sum_counts(results, "contracts_by_year_source"))
+
+    print("\n Unique contracts by year:")
+    print(sum_counts(results, "contracts_per_year").rename("unique_contracts").reset_index())
+
+    print("\n Unique PV_normal contracts by year:")
+    print(sum_counts(results, "pv_contracts_per_year").rename("unique_contracts").reset_index())
+
+    months_per_contract = pd.concat([r["months_per_contract"] for r in results])
+    print(months_per_contract.describe())
+
+    print(f"\n Saved combined parquet to {parquet_out}")
+    telemetry.finish(rows_in=sum(r['rows_loaded'] for r in results), buckets=len(buckets))
@@ -6,125 +6,250 @@ Author: Elizabeth Yoder
 Date: 02/2026
 """
 
+import json
+import os
 import pandas as pd
-import numpy as np
+import polars as pl
+
+from buckets import PANEL_ORDER, bucket_path, map_buckets
+from column_dedup import common_groups, find_identical_parquet_columns, plan_drops, plan_suffix_merges, report_merges
+from incremental import dirty_contracts, plan_buckets, record_dirty, replace_contracts
+from sampling import pl_in_sample
+from schema import csv_columns as read_csv_columns, pl_categorical, pl_text, require_columns
+from settings import PANEL_SIZE_M2, WATT_PER_PANEL
+from storage import is_sorted_by, pl_scan, pl_sink
+from telemetry import Telemetry
 
 # Paths
-PARQUET_PATH = "output/5b_out/combined.parquet
+PARQUET_PATH = "output/5b_out/combined"          # contract_ID hash buckets
 CSV_PATH = "data/checked_01132026.csv"
-OUTPUT_FILE = "output/with_sseg_reg.parquet"
-
-# Load data
-df_parquet = pd.read_parquet(PARQUET_PATH)
-df_csv = pd.read_csv(CSV_PATH)
-
-# Merge on 'contract_account_hashed'
-df_merged = pd.merge(
-    df_parquet,
-    df_csv,
-    on=['contract_account_hashed','year'],
-    how='left', 
-    suffixes=('_parquet', '_csv')
-)
+OUTPUT_FILE = "output/5c_out/with_sseg_reg"      # contract_ID hash buckets
+COLUMN_PLAN = os.path.join(OUTPUT_FILE, "_columns.json")   # kept/renamed columns of the last full run
 
 # Columns to keep
-cols_to_keep = ['contract_ID', 'contract_account_hashed', 'Type', 'month_year', 'trfname',
-                 'rate_category', 'kwh', 'contract_hashed', 'wkt_parquet', 
+cols_to_keep = ['contract_ID', 'contract_account_hashed', 'Type', 'month_idx', 'trfname',
+                 'rate_category', 'kwh', 'contract_hashed', 'wkt_parquet',
                  'contract_account_hashed_right', 'building_id','year', 'month', 'shs_label',
-                 'shs_label_edit', 'shs_area_m2', 'shs_area_m2_edit', 'has_shs', 'shs_gps', 
-                 'matched', 'installation_type', 'fake', 'total_capacity_va', 'start_year', 
-                 'wkt_csv', 'geometry', 'Did not build', 'Built; NOT found by M2F', 
+                 'shs_label_edit', 'shs_area_m2', 'shs_area_m2_edit', 'has_shs', 'shs_gps',
+                 'matched', 'installation_type', 'fake', 'total_capacity_va', 'start_year',
+                 'wkt_csv', 'geometry', 'Did not build', 'Built; NOT found by M2F',
                  'Built; found by M2F', 'Notes', 'area_m2']
 
-df_subset = df_merged[cols_to_keep].copy()
-
-# Drop columns with identical data (even if names are different)
-def drop_identical_columns(df):
-    cols = df.columns.tolist()
-    to_drop = set()
-    for i in range(len(cols)):
-        if cols[i] in to_drop:
-            continue
-        for j in range(i+1, len(cols)):
-            if cols[j] in to_drop:
-                continue
-            if df[cols[i]].equals(df[cols[j]]):
-                # Keep the first, drop the second
-                to_drop.add(cols[j])
-    return df.drop(columns=list(to_drop))
-
-df_clean = drop_identical_columns(df_subset)
-df_clean = df_clean.rename(columns=lambda x: x.replace(" ", "_").replace(";", ""))
-
-# Rename 'wkt_csv' to 'wkt'
-if 'wkt_csv' in df_clean.columns:
-    df_clean = df_clean.rename(columns={'wkt_csv': 'wkt'})
+# Columns read from each side of the merge (names before the _parquet/_csv suffixes)
+parquet_columns = ['contract_ID', 'contract_account_hashed', 'Type', 'month_idx', 'trfname',
+                   'rate_category', 'kwh', 'contract_hashed', 'wkt', 'building_id', 'year', 'month',
+                   'shs_label', 'shs_label_edit', 'shs_area_m2', 'shs_area_m2_edit', 'has_shs',
+                   'shs_gps', 'matched']
+csv_columns = ['contract_account_hashed', 'year', 'contract_account_hashed_right', 'installation_type',
+               'fake', 'total_capacity_va', 'start_year', 'wkt', 'geometry', 'Did not build',
+               'Built; NOT found by M2F', 'Built; found by M2F', 'Notes', 'area_m2']
 
+# Columns never dropped as duplicates (stage 6 and 7 need them)
+protected_columns = ['contract_ID', 'month_idx', 'wkt', 'wkt_csv']
 
 # Columns to forward-fill after first occurrence
 ff_cols = ['installation_type', 'total_capacity_va',
            'Built_NOT_found_by_M2F', 'Built_found_by_M2F']
 
-ff_cols = [c for c in ff_cols if c in df_clean.columns]
-
-# Ensure datetime for sorting
-df_clean['month_year'] = pd.to_datetime(df_clean['month_year'], errors='coerce')
-
-# Sort by household and time
-df_clean = df_clean.sort_values(['contract_ID', 'month_year'])
-
-# Forward-fill only after first valid value per household
-for col in ff_cols:
-    df_clean[col] = df_clean.groupby('contract_ID')[col].transform(lambda x: x.ffill())
-    
-# Get rid of shs predictions where visual evidence shows shs was not build
-df_clean["shs_label_edit"] = df_clean["shs_label_edit"].where(
-    df_clean["Did not build"] != 1,
-    pd.NA
-)
-
-# Fill in registration shs from visual inspection
-df_clean.loc[
-    df_clean["shs_label_edit"].isna() &
-    (
-        (df_clean["Built; NOT found by M2F"] == 1) |
-        (df_clean["Built; found by M2F"] == 1)
-    ),
-    "shs_label_edit"
-] = "PV_normal"
-
 #Define PV capacity metrics
-panel_size = 1.7      # m² per panel
-watt_per_panel = 400 # watts
-
-#Calculate capacity from predicted SHS area or, if that isn't available, registered capacity
-df_clean["Watt"] = (
-    df_clean["shs_area_m2_edit"]
-      .replace(0, np.nan)
-      * watt_per_panel / panel_size
-).fillna(df_clean["total_capacity_va"]).copy()
-
-
-# Count unique contracts per year
-unique_contracts_per_year = df_clean.groupby('year')['contract_ID'].nunique().reset_index()
-unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
-print("\n Unique contracts by year:")
-print(unique_contracts_per_year)
-
-# Filter for households with SHS
-pv_df = df_clean[df_clean['shs_label_edit'] == "PV_normal"]
-
-# Count unique contracts per year among PV households
-unique_contracts_per_year = pv_df.groupby('year')['contract_ID'].nunique().reset_index()
-unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
-
-print("\n Unique PV_normal contracts by year:")
-print(unique_contracts_per_year)
-
-months_per_contract = df_clean.groupby('contract_ID')['month_year'].nunique()
-print(months_per_contract.describe())
-
-# Save
-df_clean.to_parquet(OUTPUT_FILE, index=False)
+panel_size = PANEL_SIZE_M2        # m² per panel
+watt_per_panel = WATT_PER_PANEL   # watts
+
+# Merge keys
+merge_keys = ['contract_account_hashed', 'year']
+
+# Contracts changed upstream (recorded by 5b) or in the registrations; None = full run
+dirty = dirty_contracts(PARQUET_PATH)
+
+telemetry = Telemetry("5c")
+
+# Load registrations (small, shared by all buckets)
+require_columns(read_csv_columns(CSV_PATH), csv_columns, CSV_PATH)
+df_csv = pl.read_csv(CSV_PATH, columns=csv_columns, infer_schema_length=None).with_columns(
+    pl.col('contract_account_hashed').cast(pl.Utf8),
+    pl.col('year').cast(pl.Int64),
+    # Flags and capacity are numeric even when a column is empty
+    pl.col(['Did not build', 'Built; NOT found by M2F', 'Built; found by M2F',
+            'total_capacity_va']).cast(pl.Float64, strict=False)
+).filter(pl_in_sample('contract_account_hashed'))   # fast runs: registrations of sampled accounts
+
+#######################################
+# Lazy plan for one bucket of contracts
+
+def build_plan(bucket):
+    """
+    One polars plan for a bucket: registration merge, per-contract forward fill,
+    registration-based SHS corrections and PV capacity.
+    """
+    # Columns on both sides of the merge get the _parquet / _csv suffixes
+    shared = [c for c in parquet_columns if c in csv_columns and c not in merge_keys]
+    panel_path = bucket_path(PARQUET_PATH, bucket)
+    panel = pl_scan(panel_path)
+    require_columns(panel.collect_schema().names(), parquet_columns, panel_path)
+    panel = (
+        pl_text(panel.select(parquet_columns))
+        .filter(pl.col('contract_ID').cast(pl.Utf8).is_in(sorted(dirty)) if dirty is not None else pl.lit(True))
+        .with_columns(
+            pl.col('contract_account_hashed').cast(pl.Utf8),
+            pl.col('year').cast(pl.Int64)
+        )
+        .rename({c: f"{c}_parquet" for c in shared})
+    )
+    registrations = df_csv.lazy().rename({c: f"{c}_csv" for c in shared})
+
+    # A panel sorted by household and time (5b) stays sorted through a join that keeps its order
+    panel_sorted = is_sorted_by(panel_path, PANEL_ORDER)
+    plan = (
+        panel.join(registrations, on=merge_keys, how='left', maintain_order='left' if panel_sorted else None)
+        .select(cols_to_keep)
+        .rename({c: c.replace(" ", "_").replace(";", "") for c in cols_to_keep})
+        # Pandas wrote missing floats as NaN; treat them as missing like pandas did
+        .with_columns(pl.col(pl.Float32, pl.Float64).fill_nan(None))
+    )
+    if not panel_sorted:
+        # Sort by household and time
+        plan = plan.sort(PANEL_ORDER)
+
+    # Forward-fill only after first valid value per household
+    plan = plan.with_columns([pl.col(c).forward_fill().over('contract_ID') for c in ff_cols])
+
+    plan = plan.with_columns(
+        # Get rid of shs predictions where visual evidence shows shs was not build
+        pl.when(pl.col("Did_not_build") == 1)
+          .then(None)
+          .otherwise(pl.col("shs_label_edit"))
+          .alias("shs_label_edit")
+    ).with_columns(
+        # Fill in registration shs from visual inspection
+        pl.when(
+            pl.col("shs_label_edit").is_null() &
+            ((pl.col("Built_NOT_found_by_M2F") == 1) | (pl.col("Built_found_by_M2F") == 1))
+        )
+          .then(pl.lit("PV_normal"))
+          .otherwise(pl.col("shs_label_edit"))
+          .alias("shs_label_edit"),
+        #Calculate capacity from predicted SHS area or, if that isn't available, registered capacity
+        (
+            pl.when(pl.col("shs_area_m2_edit") == 0).then(None).otherwise(pl.col("shs_area_m2_edit"))
+            * watt_per_panel / panel_size
+        ).fill_null(pl.col("total_capacity_va")).alias("Watt")
+    )
+    # Registry text columns go out as Categorical (dictionary-encoded in Parquet)
+    return pl_categorical(plan)
+
+#######################################
+# Process one bucket of contracts
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Run the plan for one bucket, stream it to disk and return counts."""
+    if dirty is not None:
+        return process_dirty_bucket(bucket)
+    output_path = bucket_path(OUTPUT_FILE, bucket)
+    # (one streaming plan: load, merge, fill and save)
+    pl_sink(build_plan(bucket), output_path)
+    telemetry.lap("merge_save")
+
+    # Count unique contracts per year, overall and among PV households (reads only 4 columns)
+    out = pl_scan(output_path)
+    per_year = out.group_by('year').agg(
+        pl.col('contract_ID').n_unique().alias('contract_ID'),
+        pl.col('contract_ID').filter(pl.col('shs_label_edit') == "PV_normal").n_unique().alias('pv_contract_ID')
+    ).collect().to_pandas().set_index('year')
+    months = out.group_by('contract_ID').agg(pl.col('month_idx').n_unique()).collect()
+    telemetry.lap("count", rows_out=int(months['month_idx'].sum()))
+
+    return {
+        "contracts_per_year": per_year['contract_ID'],
+        "pv_contracts_per_year": per_year['pv_contract_ID'].rename('contract_ID'),
+        "months_per_contract": months['month_idx'].to_pandas(),
+        # Identical columns in this bucket; dropped at the end only if identical in every bucket
+        "columns": out.collect_schema().names(),
+        "identical_groups": find_identical_parquet_columns(output_path),
+    }
+
+
+def process_dirty_bucket(bucket):
+    """Incremental run: recompute the dirty contracts of one bucket and replace their rows. Returns counts."""
+    with open(COLUMN_PLAN) as f:
+        column_plan = json.load(f)
+    rows = build_plan(bucket).select(column_plan["kept"]).rename(column_plan["rename"]).collect()
+    telemetry.lap("merge", rows_out=rows.height)
+    replace_contracts(rows.to_arrow(), OUTPUT_FILE, bucket, dirty)
+    telemetry.lap("save", rows_out=rows.height)
+
+    per_year = rows.group_by('year').agg(
+        pl.col('contract_ID').n_unique().alias('contract_ID'),
+        pl.col('contract_ID').filter(pl.col('shs_label_edit') == "PV_normal").n_unique().alias('pv_contract_ID')
+    ).to_pandas().set_index('year')
+    return {
+        "contracts_per_year": per_year['contract_ID'],
+        "pv_contracts_per_year": per_year['pv_contract_ID'].rename('contract_ID'),
+        "months_per_contract": rows.group_by('contract_ID').agg(pl.col('month_idx').n_unique())['month_idx'].to_pandas(),
+    }
+
+#######################################
+# Drop columns with identical data (even if names are different)
 
-print(f"Merged and cleaned data saved to: {OUTPUT_FILE}")
+def drop_identical_columns(results, buckets):
+    """Drop columns identical in every bucket (identical _parquet/_csv pairs keep the base name)."""
+    columns = results[0]["columns"]
+    groups = common_groups([r["identical_groups"] for r in results], columns)
+
+    # Identical _parquet/_csv pairs collapse back to one column with the base name
+    renamed = plan_suffix_merges(groups, columns)
+    rename = {left: base for base, (left, right) in renamed.items()}
+    right_sides = {right for left, right in renamed.values()}
+    groups = [[rename.get(c, c) for c in g if c not in right_sides] for g in groups]
+
+    # Other identical columns: keep the first
+    merged = plan_drops([g for g in groups if len(g) > 1], protect=protected_columns)
+    dropped = right_sides | {c for cols in merged.values() for c in cols}
+    print("\n Merged identical columns:")
+    report_merges(merged, renamed)
+
+    # Rename 'wkt_csv' to 'wkt'
+    if 'wkt_csv' in columns and 'wkt_csv' not in dropped:
+        rename['wkt_csv'] = 'wkt'
+
+    kept = [c for c in columns if c not in dropped]
+    for bucket in buckets:
+        output_path = bucket_path(OUTPUT_FILE, bucket)
+        pl_sink(pl_scan(output_path).select(kept).rename(rename), output_path + ".tmp")
+        os.replace(output_path + ".tmp", output_path)
+    with open(COLUMN_PLAN, "w") as f:
+        json.dump({"kept": kept, "rename": rename}, f, indent=1)
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    buckets = plan_buckets(PARQUET_PATH, OUTPUT_FILE, dirty)
+    print(f"Found {len(buckets)} contract buckets in {PARQUET_PATH}")
+
+    results = map_buckets(process_bucket, buckets)
+    record_dirty(OUTPUT_FILE, dirty)
+
+    # Contracts never span buckets, so per-bucket counts add up exactly
+    unique_contracts_per_year = pd.concat([r["contracts_per_year"] for r in results]).groupby(level=0).sum().reset_index()
+    unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
+    print("\n Unique contracts by year:")
+    print(unique_contracts_per_year)
+
+    unique_contracts_per_year = pd.concat([r["pv_contracts_per_year"] for r in results]).groupby(level=0).sum().reset_index()
+    unique_contracts_per_year.rename(columns={'contract_ID': 'unique_contracts'}, inplace=True)
+    print("\n Unique PV_normal contracts by year:")
+    print(unique_contracts_per_year)
+
+    months_per_contract = pd.concat([r["months_per_contract"] for r in results])
+    print(months_per_contract.describe())
+
+    if dirty is None:
+        with telemetry.step("drop_identical_columns"):
+            drop_identical_columns(results, buckets)
+    else:
+        # Incremental runs keep the columns chosen by the last full run
+        print(f"Updated {len(dirty):,} dirty contracts")
+
+    print(f"Merged and cleaned data saved to: {OUTPUT_FILE}")
+    telemetry.finish(rows_out=int(months_per_contract.sum()), buckets=len(buckets))
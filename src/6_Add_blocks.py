@@ -5,86 +5,131 @@ Author: Elizabeth Yoder
 Date: February 2026
 """ 
 
-import os 
 import time
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely import wkt
+import pyarrow as pa
+
+from block_lookup import BlockLookup, point_coordinates
+from buckets import bucket_schema, iter_bucket, map_buckets
+from chunking import ChunkPlanner
+from incremental import dirty_contracts, merge_staged, plan_buckets, record_dirty, sink_path
+from streaming import CHUNKS_IN_FLIGHT, map_chunks, open_sink, output_schema
+from telemetry import Telemetry
 
 # Paths
-COMBINED_FILE = "output/5c_out/with_sseg_reg.parquet"
+COMBINED_FILE = "output/5c_out/with_sseg_reg"                     # contract_ID hash buckets
 BLOCKS_FILE = "data/Load_shedding_Blocks.geojson"
-OUTPUT_FILE = "output/6_out/merged_with_blocks_combined.parquet"
+OUTPUT_FILE = "output/6_out/merged_with_blocks_combined"          # contract_ID hash buckets
 
 #Set up
-os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-CHUNK_SIZE = 100_000
+CHUNK_WORKING_FACTOR = 3   # chunk sizes are planned from the memory budget (a chunk and its copy with the block attributes)
+GRID_RESOLUTION = 512   # lookup grid cells along the longer side of the blocks' extent
+BLOCK_ID = "BlockID"    # tie-break: a boundary point goes to the block with the smallest BlockID
+
+# Columns: 'wkt' is required; the old 'geometry' column is never used, so it is not read
+input_required = ["wkt"]
+input_excluded = ["geometry"]
+
+# Contracts changed upstream (recorded by 5c); None = full run
+dirty = dirty_contracts(COMBINED_FILE)
+
+telemetry = Telemetry("6")
 
 #######################################
-# Load load shedding blocks
+# Load load shedding blocks and build the lookup grid
 
 print(f"Loading load shedding blocks: {BLOCKS_FILE}")
-blocks_gdf = gpd.read_file(BLOCKS_FILE).to_crs("EPSG:4326")
+blocks_gdf = gpd.read_file(BLOCKS_FILE).to_crs("EPSG:4326").reset_index(drop=True)
 print(f"Loaded {len(blocks_gdf):,} load shedding blocks.")
 
-#######################################
-# Load combined parquet
+block_ids = blocks_gdf[BLOCK_ID] if BLOCK_ID in blocks_gdf.columns else blocks_gdf.index
+block_lookup = BlockLookup(blocks_gdf.geometry.values, block_ids, resolution=GRID_RESOLUTION)
+print(f"Lookup grid: {block_lookup.nx} x {block_lookup.ny} cells, "
+      f"{(block_lookup.owner >= 0).mean()*100:.1f}% inside a single block")
 
-print(f"\n Loading combined parquet: {COMBINED_FILE}")
-df = pd.read_parquet(COMBINED_FILE)
-total_rows = len(df)
-print(f"Loaded {total_rows:,} rows, {len(df.columns)} columns.")
+# Block attributes added to each row (same names as the previous sjoin with rsuffix="_block")
+block_attrs = pd.DataFrame(blocks_gdf.drop(columns="geometry"))
+block_attrs.insert(0, "index__block", blocks_gdf.index)
+telemetry.lap("load_blocks", rows_out=len(blocks_gdf))
 
-processed_chunks = []
-start_time = time.time()
+# Made after loading the lookup tables, so their memory is not counted as free for chunks
+planner = ChunkPlanner("6", working_factor=CHUNK_WORKING_FACTOR, in_flight=CHUNKS_IN_FLIGHT)
 
 #######################################-
-# Spatial join
-
-for start in range(0, total_rows, CHUNK_SIZE):
-    print(f"\n Processing chunk {start // CHUNK_SIZE + 1} — rows {start:,} to {min(start + CHUNK_SIZE, total_rows):,}")
-
-    chunk_df = df.iloc[start:start + CHUNK_SIZE].copy()
-    if chunk_df.empty:
-        print("Chunk is empty — skipping")
-        continue
-
-    if "wkt" not in chunk_df.columns:
-        print("'wkt' column missing — skipping chunk")
-        continue
-
-    # Convert WKT to geometry
-    chunk_df["geometry"] = chunk_df["wkt"].apply(wkt.loads)
-
-    # Avoid geometry name conflicts
-    if "geometry_block" in chunk_df.columns:
-        chunk_df = chunk_df.drop(columns=["geometry_block"])
-
-    # Create GeoDataFrame
-    chunk_gdf = gpd.GeoDataFrame(chunk_df, geometry="geometry", crs="EPSG:4326")
-
-    # Spatial join
-    merged_chunk = gpd.sjoin(
-        chunk_gdf,
-        blocks_gdf,
-        how="left",
-        predicate="intersects",
-        rsuffix="_block"
+# Point-in-block lookup
+
+def assign_blocks(chunk_df, attrs):
+    """Attach the block attributes of (at most) one block to every row of a chunk."""
+    # Contract location: 'wkt', or the panel location where 'wkt' is missing
+    location = chunk_df["wkt"]
+    if "wkt_parquet" in chunk_df.columns:
+        location = location.fillna(chunk_df["wkt_parquet"])
+    x, y = point_coordinates(location)
+
+    # Block row for each point (-1 = outside all blocks)
+    block_pos, stats = block_lookup.lookup(x, y)
+    merged_chunk = pd.concat(
+        [chunk_df, attrs.reindex(np.where(block_pos >= 0, block_pos, -1)).reset_index(drop=True)],
+        axis=1
     )
-
-    processed_chunks.append(merged_chunk)
-
-    elapsed = time.time() - start_time
-    print(f"Chunk processed in {elapsed:.1f}s")
+    return merged_chunk, stats
+
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Assign each row of one hash bucket to a block, streaming chunk by chunk to disk. Returns counts."""
+    schema_in = bucket_schema(COMBINED_FILE, bucket, exclude=input_excluded)
+
+    # Block attribute names that clash with panel columns get the "__block" suffix
+    attrs = block_attrs.rename(columns={c: f"{c}__block" for c in block_attrs.columns
+                                        if c in schema_in.names and c != "index__block"})
+    attrs_schema = pa.Schema.from_pandas(attrs, preserve_index=False)
+    schema = output_schema(schema_in, changes={f.name: f.type for f in attrs_schema})
+
+    counts = {"rows_in": 0, "grid": 0, "polygon_test": 0, "boundary_ties": 0, "no_block": 0}
+    start_time = time.time()
+    chunks = iter_bucket(COMBINED_FILE, bucket, planner, exclude=input_excluded, required=input_required,
+                         contracts=dirty)
+
+    with open_sink(sink_path(OUTPUT_FILE, bucket, dirty), schema) as sink:
+        for i, (merged_chunk, stats) in enumerate(map_chunks(lambda c: assign_blocks(c, attrs), chunks), start=1):
+            sink.write(merged_chunk)
+            counts["rows_in"] += len(merged_chunk)
+            for k, v in stats.items():
+                counts[k] += v
+            print(f" Bucket {bucket}: chunk {i} written ({sink.rows:,} rows so far, {time.time() - start_time:.1f}s)")
+    # (chunks are read, assigned and written in a pipeline, so this is one step)
+    telemetry.lap("assign_save", rows_in=counts["rows_in"], rows_out=sink.rows)
+
+    merge_staged(OUTPUT_FILE, bucket, dirty)
+    telemetry.lap("merge_staged", rows_out=sink.rows)
+    counts["rows_out"] = sink.rows
+    return counts
 
 #######################################
-# Save 
-
-if processed_chunks:
-    result_gdf = pd.concat(processed_chunks, ignore_index=True)
-    result_gdf.to_parquet(OUTPUT_FILE, index=False)
-    print(f"\n Saved merged file to: {OUTPUT_FILE}")
-    print(f"Total merged rows: {len(result_gdf):,}")
-else:
-    print("No chunks processed — no output saved.")
-
+# MAIN
+
+if __name__ == "__main__":
+    buckets = plan_buckets(COMBINED_FILE, OUTPUT_FILE, dirty)
+    print(f"\n Found {len(buckets)} contract buckets in {COMBINED_FILE}")
+
+    results = pd.DataFrame(map_buckets(process_bucket, buckets))
+    record_dirty(OUTPUT_FILE, dirty)
+    totals = results.sum() if len(results) else pd.Series(dtype=int)
+
+    #######################################
+    # Save
+
+    if totals.get("rows_out", 0):
+        print(f"\n Saved merged file to: {OUTPUT_FILE}")
+        print(f"Loaded {totals['rows_in']:,} rows, total merged rows: {totals['rows_out']:,}")
+        print(f"   🔹 Resolved by grid cell: {totals['grid']:,}")
+        print(f"   🔹 Tested against candidate polygons: {totals['polygon_test']:,} "
+              f"(on a shared boundary, tie-break by {BLOCK_ID}: {totals['boundary_ties']:,})")
+        print(f"   🔹 Outside all blocks: {totals['no_block']:,}")
+    else:
+        print("No chunks processed — no output saved.")
+    telemetry.finish(rows_in=int(totals.get("rows_in", 0)), rows_out=int(totals.get("rows_out", 0)),
+                     buckets=len(buckets))
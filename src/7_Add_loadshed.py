@@ -5,129 +5,126 @@ Author: Elizabeth Yoder
 Date: February 2026
 """
 
-import os
 import pandas as pd
-import geopandas as gpd
-import glob
 import time
-import re
+import pyarrow as pa
+
+from buckets import bucket_path, bucket_schema, iter_bucket, map_buckets
+from chunking import ChunkPlanner
+from incremental import dirty_contracts, merge_staged, plan_buckets, record_dirty, sink_path
+from loadshed_schedule import load_schedule
+from months import month_string
+from storage import FINAL_FORMAT
+from streaming import CHUNKS_IN_FLIGHT, map_chunks, open_sink, output_schema
+from telemetry import Telemetry
 
 #Paths
 LOADSHED_FILE = "data/raw/Loadshedding_schedule.csv"
-BLOCKS_DIR = "output/6_out"
-OUTPUT_DIR = "output/7_out"
-
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-#######################################
-# Load load shedding schedule
-
-print(f"Loading Load Shedding Schedule: {LOADSHED_FILE}")
-shed_df = pd.read_csv(LOADSHED_FILE)
-
-print(f"Loaded {len(shed_df):,} rows.")
-print("Parsing dates...")
-shed_df["Date"] = pd.to_datetime(shed_df["Date"], errors="coerce")
-
-# Strip column whitespace
-shed_df.columns = shed_df.columns.str.strip()
-
-# Create month_year column
-shed_df["month_year"] = shed_df["Date"].dt.to_period("M").astype(str)
+BLOCKS_DIR = "output/6_out/merged_with_blocks_combined"   # contract_ID hash buckets
+OUTPUT_DIR = "output/7_out/combined_merged"              # contract_ID hash buckets
 
-def extract_area_number(row):
-    """
-    Extract the number following 'Area' from:
-        Area column first
-        Stage column if not found in Area
-    """
-    area_pattern = re.compile(r"area\s*([0-9]+)", flags=re.IGNORECASE)
+#Set up
+CHUNK_WORKING_FACTOR = 3   # chunk sizes are planned from the memory budget (a chunk and its merge with the monthly schedule)
 
-    area_val = str(row.get("Area", ""))
-    stage_val = str(row.get("Stage", ""))
+# Columns: the block join only needs month_idx and the block id, so the point
+# geometry is not read
+input_required = ["month_idx"]
+input_excluded = ["geometry"]
 
-    # Check Area column first
-    if re.search(r"area", area_val, flags=re.IGNORECASE):
-        match = area_pattern.search(area_val)
-        if match:
-            return int(match.group(1))
+# Contracts changed upstream (recorded by 6); None = full run
+dirty = dirty_contracts(BLOCKS_DIR)
 
-    # Fallback to Stage column
-    if re.search(r"area", stage_val, flags=re.IGNORECASE):
-        match = area_pattern.search(stage_val)
-        if match:
-            return int(match.group(1))
+telemetry = Telemetry("7")
 
-    return None
+#######################################
+# Load the compiled load shedding schedule (parsed once, cached until the CSV changes)
 
-# Apply to the dataframe
-shed_df["Area_number"] = shed_df.apply(extract_area_number, axis=1)
-shed_df = shed_df[shed_df["Area_number"].notna()].copy()
+schedule = load_schedule(LOADSHED_FILE)
+intervals = schedule.intervals
 
 # Summary
 print("\n=== Extracted Area numbers ===")
-print(shed_df[["Stage", "Area", "Area_number"]].head(20))
-print(shed_df["Area_number"].value_counts(dropna=False).sort_index())
-print(f"Extracted valid Area numbers for {shed_df['Area_number'].notna().sum():,} of {len(shed_df):,} rows")
-print(shed_df.columns)
+print(intervals[["Stage", "Area_number", "start", "end"]].head(20))
+print(intervals["Area_number"].value_counts(dropna=False).sort_index())
+print(f"Compiled {len(intervals):,} outage intervals for {intervals['Area_number'].nunique():,} areas")
 
 #######################################
-# Summarize by Area and month_year
+# Summarize by Area and month
 
-print("Summarizing load shedding by Area and month_year...")
-shed_summary = shed_df.groupby(["Area_number", "month_year"], as_index=False)["Duration min"].sum()
-shed_summary.rename(columns={"Duration min": "total_duration_min"}, inplace=True)
+shed_summary = schedule.monthly.astype({"Area_number": "Float64"})
 print("Summary ready:")
 print(shed_summary.head())
+telemetry.lap("load_schedule", rows_out=len(shed_summary), intervals=len(intervals))
 
-#######################################
-# Merge with yearly data
-
-parquet_files = glob.glob(os.path.join(BLOCKS_DIR, "*.parquet"))
-merged_list = []
-output_path = os.path.join(OUTPUT_DIR, "combined_merged.parquet")
-
-for file_path in parquet_files:
-    print(f"\n Processing {file_path}...")
-    try:
-        gdf = gpd.read_parquet(file_path)
-        print(f"   - Loaded {len(gdf):,} rows.")
+# Made after loading the lookup tables, so their memory is not counted as free for chunks
+planner = ChunkPlanner("7", working_factor=CHUNK_WORKING_FACTOR, in_flight=CHUNKS_IN_FLIGHT)
 
-        # Rename BlockID to Area
-        if "BlockID" in gdf.columns:
-            gdf = gdf.rename(columns={"BlockID": "Area_number"})
-        gdf["Area_number"] = gdf["Area_number"].astype(str).str.upper().str.strip()
+#######################################
+# Merge with each contract bucket
 
-        # Ensure month_year is datetime first
-        gdf["month_year"] = pd.to_datetime(gdf["month_year"], errors="coerce")
-        gdf["month_year"] = gdf["month_year"].dt.strftime("%Y-%m")
+def add_loadshed(gdf):
+    """Add monthly load shedding duration to one chunk of contract rows."""
+    # Rename BlockID to Area
+    if "BlockID" in gdf.columns:
+        gdf = gdf.rename(columns={"BlockID": "Area_number"})
 
-        if "Area_number" not in gdf.columns:
-            print(f"No Area column in {file_path}, skipping.")
-            continue
+    gdf["Area_number"] = gdf["Area_number"].astype(str).str.upper().str.strip()
+    gdf["Area_number"] = pd.to_numeric(gdf["Area_number"], errors="coerce").astype("Float64")
 
+    merged = pd.merge(gdf, shed_summary, how="left",
+                      left_on=["Area_number", "month_idx"],
+                      right_on=["Area_number", "month_idx"])
 
-        gdf["Area_number"] = pd.to_numeric(gdf["Area_number"], errors="coerce").astype("Float64")
+    # Final output: months are exported as "YYYY-MM" as well as the integer index
+    merged["month_year"] = month_string(merged["month_idx"])
+    return merged
 
-        print(gdf[["Area_number", "month_year"]])
-        print(shed_summary[["Area_number", "month_year"]])
 
-        merged = pd.merge(gdf, shed_summary, how="left",
-                        left_on=["Area_number", "month_year"],
-                        right_on=["Area_number", "month_year"])
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Add monthly load shedding duration to one hash bucket of contracts, streaming chunk by chunk. Returns rows written."""
+    file_path = bucket_path(BLOCKS_DIR, bucket)
+    print(f"\n Processing {file_path}...")
+    schema_in = bucket_schema(BLOCKS_DIR, bucket, exclude=input_excluded)
+    schema_in = pa.schema([f.with_name("Area_number") if f.name == "BlockID" else f for f in schema_in])
+
+    if "Area_number" not in schema_in.names:
+        print(f"No Area column in {file_path}, skipping.")
+        return 0
+
+    schema = output_schema(schema_in, changes={
+        "month_year": pa.string(),
+        "Area_number": pa.float64(),
+        "total_duration_min": pa.float64(),
+    })
+    chunks = iter_bucket(BLOCKS_DIR, bucket, planner, exclude=input_excluded, required=input_required,
+                         contracts=dirty)
+
+    # Final output: always zstd Parquet, whatever the intermediate format
+    output_path = bucket_path(OUTPUT_DIR, bucket, FINAL_FORMAT)
+    with open_sink(sink_path(OUTPUT_DIR, bucket, dirty, FINAL_FORMAT), schema, FINAL_FORMAT) as sink:
+        for merged in map_chunks(add_loadshed, chunks):
+            sink.write(merged)
+    # (chunks are read, merged and written in a pipeline, so this is one step)
+    telemetry.lap("merge_save", rows_out=sink.rows)
+    merge_staged(OUTPUT_DIR, bucket, dirty, FINAL_FORMAT)
+    telemetry.lap("merge_staged", rows_out=sink.rows)
+
+    print(f"Saved merged data: {output_path} ({sink.rows:,} rows)")
+    return sink.rows
 
-        print(f"Saved merged data: {output_path}")
+#######################################
+# MAIN
 
-        merged_list.append(merged)
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
+if __name__ == "__main__":
+    buckets = plan_buckets(BLOCKS_DIR, OUTPUT_DIR, dirty)
+    rows_written = map_buckets(process_bucket, buckets)
+    record_dirty(OUTPUT_DIR, dirty)
 
-print("\n All files processed.")
+    print("\n All files processed.")
 
-# Save
-if merged_list:
-    combined_merged = pd.concat(merged_list, ignore_index=True)
-    combined_merged.to_parquet(output_path, index=False)
-    print(f"\n All files merged and saved to {output_path}")
-else:
-    print("No files were successfully merged.")
+    if sum(rows_written):
+        print(f"\n All files merged and saved to {OUTPUT_DIR} ({sum(rows_written):,} rows)")
+    else:
+        print("No files were successfully merged.")
+    telemetry.finish(rows_out=sum(rows_written), buckets=len(buckets))
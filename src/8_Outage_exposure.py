@@ -0,0 +1,107 @@
+"""
+Outage exposure between purchases: for every prepaid transaction interval
+(purchase to next purchase, from 1b), the load shedding minutes and number of
+outages in the household's block (assigned in 6) during that interval.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+from buckets import bucket_path, list_buckets, map_buckets, read_bucket, reset_dataset, write_bucket
+from loadshed_schedule import SECOND_NS, load_schedule
+from storage import FINAL_FORMAT
+from telemetry import Telemetry
+
+# Paths
+LOADSHED_FILE = "data/raw/Loadshedding_schedule.csv"
+INTERVALS_DIR = "output/1_out/transaction_intervals"            # contract hash buckets (from 1b)
+BLOCKS_DIR = "output/6_out/merged_with_blocks_combined"         # contract_ID hash buckets
+OUTPUT_DIR = "output/8_out/transaction_outages"                 # contract_ID hash buckets
+
+# Columns
+interval_columns = ["contract_account_hashed", "transaction_timestamp", "next_timestamp"]
+block_columns = ["contract_ID", "month_idx", "BlockID"]
+output_columns = ["contract_ID", "transaction_timestamp", "next_timestamp", "Area_number",
+                  "outage_minutes", "outage_count"]
+
+telemetry = Telemetry("8")
+
+#######################################
+# Load the compiled schedule and its per-area interval index (shared by all buckets)
+
+schedule = load_schedule(LOADSHED_FILE)
+area_intervals = schedule.index
+print(f"Outage intervals for {len(area_intervals.areas):,} areas "
+      f"({len(area_intervals.start):,} after merging overlaps)")
+telemetry.lap("load_schedule", rows_out=len(area_intervals.start))
+
+#######################################
+# Process one bucket of contracts
+
+def to_seconds(timestamps):
+    """datetime64 values as int64 seconds since 1970-01-01 (the index's time unit)."""
+    return pd.to_datetime(timestamps).to_numpy("datetime64[ns]").astype(np.int64) // SECOND_NS
+
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Outage minutes and count for each transaction interval of one hash bucket. Returns counts."""
+    transactions = read_bucket(INTERVALS_DIR, bucket, columns=interval_columns)
+    transactions = transactions.rename(columns={"contract_account_hashed": "contract_ID"})
+
+    # One block per contract: the block of its location in 6, in its first month with a
+    # block (not the first row, so it does not depend on the row order of 6's buckets)
+    blocks_path = bucket_path(BLOCKS_DIR, bucket)
+    if os.path.exists(blocks_path):
+        contract_blocks = (
+            read_bucket(BLOCKS_DIR, bucket, columns=block_columns)
+            .dropna(subset=["BlockID"])
+            .sort_values(["contract_ID", "month_idx", "BlockID"])
+            .drop_duplicates("contract_ID")
+            .rename(columns={"BlockID": "Area_number"})
+            [["contract_ID", "Area_number"]]
+        )
+    else:
+        contract_blocks = pd.DataFrame({"contract_ID": pd.Series(dtype="str"), "Area_number": pd.Series(dtype="Int64")})
+    df = transactions.merge(contract_blocks, on="contract_ID", how="left")
+    telemetry.lap("load", rows_out=len(df))
+
+    # Overlap with the block's outage intervals (no block = no exposure)
+    area = pd.to_numeric(df["Area_number"], errors="coerce").fillna(-1).to_numpy(dtype=np.int64)
+    has_block = area >= 0
+    seconds, count = area_intervals.overlap(
+        area, to_seconds(df["transaction_timestamp"]), to_seconds(df["next_timestamp"])
+    )
+    df["outage_minutes"] = seconds / 60
+    df["outage_count"] = count
+    telemetry.lap("overlap", rows_out=len(df))
+
+    write_bucket(df[output_columns], OUTPUT_DIR, bucket, FINAL_FORMAT)
+    telemetry.lap("save", rows_out=len(df))
+    return {
+        "transactions": len(df),
+        "with_block": int(has_block.sum()),
+        "exposed": int((count > 0).sum()),
+        "outage_minutes": float(df["outage_minutes"].sum()),
+    }
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    buckets = list_buckets(INTERVALS_DIR)
+    print(f"\n Found {len(buckets)} transaction interval buckets in {INTERVALS_DIR}")
+    reset_dataset(OUTPUT_DIR)
+
+    totals = pd.DataFrame(map_buckets(process_bucket, buckets)).sum()
+
+    print(f"\n Saved outage exposure per transaction interval to {OUTPUT_DIR}")
+    print(f"   🔹 Transaction intervals: {int(totals['transactions']):,}")
+    print(f"   🔹 With a load shedding block: {int(totals['with_block']):,}")
+    print(f"   🔹 With at least one outage: {int(totals['exposed']):,}")
+    print(f"   🔹 Total outage minutes: {totals['outage_minutes']:,.0f}")
+    telemetry.finish(rows_out=int(totals["transactions"]), buckets=len(buckets))
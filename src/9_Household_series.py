@@ -0,0 +1,61 @@
+"""
+Export the final panel (7) as a contract-major time-series store: each
+contract's monthly kWh, load shedding minutes and SHS flags as contiguous
+memory-mapped arrays (see household_series.py), for per-household analyses
+that slice arrays instead of regrouping the panel.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+import numpy as np
+import polars as pl
+
+from buckets import bucket_path, list_buckets, map_buckets
+from household_series import HouseholdSeries, contract_months, write_series
+from storage import IPC_COMPAT, pl_scan
+from telemetry import Telemetry
+
+# Paths
+PANEL_DIR = "output/7_out/combined_merged"          # contract_ID hash buckets
+OUTPUT_DIR = "output/9_out/household_series"
+STAGING_DIR = "output/9_out/staged"                 # per-bucket contract-months, removed when done
+
+telemetry = Telemetry("9")
+
+#######################################
+# Contract-months of one bucket
+
+@telemetry.timed("bucket")
+def process_bucket(bucket):
+    """Collapse one bucket of the panel to contract-months and stage it. Returns (rows, contracts)."""
+    months = contract_months(pl_scan(bucket_path(PANEL_DIR, bucket)))
+    months.write_ipc(os.path.join(STAGING_DIR, f"part-{bucket:05d}.arrow"), compat_level=IPC_COMPAT)
+    telemetry.lap("collapse", rows_out=months.height)
+    return months.height, months["contract_ID"].n_unique()
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    buckets = list_buckets(PANEL_DIR)
+    print(f"Found {len(buckets)} contract buckets in {PANEL_DIR}")
+    os.makedirs(STAGING_DIR, exist_ok=True)
+
+    counts = map_buckets(process_bucket, buckets)
+    n_rows, n_contracts = sum(r for r, _ in counts), sum(c for _, c in counts)
+
+    # Contracts never span buckets, so the store is the staged buckets one after another
+    staged = [os.path.join(STAGING_DIR, f"part-{bucket:05d}.arrow") for bucket in buckets]
+    with telemetry.step("write"):
+        write_series(OUTPUT_DIR, (pl.read_ipc(path) for path in staged), n_rows, n_contracts)
+    for path in staged:
+        os.remove(path)
+    os.rmdir(STAGING_DIR)
+
+    store = HouseholdSeries(OUTPUT_DIR)
+    months = np.diff(store.offsets)
+    print(f"Saved {len(store):,} contract series ({n_rows:,} contract-months, "
+          f"median {np.median(months) if len(months) else 0:.0f} months per contract) to {OUTPUT_DIR}")
+    telemetry.finish(rows_out=n_rows, contracts=n_contracts, buckets=len(buckets))
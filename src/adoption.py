@@ -0,0 +1,135 @@
+"""
+SHS adoption month from consumption: a vectorized change-point detector that
+finds the month a contract's grid purchases fall to a lower level.
+
+Each series is log kWh minus the panel's average for the calendar month (so
+winter peaks are not read as changes). For every possible split month the
+fit of one mean before and one after is scored at once over all contracts,
+from cumulative sums of the concatenated series (the CUSUM statistic of a mean
+shift). The best split of each contract comes from segmented reductions
+(ufunc.reduceat over the contract offsets of household_series), so there is no
+loop over contracts:
+
+    result = detect_drops(store.offsets, store.columns["month_idx"], store.columns["kwh"])
+
+A contract's drop is detected when its best split leaves at least MIN_SEGMENT
+months on each side, lowers consumption by at least MIN_DROP and has a
+t-statistic of at least MIN_T.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import numpy as np
+
+from months import BASE_YEAR
+
+# Set up
+MIN_SEGMENT = 6      # months on each side of a change point
+MIN_DROP = 0.15      # relative fall in consumption (0.15 = 15% less)
+MIN_T = 4.0          # t-statistic of the fall (the best of many splits, so well above 2)
+
+#######################################
+# Series
+
+def seasonal_profile(month_idx, kwh):
+    """Average log kWh of each calendar month (12 values) relative to the panel average."""
+    y = np.log1p(np.asarray(kwh, dtype=np.float64))
+    valid = np.isfinite(y)
+    calendar = np.asarray(month_idx)[valid] % 12
+    totals = np.bincount(calendar, weights=y[valid], minlength=12)
+    counts = np.bincount(calendar, minlength=12)
+    profile = np.divide(totals, counts, out=np.zeros(12), where=counts > 0)
+    return np.where(counts > 0, profile - y[valid].mean(), 0.0) if valid.any() else profile
+
+
+def _compact(offsets, keep):
+    """Offsets of the contracts after dropping the rows not in `keep`."""
+    return np.r_[0, np.cumsum(keep, dtype=np.int64)][offsets]   # (reduceat miscounts empty contracts)
+
+#######################################
+# Detection
+
+def detect_drops(offsets, month_idx, kwh, profile=None, min_segment=MIN_SEGMENT, min_drop=MIN_DROP, min_t=MIN_T):
+    """
+    Best downward change point of every contract (rows offsets[i]:offsets[i + 1],
+    sorted by month). Returns a dict of per-contract arrays:
+
+        adoption_month_idx   first month at the lower level (-1: no valid split)
+        kwh_drop             relative fall in consumption at that split
+        t_stat               t-statistic of the fall
+        detected             the split passes min_drop and min_t
+        n_months             months with consumption
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    month_idx = np.asarray(month_idx)
+    y = np.log1p(np.asarray(kwh, dtype=np.float64))
+    if profile is not None:
+        y = y - profile[month_idx % 12]
+
+    # Months without consumption are left out of the series
+    keep = np.isfinite(y)
+    offsets, y, month_idx = _compact(offsets, keep), y[keep], month_idx[keep]
+    n_contracts, n_rows = len(offsets) - 1, len(y)
+    starts, n = offsets[:-1], np.diff(offsets)
+    result = {
+        "adoption_month_idx": np.full(n_contracts, -1, dtype=np.int64),
+        "kwh_drop": np.full(n_contracts, np.nan),
+        "t_stat": np.full(n_contracts, np.nan),
+        "detected": np.zeros(n_contracts, dtype=bool),
+        "n_months": n,
+    }
+    if not n_rows:
+        return result
+
+    # Contract and position of every row; splitting at row i puts rows before it in the first segment
+    contract = np.repeat(np.arange(n_contracts), n)
+    k = np.arange(n_rows) - starts[contract]
+    n_row = n[contract].astype(np.float64)
+
+    # Centre each series (keeps the cumulative sums small), then segment sums from cumulative sums
+    nonempty = n > 0
+    means = np.zeros(n_contracts)
+    means[nonempty] = np.add.reduceat(y, starts[nonempty]) / n[nonempty]
+    y = y - means[contract]
+    csum = np.concatenate([[0.0], np.cumsum(y)])
+    csq = np.concatenate([[0.0], np.cumsum(y * y)])
+    before = csum[np.arange(n_rows)] - csum[starts[contract]]     # sum of the rows before the split
+    sse = (csq[offsets[1:]] - csq[starts])[contract]              # total sum of squares (centred series)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_before = before / k
+        mean_after = -before / (n_row - k)                        # the series sums to 0
+        gain = k * (n_row - k) / n_row * (mean_before - mean_after) ** 2
+        valid = (k >= min_segment) & (n_row - k >= min_segment) & (mean_after < mean_before)
+        score = np.where(valid, gain, -np.inf)
+
+        # Best split of each contract: its highest score, then the first row reaching it
+        best = np.full(n_contracts, -np.inf)
+        best[nonempty] = np.maximum.reduceat(score, starts[nonempty])
+        first = np.where(score == best[contract], np.arange(n_rows), n_rows)
+        split = np.full(n_contracts, n_rows)
+        split[nonempty] = np.minimum.reduceat(first, starts[nonempty])
+
+        found = np.isfinite(best)
+        rows = split[found]
+        sigma2 = (sse[rows] - gain[rows]) / (n_row[rows] - 2)
+        t_stat = np.sqrt(gain[rows] / sigma2)
+        drop = 1 - np.exp(mean_after[rows] - mean_before[rows])
+
+    result["adoption_month_idx"][found] = month_idx[rows]
+    result["kwh_drop"][found] = drop
+    result["t_stat"][found] = np.where(sigma2 > 0, t_stat, np.inf)
+    result["detected"][found] = (drop >= min_drop) & (result["t_stat"][found] >= min_t)
+    return result
+
+
+def first_year(offsets, month_idx, flag):
+    """Year of each contract's first row where `flag` is set (-1: never)."""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    rows = np.where(np.asarray(flag, dtype=bool), np.arange(len(flag)), len(flag))
+    nonempty = np.diff(offsets) > 0
+    first = np.full(len(offsets) - 1, len(flag))
+    first[nonempty] = np.minimum.reduceat(rows, offsets[:-1][nonempty])
+    months = np.append(np.asarray(month_idx, dtype=np.int64), -1)[first]
+    return np.where(first < len(flag), BASE_YEAR + months // 12, -1)
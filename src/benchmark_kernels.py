@@ -0,0 +1,338 @@
+"""
+Track the performance of the pipeline's core kernels against stored baselines.
+
+A fixed workload (synthetic inputs from generate_synthetic.py, fixed seed, size
+and settings) is run through the stages that hold the kernels below, and each
+kernel is measured from the stages' telemetry steps (telemetry.py):
+
+    apportionment     1b expand_months + aggregate, 1c process_save
+    interval_join     2b join (pandas / polars hand-off)
+    spatial_join      3 join + nearest, 4 join + nearest, 6 assign_save
+    shs_rules         5b fix_years
+    schedule_merge    7 merge_save
+
+Every run is appended to a versioned history file (benchmarks/kernel_history.jsonl,
+kept in git with a baseline run of the reference machine). A run records the commit
+it measured (HEAD when it ran), so a run committed to the history names the commit
+before the one that adds it, and --baseline picks runs by the code they measured.
+Throughput (rows/s) and peak RSS of each kernel are compared with the median of the
+previous comparable runs (same workload and settings, CPU count, Python and package
+versions), and a kernel is flagged when it got slower or larger by more than the
+thresholds.
+The exit code is 1 when anything is flagged, so the command can gate a change.
+
+    python src/benchmark_kernels.py                        # run, compare, record
+    python src/benchmark_kernels.py --repeat 3 --profile   # median of 3 runs, then profile the slowest kernel
+    python src/benchmark_kernels.py --baseline 2a51fec     # compare with the runs of one commit
+
+--profile re-runs the stage of the slowest kernel under cProfile (or py-spy,
+writing a flamegraph, when it is installed) and saves the profile next to the
+history.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from importlib.metadata import PackageNotFoundError, version
+
+import pandas as pd
+
+import generate_synthetic
+from benchmark_stages import clear_outputs, measure
+from pipeline import SRC_DIR, select
+from telemetry import start_run
+
+# Paths
+REPO_DIR = os.path.dirname(SRC_DIR)
+HISTORY_FILE = os.path.join(REPO_DIR, "benchmarks", "kernel_history.jsonl")
+WORKLOAD_DIR = os.path.join(REPO_DIR, "benchmarks", "workload")
+PROFILE_DIR = os.path.join(REPO_DIR, "benchmarks", "profiles")
+
+HISTORY_FORMAT = 1   # bump when kernels or their measurement change, so old runs are not used as baselines
+
+# Fixed workload: the same inputs and settings on every run
+WORKLOAD = {"contracts": 20_000, "seed": 0}
+WORKLOAD_SETTINGS = {
+    "PIPELINE_N_BUCKETS": "16",
+    "PIPELINE_WORKERS": "1",          # buckets in the stage process, so cProfile sees them
+    "PIPELINE_CHUNK_WORKERS": "1",
+    "PIPELINE_INTERMEDIATE_FORMAT": "parquet",
+    "PIPELINE_TELEMETRY_FILE": "output/logs/telemetry.jsonl",
+}
+
+# Kernel: {stage: telemetry steps}
+KERNELS = {
+    "apportionment": {"1b": ["expand_months", "aggregate"], "1c": ["process_save"]},
+    "interval_join": {"2b": ["join"]},
+    "spatial_join": {"3": ["join", "nearest"], "4": ["join", "nearest"], "6": ["assign_save"]},
+    "shs_rules": {"5b": ["fix_years"]},
+    "schedule_merge": {"7": ["merge_save"]},
+}
+
+PACKAGES = ["pandas", "polars", "pyarrow", "duckdb", "geopandas", "shapely", "numpy"]
+
+#######################################
+# Workload
+
+def prepare_workload(workdir, contracts, seed):
+    """Write the synthetic inputs under workdir/data, unless the same ones are already there."""
+    marker = os.path.join(workdir, "data", "_workload.json")
+    wanted = {"contracts": contracts, "seed": seed}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == wanted:
+                return
+    print(f"Writing the workload: {contracts:,} synthetic contracts (seed {seed})")
+    shutil.rmtree(os.path.join(workdir, "output"), ignore_errors=True)
+    generate_synthetic.generate(workdir, contracts, seed)
+    with open(marker, "w") as f:
+        json.dump(wanted, f)
+
+
+def run_workload(stages):
+    """Run the stages from scratch, in the current folder and in pipeline order."""
+    for stage in stages:
+        clear_outputs(stage)
+        ok, wall, _ = measure(stage)
+        print(f"   {'✅' if ok else '❌'} {stage.name}: {wall:.1f}s")
+        if not ok:
+            raise SystemExit(f"Stage {stage.name} failed, see output/logs/{stage.name}.log")
+
+#######################################
+# Kernel measurements
+
+def kernel_results(telemetry, run_id):
+    """
+    {kernel: wall_s, rows, rows_per_s, peak_rss_mb} of one run, from its telemetry records.
+    Rows of a stage are those of its busiest kernel step (summed over buckets).
+    """
+    t = telemetry[(telemetry["run_id"] == run_id) & (telemetry["step"] != "log")]
+    results = {}
+    for kernel, steps in KERNELS.items():
+        wall = rows = peak = 0.0
+        for stage, names in steps.items():
+            records = t[(t["stage"] == stage) & t["step"].isin(names)]
+            if records.empty:
+                raise SystemExit(f"No telemetry for {kernel} ({stage}: {names}) in run {run_id}")
+            wall += records["wall_s"].sum()
+            rows += records.groupby("step")["rows_out"].sum().max()
+            peak = max(peak, records["peak_rss_mb"].max())
+        results[kernel] = {
+            "wall_s": round(wall, 4),
+            "rows": int(rows),
+            "rows_per_s": round(rows / wall) if wall else None,
+            "peak_rss_mb": round(peak, 1),
+        }
+    return results
+
+
+def slowest_stage(telemetry, run_id, kernel):
+    """The stage that spent the most time in a kernel's steps in one run."""
+    t = telemetry[telemetry["run_id"] == run_id]
+    walls = {stage: t.loc[(t["stage"] == stage) & t["step"].isin(names), "wall_s"].sum()
+             for stage, names in KERNELS[kernel].items()}
+    return select([max(walls, key=walls.get)], only=True)[0]
+
+
+def median_results(runs):
+    """Per-kernel median of several runs' results."""
+    return {
+        kernel: {
+            key: pd.Series([run[kernel][key] for run in runs]).median().round(4).item()
+            for key in runs[0][kernel]
+        }
+        for kernel in runs[0]
+    }
+
+#######################################
+# History
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", "-C", REPO_DIR, *args], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _package_versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def make_entry(results, contracts, seed, repeat):
+    return {
+        "format": HISTORY_FORMAT,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git("rev-parse", "--short", "HEAD"),
+        "uncommitted_changes": bool(_git("status", "--porcelain", "--untracked-files=no", "src")),
+        "machine": {"host": platform.node(), "cpus": os.cpu_count(), "python": platform.python_version()},
+        "packages": _package_versions(),
+        "repeat": repeat,
+        "workload": {"contracts": contracts, "seed": seed, **WORKLOAD_SETTINGS},
+        "kernels": results,
+    }
+
+
+def load_history(path=HISTORY_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def comparable(entry, other):
+    """
+    Runs that can serve as each other's baseline: same history format and workload,
+    on the same kind of machine (CPU count, Python and package versions). The host
+    name is recorded but not compared, so a fresh checkout or CI runner with the
+    same setup is checked against the runs committed with the history.
+    """
+    return (other["format"] == entry["format"]
+            and other["workload"] == entry["workload"]
+            and other["machine"]["cpus"] == entry["machine"]["cpus"]
+            and other["machine"]["python"] == entry["machine"]["python"]
+            and other["packages"] == entry["packages"])
+
+
+def baseline(entry, history, commit=None, last=5):
+    """Median results of the last `last` comparable runs (or of the comparable runs of `commit`)."""
+    runs = [h for h in history if comparable(entry, h)]
+    if commit:
+        runs = [h for h in runs if h["commit"] and h["commit"].startswith(commit)]
+    else:
+        runs = runs[-last:]
+    runs = [h["kernels"] for h in runs if h["kernels"].keys() == entry["kernels"].keys()]
+    return (median_results(runs), len(runs)) if runs else (None, 0)
+
+
+def compare(results, base, max_slowdown, max_memory_growth, min_seconds):
+    """Table of kernels against the baseline, with a `regression` column."""
+    rows = []
+    for kernel, r in results.items():
+        b = base[kernel]
+        throughput = r["rows_per_s"] / b["rows_per_s"] - 1 if b["rows_per_s"] else 0.0
+        memory = r["peak_rss_mb"] / b["peak_rss_mb"] - 1 if b["peak_rss_mb"] else 0.0
+        flags = []
+        # Short kernels are noisy: a slowdown also has to cost min_seconds to count
+        if throughput < -max_slowdown and r["wall_s"] - b["wall_s"] > min_seconds:
+            flags.append("throughput")
+        if memory > max_memory_growth:
+            flags.append("memory")
+        rows.append({
+            "kernel": kernel,
+            "wall_s": r["wall_s"],
+            "baseline_wall_s": b["wall_s"],
+            "rows_per_s": r["rows_per_s"],
+            "baseline_rows_per_s": b["rows_per_s"],
+            "throughput_change": f"{throughput:+.1%}",
+            "peak_rss_mb": r["peak_rss_mb"],
+            "baseline_peak_rss_mb": b["peak_rss_mb"],
+            "memory_change": f"{memory:+.1%}",
+            "regression": ", ".join(flags),
+        })
+    return pd.DataFrame(rows)
+
+#######################################
+# Profiling
+
+def profile(stage, name):
+    """Re-run one stage under py-spy (flamegraph) or cProfile; returns the profile path."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    clear_outputs(stage)
+    script = os.path.join(SRC_DIR, stage.script)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    if shutil.which("py-spy"):
+        path = os.path.join(PROFILE_DIR, f"{name}-{stamp}.svg")
+        cmd = ["py-spy", "record", "--subprocesses", "--output", path, "--", sys.executable, script]
+    else:
+        path = os.path.join(PROFILE_DIR, f"{name}-{stamp}.prof")
+        cmd = [sys.executable, "-m", "cProfile", "-o", path, script]
+    print(f"\nProfiling {name} (stage {stage.name}) with {cmd[0] if cmd[0] == 'py-spy' else 'cProfile'}")
+    subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+    if path.endswith(".prof"):
+        import pstats
+        pstats.Stats(path).sort_stats("cumulative").print_stats(25)
+    return path
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline kernels against stored baselines.")
+    parser.add_argument("--contracts", type=int, default=WORKLOAD["contracts"], help="size of the workload")
+    parser.add_argument("--seed", type=int, default=WORKLOAD["seed"], help="seed of the workload")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of the workload; the median is kept")
+    parser.add_argument("--baseline", metavar="COMMIT", help="compare with the runs of this commit")
+    parser.add_argument("--max-slowdown", type=float, default=0.20,
+                        help="flag kernels whose rows/s dropped by more than this fraction (default 0.20)")
+    parser.add_argument("--max-memory-growth", type=float, default=0.20,
+                        help="flag kernels whose peak RSS grew by more than this fraction (default 0.20)")
+    parser.add_argument("--min-seconds", type=float, default=0.1,
+                        help="ignore slowdowns of less than this many seconds (default 0.1)")
+    parser.add_argument("--profile", action="store_true", help="profile the slowest kernel afterwards")
+    parser.add_argument("--no-record", action="store_true", help="do not add this run to the history")
+    parser.add_argument("--workdir", default=WORKLOAD_DIR, help="folder of the workload inputs and outputs")
+    args = parser.parse_args()
+
+    os.environ.update(WORKLOAD_SETTINGS)
+    os.environ.pop("PIPELINE_DIRTY_CONTRACTS", None)
+    os.makedirs(args.workdir, exist_ok=True)
+    prepare_workload(args.workdir, args.contracts, args.seed)
+    os.chdir(args.workdir)
+
+    stages = select(sorted({stage for steps in KERNELS.values() for stage in steps}))
+    telemetry_file = WORKLOAD_SETTINGS["PIPELINE_TELEMETRY_FILE"]
+    if os.path.exists(telemetry_file):
+        os.remove(telemetry_file)
+
+    runs = []
+    for i in range(args.repeat):
+        print(f"\n=== Run {i + 1} of {args.repeat} ===")
+        run_id = start_run()
+        run_workload(stages)
+        runs.append(kernel_results(pd.read_json(telemetry_file, lines=True), run_id))
+    results = median_results(runs)
+
+    history = load_history()
+    entry = make_entry(results, args.contracts, args.seed, args.repeat)
+    base, n_base = baseline(entry, history, args.baseline)
+
+    regressions = []
+    if base is None:
+        print("\n No comparable baseline yet.")
+        print(pd.DataFrame(results).T.to_string())
+    else:
+        table = compare(results, base, args.max_slowdown, args.max_memory_growth, args.min_seconds)
+        source = f"commit {args.baseline}" if args.baseline else "previous runs"
+        print(f"\n Kernels against the median of {n_base} comparable run(s) ({source}):")
+        print(table.to_string(index=False))
+        regressions = table.loc[table["regression"] != "", "kernel"].tolist()
+        entry["regressions"] = regressions
+        print(f"\n{'⚠️  Regressions: ' + ', '.join(regressions) if regressions else '✅ No regressions'}")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f" Recorded in {HISTORY_FILE}")
+
+    if args.profile:
+        slowest = max(results, key=lambda k: results[k]["wall_s"])
+        stage = slowest_stage(pd.read_json(telemetry_file, lines=True), run_id, slowest)
+        print(f" Profile saved to {profile(stage, slowest)}")
+
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,152 @@
+"""
+Benchmark each pipeline stage: wall time, rows read and written, rows/s and peak memory.
+
+Stages run one at a time in pipeline order, each in a fresh process and from
+scratch (its previous outputs are removed first), so the numbers are per stage.
+Peak RSS is that of the largest single process of the stage (the script itself
+or one of its bucket workers), as reported by the OS when the stage exits. Rows are counted from the Parquet / Arrow footers and CSV
+lines of the stage's declared inputs and outputs (pipeline.STAGES).
+
+Run from the folder holding data/ (e.g. the synthetic inputs of generate_synthetic.py):
+
+    python ../src/benchmark_stages.py --generate 100000     # write 100k synthetic contracts, then run all stages
+    python ../src/benchmark_stages.py 5b 5c 6                # just these stages, on the data already there
+
+Results are appended to output/benchmarks/stage_throughput.csv, so runs at
+different scales end up in one table.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import generate_synthetic
+import settings
+from pipeline import LOG_DIR, SRC_DIR, select
+from storage import is_ipc
+from telemetry import start_run
+
+# Paths
+OUTPUT_FILE = "output/benchmarks/stage_throughput.csv"
+
+#######################################
+# Row counts
+
+def _files(path):
+    """Data files under a path (file, folder or glob)."""
+    if any(ch in path for ch in "*?["):
+        paths = glob.glob(path)
+    elif os.path.isdir(path):
+        paths = glob.glob(os.path.join(path, "**", "*"), recursive=True)
+    else:
+        paths = [path]
+    return [p for p in paths if os.path.isfile(p) and p.endswith((".parquet", ".arrow", ".csv"))
+            and not os.path.basename(p).startswith("_")]
+
+
+def count_rows(path):
+    """Rows of one Parquet, Arrow IPC or CSV file, without reading the data."""
+    if path.endswith(".csv"):
+        with open(path, "rb") as f:
+            return max(sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 24), b"")) - 1, 0)
+    if is_ipc(path):
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+    return pq.ParquetFile(path).metadata.num_rows
+
+
+def dataset_rows(paths):
+    return sum(count_rows(f) for path in paths for f in _files(path))
+
+#######################################
+# Measurement
+
+def clear_outputs(stage):
+    """Remove a stage's outputs, so it does all its work (4 would otherwise resume from its checkpoints)."""
+    for path in stage.outputs:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def measure(stage):
+    """Run one stage script in a fresh process. Returns (success, wall seconds, peak RSS in MB)."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with open(os.path.join(LOG_DIR, f"{stage.name}.log"), "w") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(SRC_DIR, stage.script)],
+                                stdout=log, stderr=subprocess.STDOUT)
+        # wait4 reports the largest RSS of the process and of the workers it waited for
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    return os.waitstatus_to_exitcode(status) == 0, wall, usage.ru_maxrss / 1024
+
+
+def benchmark(stages, contracts=None):
+    rows = []
+    run_id = start_run()
+    for stage in stages:
+        print(f"▶️  {stage.name}: running {stage.script}")
+        rows_in = dataset_rows(stage.inputs)
+        clear_outputs(stage)
+        ok, wall, peak_rss_mb = measure(stage)
+        if not ok:
+            print(f"❌ {stage.name}: failed, see {LOG_DIR}/{stage.name}.log")
+            break
+        rows_out = dataset_rows(stage.outputs)
+        rows.append({
+            "run_id": run_id,
+            "stage": stage.name,
+            "contracts": contracts,
+            "n_buckets": settings.N_BUCKETS,
+            "n_workers": settings.N_WORKERS,
+            "format": settings.INTERMEDIATE_FORMAT,
+            "rows_in": rows_in,
+            "rows_out": rows_out,
+            "wall_s": round(wall, 3),
+            "rows_per_s": round(rows_in / wall) if wall else None,
+            "peak_rss_mb": round(peak_rss_mb, 1),
+        })
+        print(f"✅ {stage.name}: {wall:.1f}s, {rows_in:,} rows in, {rows_out:,} rows out, "
+              f"peak RSS {peak_rss_mb:,.0f} MB")
+    return pd.DataFrame(rows)
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages.")
+    parser.add_argument("stages", nargs="*", help="stages to run (default: all), e.g. 5b 5c")
+    parser.add_argument("--generate", type=int, metavar="CONTRACTS",
+                        help="first write synthetic inputs for this many contracts to data/")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic inputs")
+    args = parser.parse_args()
+
+    if args.generate:
+        start = time.time()
+        generate_synthetic.generate(".", args.generate, args.seed)
+        print(f"Synthetic inputs for {args.generate:,} contracts written in {time.time() - start:.1f}s\n")
+
+    results = benchmark(select(args.stages, only=True), args.generate)
+    if results.empty:
+        sys.exit(1)
+
+    print("\n" + results.to_string(index=False))
+    print(f"\n Total: {results['wall_s'].sum():.1f}s, largest peak RSS {results['peak_rss_mb'].max():,.0f} MB")
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    results.to_csv(OUTPUT_FILE, mode="a", index=False, header=not os.path.exists(OUTPUT_FILE))
+    print(f"\n Saved benchmark to {OUTPUT_FILE}")
@@ -0,0 +1,134 @@
+"""
+Point-to-load-shedding-block lookup for stage 6.
+
+A uniform grid is laid over the blocks once. Each cell is either
+  - owned: entirely inside one block (the block's interior), or
+  - empty: touching no block, or
+  - ambiguous: touching a block boundary; it keeps the list of candidate blocks.
+Points in owned and empty cells are resolved with an array index. Only points in
+ambiguous cells are tested against the (prepared) candidate polygons.
+
+Tie-break rule for points that touch more than one block (shared boundaries,
+overlapping polygons): a block whose interior contains the point wins over a
+block the point only touches; among equals, the block with the smallest block id
+wins. Every point gets at most one block, so rows are never duplicated.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+NO_BLOCK = -1
+AMBIGUOUS = -2
+
+
+class BlockLookup:
+    """Grid index over block polygons; lookup(x, y) returns block row positions (-1 = no block)."""
+
+    def __init__(self, geometries, block_ids, resolution=512):
+        self.geoms = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geoms)
+        n_blocks = len(self.geoms)
+
+        # Tie-break rank: position of each block when sorted by block id
+        self.rank = np.empty(n_blocks, dtype=np.int64)
+        self.rank[np.argsort(np.asarray(block_ids), kind="stable")] = np.arange(n_blocks)
+
+        # Grid over the extent of all blocks
+        self.minx, self.miny, self.maxx, self.maxy = shapely.total_bounds(self.geoms)
+        self.cell = max(self.maxx - self.minx, self.maxy - self.miny) / resolution
+        self.nx = max(int(np.ceil((self.maxx - self.minx) / self.cell)), 1)
+        self.ny = max(int(np.ceil((self.maxy - self.miny) / self.cell)), 1)
+
+        ix, iy = np.meshgrid(np.arange(self.nx), np.arange(self.ny))
+        ix, iy = ix.ravel(), iy.ravel()
+        cells = shapely.box(
+            self.minx + ix * self.cell, self.miny + iy * self.cell,
+            self.minx + (ix + 1) * self.cell, self.miny + (iy + 1) * self.cell
+        )
+
+        # Candidate (cell, block) pairs, then cells fully inside one block's interior
+        tree = shapely.STRtree(self.geoms)
+        cell_idx, block_idx = tree.query(cells, predicate="intersects")
+        n_candidates = np.bincount(cell_idx, minlength=len(cells))
+        inside = shapely.contains_properly(self.geoms[block_idx], cells[cell_idx])
+
+        self.owner = np.full(len(cells), NO_BLOCK, dtype=np.int64)
+        self.owner[n_candidates > 0] = AMBIGUOUS
+        single = inside & (n_candidates[cell_idx] == 1)
+        self.owner[cell_idx[single]] = block_idx[single]
+
+        # Candidate blocks of ambiguous cells, CSR layout (sorted by cell)
+        keep = self.owner[cell_idx] == AMBIGUOUS
+        order = np.argsort(cell_idx[keep], kind="stable")
+        self.cand_blocks = block_idx[keep][order]
+        self.cand_offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell_idx[keep], minlength=len(cells)), out=self.cand_offsets[1:])
+
+    def cell_of(self, x, y):
+        """Grid cell of each point (-1 outside the grid or for missing coordinates)."""
+        with np.errstate(invalid="ignore"):
+            valid = (x >= self.minx) & (x <= self.maxx) & (y >= self.miny) & (y <= self.maxy)
+        # Points on the top/right edge of the extent belong to the last cell
+        ix = np.minimum(np.floor((x[valid] - self.minx) / self.cell).astype(np.int64), self.nx - 1)
+        iy = np.minimum(np.floor((y[valid] - self.miny) / self.cell).astype(np.int64), self.ny - 1)
+        cell = np.full(len(x), -1, dtype=np.int64)
+        cell[valid] = iy * self.nx + ix
+        return cell
+
+    def lookup(self, x, y):
+        """
+        Block row position for each point.
+        Returns (blocks, stats) where stats counts how each point was resolved.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cell = self.cell_of(x, y)
+        blocks = np.full(len(x), NO_BLOCK, dtype=np.int64)
+        in_grid = cell >= 0
+        blocks[in_grid] = self.owner[cell[in_grid]]
+
+        ambiguous = np.flatnonzero(blocks == AMBIGUOUS)
+        stats = {"grid": int((blocks >= 0).sum()), "polygon_test": len(ambiguous), "boundary_ties": 0}
+        if len(ambiguous):
+            blocks[ambiguous], stats["boundary_ties"] = self._resolve(ambiguous, cell, x, y)
+        stats["no_block"] = int((blocks == NO_BLOCK).sum())
+        return blocks, stats
+
+    def _resolve(self, points, cell, x, y):
+        """Test points of ambiguous cells against their candidate blocks and apply the tie-break."""
+        starts = self.cand_offsets[cell[points]]
+        counts = self.cand_offsets[cell[points] + 1] - starts
+
+        # One (point, candidate block) pair per row
+        pair_point = np.repeat(np.arange(len(points)), counts)
+        pair_pos = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_block = self.cand_blocks[np.repeat(starts, counts) + pair_pos]
+
+        geoms = shapely.points(x[points][pair_point], y[points][pair_point])
+        touches = shapely.intersects(self.geoms[pair_block], geoms)
+        interior = shapely.contains_properly(self.geoms[pair_block], geoms)
+
+        # Lower key wins: interior before boundary-only, then smallest block id
+        n_blocks = len(self.geoms)
+        key = np.where(interior, 0, n_blocks) + self.rank[pair_block]
+        best = np.full(len(points), 2 * n_blocks, dtype=np.int64)
+        np.minimum.at(best, pair_point[touches], key[touches])
+
+        hits = np.bincount(pair_point[touches], minlength=len(points))
+        resolved = np.full(len(points), NO_BLOCK, dtype=np.int64)
+        found = best < 2 * n_blocks
+        resolved[found] = np.argsort(self.rank)[best[found] % n_blocks]
+        return resolved, int((hits > 1).sum())
+
+
+def point_coordinates(wkt_values):
+    """x, y of each WKT geometry (points as-is, other shapes via a point on their surface)."""
+    values = pd.Series(wkt_values, dtype="object")
+    geoms = shapely.from_wkt(values.where(values.notna(), None).to_numpy(), on_invalid="ignore")
+    is_point = shapely.get_type_id(geoms) == 0
+    points = np.where(is_point, geoms, shapely.point_on_surface(geoms))
+    return shapely.get_x(points), shapely.get_y(points)
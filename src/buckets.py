@@ -0,0 +1,191 @@
+"""
+Contract-hash partitioned datasets for the intermediate stages (2b to 7).
+
+A dataset is a folder with one file per bucket:
+
+    output/2b_out/out_contract_with_location/part-00000.parquet
+    output/2b_out/out_contract_with_location/part-00001.parquet
+    ...
+
+Bucket files are Parquet or Arrow IPC (.arrow), as set by
+PIPELINE_INTERMEDIATE_FORMAT (see storage.py); final outputs are zstd Parquet.
+
+Every row of a contract lands in the same bucket, so all per-contract work
+(sorting, ffill, SHS rules, registration fill) can run one bucket at a time.
+
+Buckets are written and read back with the registry's categorical columns
+(schema.CATEGORICAL_COLUMNS) as categoricals, whatever engine produced them.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import glob
+import multiprocessing as mp
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from chunking import ChunkPlanner
+from schema import pl_categorical, project_columns, require_columns, to_categorical
+from settings import N_BUCKETS, N_WORKERS
+from storage import FORMATS, INTERMEDIATE_FORMAT, extension, iter_batches, pl_write, read_schema, read_table, write_frame
+
+BUCKET_KEY = "contract_ID"
+PANEL_ORDER = [BUCKET_KEY, "month_idx"]   # row order of the monthly panels (recorded by 2b, 5a and 5b)
+PART_PATTERN = re.compile(r"part-(\d+)\.(parquet|arrow)$")
+EXTENSIONS = sorted({f["extension"] for f in FORMATS.values()})
+
+#######################################
+# Hashing
+
+def bucket_ids(keys, n_buckets=N_BUCKETS):
+    """
+    Return the bucket number of each key.
+    Uses pandas' fixed-key hash, so a key maps to the same bucket in every stage and run.
+    """
+    keys = pd.Series(keys).astype("string")
+    hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+    return (hashes % np.uint64(n_buckets)).astype(np.int32)
+
+#######################################
+# Paths
+
+def bucket_path(dataset_dir, bucket, fmt=None):
+    """
+    Path of one bucket file. fmt=None: the bucket's existing file, whatever its
+    format, or a new file in the intermediate format; otherwise a file in `fmt`.
+    """
+    if fmt is None:
+        for ext in EXTENSIONS:
+            path = os.path.join(dataset_dir, f"part-{bucket:05d}{ext}")
+            if os.path.exists(path):
+                return path
+        fmt = INTERMEDIATE_FORMAT
+    return os.path.join(dataset_dir, f"part-{bucket:05d}{extension(fmt)}")
+
+
+def list_buckets(dataset_dir):
+    """Sorted bucket numbers present in a dataset folder."""
+    files = glob.glob(os.path.join(dataset_dir, "part-*"))
+    return sorted({int(PART_PATTERN.search(f).group(1)) for f in files if PART_PATTERN.search(f)})
+
+
+def reset_dataset(dataset_dir):
+    """Create the dataset folder and remove bucket (and half-written or staged) files left over from a previous run."""
+    os.makedirs(dataset_dir, exist_ok=True)
+    for pattern in ["part-*", "staged-*"]:
+        for f in glob.glob(os.path.join(dataset_dir, pattern)):
+            os.remove(f)
+
+#######################################
+# Read / write
+
+def write_buckets(df, dataset_dir, key=BUCKET_KEY, n_buckets=N_BUCKETS, sorted_by=None):
+    """
+    Split df into hash buckets on `key` and write one file per bucket.
+    sorted_by: the columns df is sorted by, recorded in every bucket (splitting keeps the row order).
+    """
+    reset_dataset(dataset_dir)
+    df = to_categorical(df)
+    ids = bucket_ids(df[key], n_buckets)
+    for bucket in np.unique(ids):
+        write_frame(df[ids == bucket], bucket_path(dataset_dir, bucket), sorted_by=sorted_by)
+    return len(np.unique(ids))
+
+
+def write_polars_buckets(df, dataset_dir, key=BUCKET_KEY, n_buckets=N_BUCKETS, sorted_by=None):
+    """write_buckets for a polars DataFrame (same hash, so buckets line up with pandas-written datasets)."""
+    reset_dataset(dataset_dir)
+    ids = bucket_ids(df[key].to_pandas(), n_buckets)
+    parts = pl_categorical(df).with_columns(pl.Series("_bucket", ids)).partition_by("_bucket")
+    for part in parts:
+        pl_write(part.drop("_bucket"), bucket_path(dataset_dir, int(part["_bucket"][0])), sorted_by=sorted_by)
+    return len(parts)
+
+
+def write_bucket(df, dataset_dir, bucket, fmt=INTERMEDIATE_FORMAT, sorted_by=None):
+    write_frame(to_categorical(df), bucket_path(dataset_dir, bucket, fmt), fmt, sorted_by=sorted_by)
+
+
+def contract_mask(data, contracts, key=BUCKET_KEY):
+    """Boolean Arrow mask of the rows of an Arrow table / record batch whose `key` is in `contracts`."""
+    values = pc.cast(data.column(key), pa.large_string())
+    return pc.fill_null(pc.is_in(values, value_set=pa.array(sorted(contracts), pa.large_string())), False)
+
+
+def _read_columns(path, columns, exclude, required, contracts):
+    selected = project_columns(path, columns=columns, exclude=exclude)
+    if required:
+        require_columns(selected, required, path)
+    if contracts is not None and BUCKET_KEY not in selected:
+        raise ValueError(f"Filtering {path} on contracts needs the {BUCKET_KEY} column")
+    return selected
+
+
+def read_bucket_table(dataset_dir, bucket, columns=None, exclude=None, required=None, contracts=None):
+    """
+    Read one bucket as an Arrow table, pushing the column projection down into the reader
+    (Arrow IPC buckets are memory mapped, so unread columns are never touched).
+    columns: read only these; exclude: skip these; required: must exist even when reading all columns;
+    contracts: keep only the rows of these contract_IDs (incremental runs).
+    """
+    path = bucket_path(dataset_dir, bucket)
+    table = read_table(path, columns=_read_columns(path, columns, exclude, required, contracts))
+    return table if contracts is None else table.filter(contract_mask(table, contracts))
+
+
+def read_bucket(dataset_dir, bucket, columns=None, exclude=None, required=None, contracts=None):
+    """Read one bucket as pandas (same projection rules as read_bucket_table)."""
+    table = read_bucket_table(dataset_dir, bucket, columns=columns, exclude=exclude,
+                              required=required, contracts=contracts)
+    return to_categorical(table.to_pandas())
+
+
+def iter_bucket(dataset_dir, bucket, chunk_rows, columns=None, exclude=None, required=None, contracts=None):
+    """
+    Read one bucket as pandas chunks (same projection rules as read_bucket) of at most
+    chunk_rows rows, or of the size chosen by a chunking.ChunkPlanner passed as chunk_rows.
+    """
+    path = bucket_path(dataset_dir, bucket)
+    selected = _read_columns(path, columns, exclude, required, contracts)
+    planner = chunk_rows if isinstance(chunk_rows, ChunkPlanner) else None
+    batches = iter_batches(path, planner.min_rows if planner else chunk_rows, columns=selected)
+    if planner:
+        batches = planner.regroup(batches)
+    for batch in batches:
+        if contracts is not None:
+            batch = batch.filter(contract_mask(batch, contracts))
+            if not batch.num_rows:
+                continue
+        df = to_categorical(batch.to_pandas())
+        yield df
+        if planner:
+            planner.observe(df)
+
+
+def bucket_schema(dataset_dir, bucket, exclude=None):
+    """Arrow schema of one bucket, without pandas metadata and `exclude` columns."""
+    schema = read_schema(bucket_path(dataset_dir, bucket)).remove_metadata()
+    return pa.schema([f for f in schema if f.name not in set(exclude or [])])
+
+#######################################
+# Execution
+
+def map_buckets(func, buckets, workers=N_WORKERS):
+    """
+    Call func(bucket) for every bucket and return the results in bucket order.
+    With workers > 1 the buckets run in a process pool (func must be a module-level function).
+    Workers are spawned, not forked: polars and DuckDB thread pools are not fork-safe.
+    """
+    buckets = list(buckets)
+    if workers <= 1 or len(buckets) <= 1:
+        return [func(b) for b in buckets]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        return list(pool.map(func, buckets))
@@ -0,0 +1,152 @@
+"""
+Memory-budget chunk sizing for the chunked readers (1a, 2a, 4, 6, 7).
+
+A ChunkPlanner turns the run's memory budget (settings.MEMORY_BUDGET_MB) into
+rows per chunk. The first chunk is a small sample: its in-memory size gives the
+bytes per row, which times the stage's working factor (the copies a chunk goes
+through while it is processed) and the chunks in flight gives the memory one
+row costs. The chunk size is then the largest that fits in the budget left
+over by what the process holds when the planner is made (so make it after
+loading lookup tables, e.g. the buildings in 4).
+
+While reading, the planner keeps adapting: the bytes per row follow the chunks
+read, the chunk shrinks when the process' resident memory goes over the budget
+and grows back (up to a limit) when it stays well under it.
+
+    planner = ChunkPlanner("4", working_factor=8)
+    for chunk in planner.read_csv(path, low_memory=False):    # CSV inputs
+        ...
+    for chunk in iter_bucket(dataset_dir, bucket, planner):   # bucket datasets (buckets.py)
+        ...
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from settings import MEMORY_BUDGET_MB, N_WORKERS
+
+MB = 1024 ** 2
+
+# Set up
+SAMPLE_ROWS = 10_000        # first chunk, used to measure the bytes per row
+MIN_ROWS = 10_000
+MAX_ROWS = 2_000_000
+MIN_FREE_SHARE = 0.1        # chunks always get at least this share of the budget
+MIN_SCALE, MAX_SCALE = 1 / 16, 4.0   # how far the measured memory can shrink or grow the planned chunk
+SMOOTHING = 0.5             # weight of the latest chunk in the bytes-per-row estimate
+
+#######################################
+# Memory
+
+def physical_memory_mb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / MB
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def current_rss_mb():
+    """Resident memory of this process now (not its peak), or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / MB
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def memory_budget_mb(workers=N_WORKERS):
+    """Budget of one stage process: the run's budget (default half of physical memory) shared by the bucket workers."""
+    total = MEMORY_BUDGET_MB or (physical_memory_mb() or 8192) / 2
+    return total / max(workers, 1)
+
+#######################################
+# Planner
+
+class ChunkPlanner:
+    """Rows per chunk for one stage, from a memory budget and the chunks read so far."""
+
+    def __init__(self, name, working_factor=3.0, in_flight=1, budget_mb=None,
+                 min_rows=MIN_ROWS, max_rows=MAX_ROWS):
+        self.name = name
+        self.working_factor = working_factor
+        self.in_flight = max(in_flight, 1)
+        self.budget_mb = budget_mb or memory_budget_mb()
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.held_mb = current_rss_mb() or 0.0   # memory in use before any chunk
+        self.bytes_per_row = None
+        self.scale = 1.0
+        self.rows = min(SAMPLE_ROWS, max_rows)
+
+    def _plan(self):
+        free_mb = max(self.budget_mb - self.held_mb, MIN_FREE_SHARE * self.budget_mb)
+        row_bytes = self.bytes_per_row * self.working_factor * self.in_flight
+        rows = int(free_mb * MB / row_bytes * self.scale) if row_bytes else self.max_rows
+        self.rows = min(max(rows, self.min_rows), self.max_rows)
+
+    def observe(self, df):
+        """Update the plan after a chunk (a pandas DataFrame) has been read and processed."""
+        if len(df):
+            bytes_per_row = df.memory_usage(deep=True).sum() / len(df)
+            first = self.bytes_per_row is None
+            self.bytes_per_row = bytes_per_row if first else (
+                SMOOTHING * bytes_per_row + (1 - SMOOTHING) * self.bytes_per_row)
+            if first:
+                self._plan()
+                print(f"   📏 {self.name}: chunks of {self.rows:,} rows (~{self.bytes_per_row:,.0f} bytes/row, "
+                      f"x{self.working_factor:g} working, x{self.in_flight} in flight, "
+                      f"budget {self.budget_mb:,.0f} MB, {self.held_mb:,.0f} MB already held)")
+                return
+
+        rss = current_rss_mb()
+        if rss is not None and self.bytes_per_row is not None:
+            if rss > self.budget_mb:
+                rows = self.rows
+                self.scale = max(self.scale * 0.9 * self.budget_mb / rss, MIN_SCALE)
+                self._plan()
+                if self.rows < rows:
+                    print(f"   📏 {self.name}: RSS {rss:,.0f} MB over the {self.budget_mb:,.0f} MB budget, "
+                          f"chunks down to {self.rows:,} rows")
+                return
+            if rss < 0.5 * self.budget_mb and self.scale < MAX_SCALE:
+                self.scale = min(self.scale * 1.25, MAX_SCALE)
+        if self.bytes_per_row is not None:
+            self._plan()
+
+    #######################################
+    # Readers
+
+    def read_csv(self, path, skip_rows=0, **kwargs):
+        """pd.read_csv in chunks of the planned size, after the first skip_rows data rows."""
+        if skip_rows:
+            kwargs["skiprows"] = lambda i: 0 < i <= skip_rows   # keep the header
+        with pd.read_csv(path, chunksize=self.rows, **kwargs) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(self.rows)
+                except StopIteration:
+                    return
+                if chunk.empty:   # every row skipped
+                    return
+                yield chunk
+                self.observe(chunk)
+
+    def regroup(self, batches):
+        """
+        Regroup a stream of small Arrow record batches into tables of the planned
+        size. The caller calls observe() on each chunk it converts.
+        """
+        pending, rows = [], 0
+        for batch in batches:
+            pending.append(batch)
+            rows += batch.num_rows
+            if rows >= self.rows:
+                yield pa.Table.from_batches(pending)
+                pending, rows = [], 0
+        if pending:
+            yield pa.Table.from_batches(pending)
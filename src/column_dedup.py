@@ -0,0 +1,170 @@
+"""
+Find and drop columns that hold identical data, even if their names differ.
+
+Each column is hashed once, in row chunks, with pandas' vectorized hashing.
+Only columns whose fingerprints collide are compared element by element,
+instead of comparing every pair of columns over the full panel.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import hashlib
+
+import pandas as pd
+
+from storage import iter_batches, read_schema, read_table
+
+CHUNK_ROWS = 1_000_000
+
+#######################################
+# Fingerprints
+
+def _update(digest, series):
+    """Feed one chunk of a column into a running digest."""
+    try:
+        hashes = pd.util.hash_pandas_object(series, index=False)
+    except TypeError:
+        # Unhashable objects (e.g. lists): hash their text form instead
+        hashes = pd.util.hash_pandas_object(series.astype(str), index=False)
+    digest.update(hashes.to_numpy().tobytes())
+
+
+def column_fingerprint(series, chunk_rows=CHUNK_ROWS):
+    """Digest of a column's dtype and values. Equal columns always get equal fingerprints."""
+    digest = hashlib.blake2b(str(series.dtype).encode(), digest_size=16)
+    for start in range(0, len(series), chunk_rows):
+        _update(digest, series.iloc[start:start + chunk_rows])
+    return digest.hexdigest()
+
+
+def parquet_column_fingerprint(path, column, chunk_rows=CHUNK_ROWS):
+    """Same as column_fingerprint, but streams one column of a Parquet (or Arrow IPC) file in row batches."""
+    digest = hashlib.blake2b(str(read_schema(path).field(column).type).encode(), digest_size=16)
+    for batch in iter_batches(path, chunk_rows, columns=[column]):
+        _update(digest, batch.column(0).to_pandas())
+    return digest.hexdigest()
+
+
+def _group_identical(columns, fingerprint, equals):
+    """Group columns by fingerprint, then confirm each collision with equals(a, b)."""
+    by_fingerprint = {}
+    for col in columns:
+        by_fingerprint.setdefault(fingerprint(col), []).append(col)
+
+    groups = []
+    for candidates in by_fingerprint.values():
+        # Confirm collisions (a hash match is not proof of equality)
+        while len(candidates) > 1:
+            first, rest = candidates[0], candidates[1:]
+            same = [c for c in rest if equals(first, c)]
+            if same:
+                groups.append([first] + same)
+            candidates = [c for c in rest if c not in same]
+    return sorted(groups, key=lambda g: columns.index(g[0]))
+
+
+def find_identical_columns(df, columns=None, chunk_rows=CHUNK_ROWS):
+    """
+    Groups of columns with identical data, each group in column order.
+    Columns are only compared with .equals() when their fingerprints collide.
+    """
+    return _group_identical(
+        list(df.columns if columns is None else columns),
+        lambda col: column_fingerprint(df[col], chunk_rows),
+        lambda a, b: df[a].equals(df[b]),
+    )
+
+
+def find_identical_parquet_columns(path, columns=None, chunk_rows=CHUNK_ROWS):
+    """find_identical_columns for a Parquet (or Arrow IPC) file, holding at most two columns in memory."""
+    def equals(a, b):
+        pair = read_table(path, columns=[a, b]).to_pandas()
+        return pair[a].equals(pair[b])
+
+    return _group_identical(
+        list(read_schema(path).names if columns is None else columns),
+        lambda col: parquet_column_fingerprint(path, col, chunk_rows),
+        equals,
+    )
+
+
+def common_groups(groups_per_part, columns):
+    """
+    Groups of columns that are identical in every part (e.g. every hash bucket).
+    groups_per_part: one find_identical_columns() result per part.
+    """
+    keys = {col: [] for col in columns}
+    for groups in groups_per_part:
+        label = {col: col for col in columns}
+        for group in groups:
+            for col in group:
+                label[col] = group[0]
+        for col in columns:
+            keys[col].append(label.get(col))
+
+    by_key = {}
+    for col in columns:
+        by_key.setdefault(tuple(keys[col]), []).append(col)
+    return [g for g in by_key.values() if len(g) > 1]
+
+#######################################
+# Dropping
+
+def plan_drops(groups, protect=()):
+    """
+    Decide which column of each group to keep: the first one, unless the group
+    contains protected columns, which are always kept.
+    Returns {kept column: [dropped columns]}.
+    """
+    merged = {}
+    for group in groups:
+        protected = [c for c in group if c in protect]
+        kept = protected if protected else group[:1]
+        dropped = [c for c in group if c not in kept]
+        if dropped:
+            merged.setdefault(kept[0], []).extend(dropped)
+    return merged
+
+
+def drop_identical_columns(df, protect=(), chunk_rows=CHUNK_ROWS):
+    """Drop columns with identical data (keep the first). Returns (df, {kept: [dropped]})."""
+    merged = plan_drops(find_identical_columns(df, chunk_rows=chunk_rows), protect)
+    to_drop = [c for dropped in merged.values() for c in dropped]
+    return df.drop(columns=to_drop), merged
+
+
+def suffix_pairs(columns, suffixes=("_parquet", "_csv")):
+    """{base name: (left column, right column)} for merge outputs such as wkt_parquet / wkt_csv."""
+    left, right = suffixes
+    pairs = {}
+    for col in columns:
+        if col.endswith(left):
+            base = col[:-len(left)]
+            if base + right in columns and base not in columns:
+                pairs[base] = (col, base + right)
+    return pairs
+
+
+def plan_suffix_merges(groups, columns, suffixes=("_parquet", "_csv")):
+    """
+    Suffix pairs whose two sides are identical, to be collapsed back to the base name.
+    Returns {base name: (left column, right column)}.
+    """
+    same = {c: tuple(g) for g in groups for c in g}
+    return {
+        base: (left, right)
+        for base, (left, right) in suffix_pairs(columns, suffixes).items()
+        if right in same.get(left, ())
+    }
+
+
+def report_merges(merged, renamed=None):
+    """Print which source columns were merged into which kept column."""
+    if not merged and not renamed:
+        print("No identical columns found.")
+        return
+    for base, (left, right) in (renamed or {}).items():
+        print(f"   {left} + {right} → {base}")
+    for kept, dropped in merged.items():
+        print(f"   {kept} ← {', '.join(dropped)}")
@@ -0,0 +1,140 @@
+"""
+Compare runtime and peak memory of stage 5c: the previous pandas implementation
+against the polars lazy plan, on the same 5b buckets.
+
+Each run happens in a fresh process so peak RSS is measured per engine and bucket.
+Usage: python src/compare_5c_engines.py [number of buckets, default 4]
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import importlib
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from buckets import bucket_path, list_buckets, read_bucket
+from schema import CATEGORICAL_COLUMNS
+
+# Paths
+OUTPUT_FILE = "output/benchmarks/5c_engine_comparison.csv"
+
+stage = importlib.import_module("5c_SSEGRegistration")
+
+#######################################
+# Previous pandas implementation (reference)
+
+def run_pandas(bucket, output_path):
+    df_parquet = read_bucket(stage.PARQUET_PATH, bucket, columns=stage.parquet_columns)
+    # The reference implementation worked on plain strings
+    df_parquet = df_parquet.astype({c: "object" for c in CATEGORICAL_COLUMNS if c in df_parquet.columns})
+    df_csv = pd.read_csv(stage.CSV_PATH, usecols=stage.csv_columns)
+
+    df_merged = pd.merge(
+        df_parquet,
+        df_csv,
+        on=stage.merge_keys,
+        how='left',
+        suffixes=('_parquet', '_csv')
+    )
+    df_clean = df_merged[stage.cols_to_keep].copy()
+    df_clean = df_clean.rename(columns=lambda x: x.replace(" ", "_").replace(";", ""))
+
+    df_clean = df_clean.sort_values(['contract_ID', 'month_idx'])
+    for col in stage.ff_cols:
+        df_clean[col] = df_clean.groupby('contract_ID')[col].transform(lambda x: x.ffill())
+
+    df_clean["shs_label_edit"] = df_clean["shs_label_edit"].where(df_clean["Did_not_build"] != 1, pd.NA)
+    df_clean.loc[
+        df_clean["shs_label_edit"].isna() &
+        ((df_clean["Built_NOT_found_by_M2F"] == 1) | (df_clean["Built_found_by_M2F"] == 1)),
+        "shs_label_edit"
+    ] = "PV_normal"
+    df_clean["Watt"] = (
+        df_clean["shs_area_m2_edit"].replace(0, np.nan) * stage.watt_per_panel / stage.panel_size
+    ).fillna(df_clean["total_capacity_va"])
+
+    df_clean.to_parquet(output_path, index=False)
+
+
+def run_polars(bucket, output_path):
+    stage.build_plan(bucket).sink_parquet(output_path)
+
+#######################################
+# Measurement
+
+def _measure(engine, bucket, output_path, queue):
+    """Child process: run one engine on one bucket and report wall time and peak RSS."""
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    {"pandas": run_pandas, "polars": run_polars}[engine](bucket, output_path)
+    wall = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((wall, rss_before / 1024, rss_peak / 1024))
+
+
+def measure(engine, bucket, output_path):
+    ctx = mp.get_context("spawn")  # polars thread pools are not fork-safe
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_measure, args=(engine, bucket, output_path, queue))
+    proc.start()
+    wall, rss_before_mb, rss_peak_mb = queue.get()
+    proc.join()
+    return wall, rss_before_mb, rss_peak_mb
+
+
+def summarize(path):
+    """Numbers both engines must agree on."""
+    df = pd.read_parquet(path, columns=["contract_ID", "shs_label_edit", "Watt"])
+    return len(df), int((df["shs_label_edit"] == "PV_normal").sum()), round(float(df["Watt"].sum()), 3)
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    n_buckets = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    buckets = list_buckets(stage.PARQUET_PATH)[:n_buckets]
+    print(f"Comparing 5c engines on {len(buckets)} buckets of {stage.PARQUET_PATH}")
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for bucket in buckets:
+            input_rows = len(read_bucket(stage.PARQUET_PATH, bucket, columns=["contract_ID"]))
+            checks = {}
+            for engine in ["pandas", "polars"]:
+                output_path = bucket_path(os.path.join(tmp, engine), bucket, "parquet")
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                wall, rss_before_mb, rss_peak_mb = measure(engine, bucket, output_path)
+                checks[engine] = summarize(output_path)
+                rows.append({
+                    "bucket": bucket,
+                    "engine": engine,
+                    "rows": input_rows,
+                    "wall_s": round(wall, 3),
+                    "rows_per_s": round(input_rows / wall) if wall else None,
+                    "peak_rss_mb": round(rss_peak_mb, 1),
+                    "rss_growth_mb": round(rss_peak_mb - rss_before_mb, 1),
+                })
+            if checks["pandas"] != checks["polars"]:
+                print(f"⚠️ Bucket {bucket}: outputs differ (rows, PV rows, Watt sum): {checks}")
+
+    results = pd.DataFrame(rows)
+    totals = results.groupby("engine").agg(
+        rows=("rows", "sum"), wall_s=("wall_s", "sum"), peak_rss_mb=("peak_rss_mb", "max")
+    )
+    totals["speedup_vs_pandas"] = totals.loc["pandas", "wall_s"] / totals["wall_s"]
+
+    print(results.to_string(index=False))
+    print("\n Totals:")
+    print(totals)
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    results.to_csv(OUTPUT_FILE, index=False)
+    print(f"\n Saved comparison to {OUTPUT_FILE}")
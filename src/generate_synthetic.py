@@ -0,0 +1,506 @@
+"""
+Seeded synthetic versions of every pipeline input, in the files, columns and
+formats the stage scripts read, so the pipeline can be run, profiled and
+benchmarked without the (unshareable) real data.
+
+Layout: households are clustered around suburb centres in a Cape Town bounding
+box. Each household has a building polygon around its meter location (a few
+locations fall just outside, or are missing); extra non-household buildings
+are scattered around the suburbs. Rooftop PV predictions are centred on the
+buildings of households that have adopted PV, and the load shedding blocks
+tile the box with BlockIDs 1-16, the Area numbers of the schedule.
+
+Contracts are generated in chunks with one random stream per chunk, so the
+same seed and scale always give the same files, and 5M contracts fit in memory.
+
+Usage: python src/generate_synthetic.py --contracts 100000 --seed 0 --root synthetic
+(writes synthetic/data/...; run the stages from synthetic/, e.g. python ../src/pipeline.py)
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+import pyproj
+import shapely
+
+from months import BASE_YEAR
+
+# Files written under <root>, as read by the stage scripts
+OLD_PREPAID_DIR = "data/old_prepaid"                 # 1a: one CSV per month, 2020-01 to 2021-03
+POSTPAID_DIR = "data/postpaid"                       # 1a
+PREPAID_DIR = "data/prepaid_parquet"                 # 1b: from 2021-04
+LOCATIONS_DIR = "data/ContractLocations"             # 2a
+DEVICES_FILE = "data/devices_total.parquet"          # 2b
+BUILDINGS_FILE = "data/capetown_buildings2.parquet"  # 3, 4
+PREDICTIONS_FILE = "data/prediction_merged_{year}.csv"   # 4
+REGISTRATIONS_FILE = "data/checked_01132026.csv"     # 5c
+BLOCKS_FILE = "data/Load_shedding_Blocks.geojson"    # 6
+SCHEDULE_FILE = "data/raw/Loadshedding_schedule.csv" # 7, 8
+
+# Set up
+CHUNK_CONTRACTS = 100_000
+BBOX = (18.35, -34.15, 18.95, -33.70)     # lon/lat box around Cape Town
+N_SUBURBS = 120
+N_AREAS = 16                              # load shedding areas (BlockID / Area number)
+BLOCK_GRID = (12, 10)                     # block polygons along lon, lat
+PREPAID_SHARE = 0.85
+FIRST_MONTH, LAST_MONTH = (2020 - BASE_YEAR) * 12, (2023 - BASE_YEAR) * 12 + 11
+NEW_PREPAID_MONTH = (2021 - BASE_YEAR) * 12 + 3          # 2021-04: first month of the new prepaid format
+PURCHASES_PER_MONTH = 2.2
+MEDIAN_KWH = 350                          # median monthly household consumption
+PV_ADOPTION = {2020: 0.04, 2021: 0.07, 2022: 0.11, 2023: 0.16}   # share of households with PV by year
+PV_DETECTION = 0.85                       # share of PV rooftops found by the model in a year
+PV_FALSE_POSITIVE = 0.003
+REGISTERED_SHARE = 0.3                    # PV households with an SSEG registration
+YEARS = list(PV_ADOPTION)
+
+M_PER_DEG_LAT = 110_540
+
+#######################################
+# Helpers
+
+def hashes(prefix, ids):
+    """Stable 16-hex-digit pseudo hashes of integer ids (stand-ins for the hashed keys)."""
+    values = pd.util.hash_array(np.asarray(ids, dtype=np.uint64), hash_key=(prefix * 16)[:16])
+    return np.array([f"{v:016x}" for v in values], dtype=object)
+
+
+def month_starts(month_idx):
+    """datetime64[s] of the first second of each month index."""
+    return (np.datetime64(f"{BASE_YEAR}-01", "M") + np.asarray(month_idx)).astype("datetime64[s]")
+
+
+def format_timestamps(ts):
+    """'YYYY-MM-DD HH:MM:SS' strings of datetime64[s] values (Arrow's cast, much faster than strftime)."""
+    return pa.array(ts, pa.timestamp("s")).cast(pa.string())
+
+
+def points_wkt(lon, lat):
+    return np.char.add(np.char.add(np.char.add("POINT (", np.char.mod("%.7f", lon)),
+                                   np.char.add(" ", np.char.mod("%.7f", lat))), ")")
+
+
+def append_csv(table, path):
+    """Append an Arrow table to a CSV file (header only when the file is new)."""
+    if isinstance(table, pd.DataFrame):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+    options = pacsv.WriteOptions(include_header=not os.path.exists(path), quoting_style="needed")
+    with open(path, "ab") as f:
+        pacsv.write_csv(table, f, write_options=options)
+
+
+def seasonal(month_idx):
+    """Consumption factor by month: Cape Town winters (June-August) use ~20% more."""
+    month = np.asarray(month_idx) % 12 + 1
+    return 1 + 0.2 * np.cos(2 * np.pi * (month - 7) / 12)
+
+#######################################
+# Shared geography
+
+def make_suburbs(rng):
+    """Suburb centres (lon, lat), spread (degrees) and size weights."""
+    lon = rng.uniform(BBOX[0] + 0.03, BBOX[2] - 0.03, N_SUBURBS)
+    lat = rng.uniform(BBOX[1] + 0.03, BBOX[3] - 0.03, N_SUBURBS)
+    spread = rng.uniform(0.004, 0.015, N_SUBURBS)
+    weight = rng.pareto(1.5, N_SUBURBS) + 1
+    return pd.DataFrame({"lon": lon, "lat": lat, "spread": spread, "weight": weight / weight.sum()})
+
+
+def write_blocks(root, rng):
+    """Load shedding blocks: a grid over the box, each cell assigned to one of the 16 areas."""
+    nx, ny = BLOCK_GRID
+    xs = np.linspace(BBOX[0], BBOX[2], nx + 1)
+    ys = np.linspace(BBOX[1], BBOX[3], ny + 1)
+    ix, iy = np.meshgrid(np.arange(nx), np.arange(ny), indexing="ij")
+    ix, iy = ix.ravel(), iy.ravel()
+    area = rng.permutation(np.resize(np.arange(1, N_AREAS + 1), nx * ny))
+    blocks = gpd.GeoDataFrame(
+        {"BlockID": area, "Name": [f"Block {a}" for a in area]},
+        geometry=shapely.box(xs[ix], ys[iy], xs[ix + 1], ys[iy + 1]),
+        crs="EPSG:4326",
+    )
+    blocks.to_file(os.path.join(root, BLOCKS_FILE), driver="GeoJSON")
+
+
+def write_schedule(root, rng):
+    """
+    Daily schedule for 2022-2023: a sticky national stage (0-6) per day, and at
+    stage s each area is shed in about s/2 two-hour slots (longer at stage 5+).
+    """
+    days = pd.date_range("2022-01-01", "2023-12-31", freq="D")
+    stage = np.zeros(len(days), dtype=int)
+    for i in range(1, len(days)):
+        stage[i] = np.clip(stage[i - 1] + rng.choice([-1, 0, 0, 0, 0, 0, 1]), 0, 6)
+    rows = []
+    for day, s in zip(days, stage):
+        if s == 0:
+            continue
+        slots = rng.poisson(s / 2, N_AREAS).clip(1, 6)
+        for area, n in zip(range(1, N_AREAS + 1), slots):
+            for slot in rng.choice(12, size=n, replace=False):
+                rows.append((day.strftime("%Y-%m-%d"), f"Stage {s}", f"Area {area}",
+                             240 if s >= 5 else 120, f"{2 * slot:02d}:00:00"))
+    schedule = pd.DataFrame(rows, columns=["Date", "Stage", "Area", "Duration min", "Start"])
+    os.makedirs(os.path.dirname(os.path.join(root, SCHEDULE_FILE)), exist_ok=True)
+    schedule.to_csv(os.path.join(root, SCHEDULE_FILE), index=False)
+    return len(schedule)
+
+#######################################
+# One chunk of contracts
+
+def make_households(rng, suburbs, ids):
+    """Location, building and consumption profile of each household."""
+    n = len(ids)
+    suburb = rng.choice(len(suburbs), size=n, p=suburbs["weight"])
+    lon = suburbs["lon"].to_numpy()[suburb] + rng.normal(0, suburbs["spread"].to_numpy()[suburb])
+    lat = suburbs["lat"].to_numpy()[suburb] + rng.normal(0, suburbs["spread"].to_numpy()[suburb])
+    lon, lat = np.clip(lon, BBOX[0], BBOX[2]), np.clip(lat, BBOX[1], BBOX[3])
+
+    adopted = rng.random(n)
+    pv_year = np.full(n, 9999)
+    for year in sorted(PV_ADOPTION, reverse=True):
+        pv_year[adopted < PV_ADOPTION[year]] = year
+
+    first = rng.integers(FIRST_MONTH - 12, FIRST_MONTH + 30, n).clip(FIRST_MONTH, None)
+    last = np.where(rng.random(n) < 0.1, rng.integers(first, LAST_MONTH + 1), LAST_MONTH)
+    return pd.DataFrame({
+        "id": ids,
+        "prepaid": rng.random(n) < PREPAID_SHARE,
+        "account": hashes("acct", ids),
+        "contract": hashes("cont", ids),
+        "suburb": suburb,
+        "lon": lon,
+        "lat": lat,
+        "half_size_m": rng.uniform(4, 12, n),
+        "kwh": MEDIAN_KWH * rng.lognormal(0, 0.6, n),
+        "lifeline": rng.random(n) < 0.3,
+        "pv_year": pv_year,
+        "first_month": first,
+        "last_month": last,
+    })
+
+
+def building_boxes(lon, lat, half_size_m):
+    dx = half_size_m / (M_PER_DEG_LAT * np.cos(np.radians(lat)))
+    dy = half_size_m / M_PER_DEG_LAT
+    return shapely.box(lon - dx, lat - dy, lon + dx, lat + dy)
+
+
+def monthly_kwh(households, contract_rows, month_idx, rng):
+    """Consumption of each (household, month): base level x season x noise, lower once PV is installed."""
+    hh = households.iloc[contract_rows]
+    kwh = hh["kwh"].to_numpy() * seasonal(month_idx) * rng.lognormal(0, 0.15, len(month_idx))
+    has_pv = (month_idx // 12 + BASE_YEAR) >= hh["pv_year"].to_numpy()
+    return np.where(has_pv, 0.75 * kwh, kwh)
+
+
+def active_months(households, rows):
+    """(household row, month index) of every month each household is a customer."""
+    first = households["first_month"].to_numpy()[rows]
+    n = households["last_month"].to_numpy()[rows] - first + 1
+    contract_rows = np.repeat(rows, n)
+    months = np.repeat(first, n) + (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))
+    return contract_rows, months
+
+
+def write_prepaid(root, households, rng, chunk):
+    """Prepaid purchases: ~2 per month, old format (monthly CSVs) before 2021-04, new format (Parquet) after."""
+    rows, months = active_months(households, np.flatnonzero(households["prepaid"].to_numpy()))
+    count = rng.poisson(PURCHASES_PER_MONTH, len(rows)).clip(1, None)
+    units = monthly_kwh(households, rows, months, rng) / count
+    rows, months, units = np.repeat(rows, count), np.repeat(months, count), np.repeat(units, count)
+    units = np.round(units * rng.lognormal(0, 0.3, len(units)), 1)
+
+    starts = month_starts(months)
+    seconds = (month_starts(months + 1) - starts).astype(np.int64)
+    ts = starts + (rng.random(len(rows)) * seconds).astype("timedelta64[s]")
+    # String columns are gathered per purchase with Arrow's take (numpy object indexing is slow)
+    accounts = pa.array(households["account"].to_numpy(), pa.string())
+    meters = pa.array(hashes("metr", households["id"].to_numpy()), pa.string())
+
+    old = months < NEW_PREPAID_MONTH
+    old_df = pa.table({
+        "contract_account_hashed": accounts.take(rows[old]),
+        "units_purchased": units[old],
+        "purchase_period_start": format_timestamps(ts[old]),
+        "meter_serial_number_hashed": meters.take(rows[old]),
+    })
+    old_months = months[old]
+    for month in np.unique(old_months):
+        name = f"prepaid-electricity-purchases-{str(month_starts([month])[0])[:7]}.csv"
+        append_csv(old_df.filter(pa.array(old_months == month)), os.path.join(root, OLD_PREPAID_DIR, name))
+
+    new = ~old
+    trfname = pa.array(["Domestic", "Domestic Lifeline"]).take(households["lifeline"].to_numpy()[rows[new]].astype(int))
+    pq.write_table(pa.table({
+        "contract_account_hashed": accounts.take(rows[new]),
+        "totalunits": units[new],
+        "trfname": trfname,
+        "transaction_timestamp": format_timestamps(ts[new]),
+    }), os.path.join(root, PREPAID_DIR, f"part-{chunk:05d}.parquet"))
+    return int(new.sum()), int(old.sum())
+
+
+def write_postpaid(root, households, rng, chunk):
+    """Postpaid bills: one kWh line per month, plus demand (kVA) lines that 1a filters out."""
+    rows, months = active_months(households, np.flatnonzero(~households["prepaid"].to_numpy()))
+    kwh = np.round(monthly_kwh(households, rows, months, rng), 1)
+    demand = rng.random(len(rows)) < 0.1
+    rows = np.r_[rows, rows[demand]]
+    months = np.r_[months, months[demand]]
+    quantity = np.r_[kwh, np.round(rng.uniform(5, 40, demand.sum()), 1)]
+    unit = np.r_[np.full(len(kwh), "KWH"), np.full(demand.sum(), "KVA")]
+    rate = np.where(households["lifeline"].to_numpy()[rows], "Domestic Lifeline", "Domestic")
+    append_csv(pa.table({
+        "contract_hashed": households["contract"].to_numpy()[rows],
+        "billing_period_start_month": months % 12 + 1,
+        "billing_period_start_year": months // 12 + BASE_YEAR,
+        "quantity_billed": quantity,
+        "rate_category": rate,
+        "unit_of_measure_code": unit,
+    }), os.path.join(root, POSTPAID_DIR, f"postpaid-{chunk:05d}.csv"))
+    return len(rows)
+
+
+def write_locations(root, households, extra_lon, extra_lat, rng, chunk):
+    """
+    One location record per contract (move-in date, meter point): 90% inside the
+    household's building, 7% 15-60 m away, 3% missing. 5% of households moved
+    during the panel and have a second record at another building.
+    """
+    n = len(households)
+    lon, lat = households["lon"].to_numpy().copy(), households["lat"].to_numpy().copy()
+    offset = rng.random(n) < 0.07
+    distance = rng.uniform(15, 60, offset.sum()) / M_PER_DEG_LAT
+    angle = rng.uniform(0, 2 * np.pi, offset.sum())
+    lon[offset] += distance * np.cos(angle) / np.cos(np.radians(lat[offset]))
+    lat[offset] += distance * np.sin(angle)
+    wkt = points_wkt(lon, lat).astype(object)
+    wkt[rng.random(n) < 0.03] = None
+
+    move_in = month_starts(households["first_month"].to_numpy() - rng.integers(0, 120, n)) \
+        + rng.integers(0, 28 * 86400, n).astype("timedelta64[s]")
+    move_out = np.full(n, "9999-12-31", dtype=object)
+    move_out[households["last_month"].to_numpy() < LAST_MONTH] = None
+
+    # Movers: the first record ends at the move, the second starts there
+    movers = np.flatnonzero(rng.random(n) < 0.05)
+    move_month = rng.integers(FIRST_MONTH + 6, LAST_MONTH - 6, len(movers))
+    move_date = format_timestamps(month_starts(move_month) + np.timedelta64(14, "D")).to_numpy(zero_copy_only=False)
+    new_building = rng.integers(0, len(extra_lon), len(movers))
+
+    suburb = households["suburb"].to_numpy()
+    records = pd.DataFrame({
+        "contract_account_hashed": households["account"].to_numpy(),
+        "contract_hashed": households["contract"].to_numpy(),
+        "move_in_timestamp": format_timestamps(move_in).to_numpy(zero_copy_only=False),
+        "move_out_timestamp": move_out,
+        "active": np.where(households["last_month"].to_numpy() == LAST_MONTH, "Y", "N"),
+        "wkt": wkt,
+        "absd_area": [f"ABSD {s % 9}" for s in suburb],
+        "ward2021": [f"Ward {s % 116 + 1}" for s in suburb],
+        "official_suburb": [f"Suburb {s:03d}" for s in suburb],
+        "electricity_region": [("North", "South", "East", "West")[s % 4] for s in suburb],
+        "device_serial_number_hashed": hashes("devc", households["id"].to_numpy()),
+        "business_area": np.where(rng.random(n) < 0.97, "TSES", "ESKOM"),
+    })
+    records.loc[movers, "move_out_timestamp"] = move_date
+    moved = records.iloc[movers].copy()
+    moved["move_in_timestamp"] = move_date
+    moved["move_out_timestamp"] = "9999-12-31"
+    moved["wkt"] = points_wkt(extra_lon[new_building], extra_lat[new_building])
+    records = pd.concat([records, moved], ignore_index=True)
+    append_csv(records, os.path.join(root, LOCATIONS_DIR, f"locations-{chunk:05d}.csv"))
+    return len(records)
+
+
+def write_predictions(root, households, building_offset, rng, chunk):
+    """
+    Rooftop predictions per year: PV_normal on ~85% of PV households' roofs each
+    year (so some years are missed), a few false positives and other labels.
+    Centroids fall inside the building (3% just outside); 3% of areas are below
+    the 1.7 m² cut.
+    """
+    n = len(households)
+    rows_written = 0
+    for year in YEARS:
+        has_pv = households["pv_year"].to_numpy() <= year
+        pv = (has_pv & (rng.random(n) < PV_DETECTION)) | (~has_pv & (rng.random(n) < PV_FALSE_POSITIVE))
+        other = rng.random(n) < 0.02
+        rows = np.r_[np.flatnonzero(pv), np.flatnonzero(other)]
+        label = np.r_[np.full(pv.sum(), "PV_normal"), rng.choice(["PV_heater", "PV_pool"], other.sum())]
+        hh = households.iloc[rows]
+        jitter_m = hh["half_size_m"].to_numpy() * rng.uniform(-0.5, 0.5, (2, len(rows)))
+        jitter_m[:, rng.random(len(rows)) < 0.03] += 25     # just off the roof (nearest-building match)
+        lat = hh["lat"].to_numpy() + jitter_m[0] / M_PER_DEG_LAT
+        lon = hh["lon"].to_numpy() + jitter_m[1] / (M_PER_DEG_LAT * np.cos(np.radians(hh["lat"].to_numpy())))
+        area = np.round(rng.lognormal(np.log(12), 0.5, len(rows)), 2)
+        area[rng.random(len(rows)) < 0.03] = 1.0
+        gps = np.char.add(np.char.add(np.char.add("(", np.char.mod("%.7f", lat)),
+                                      np.char.add(", ", np.char.mod("%.7f", lon))), ")")
+        prediction_ids = building_offset + rows
+        append_csv(pd.DataFrame({
+            "id": [f"{year}_{chunk}_{i}" for i in range(len(rows))],
+            "image_id": [f"tile_{s}_{year}" for s in hh["suburb"].to_numpy()],
+            "prediction_id": prediction_ids,
+            "label": label,
+            "area_m2": area,
+            "polygon_centroid_GPS[lat,lon]": gps,
+        }), os.path.join(root, PREDICTIONS_FILE.format(year=year)))
+        rows_written += len(rows)
+    return rows_written
+
+
+def write_registrations(root, households, rng):
+    """
+    SSEG registrations of ~30% of PV households, one row per year from the
+    installation year, with the visual check outcome (found / not found / not built).
+    """
+    registered = households[(households["pv_year"] <= max(YEARS)) & (rng.random(len(households)) < REGISTERED_SHARE)]
+    n_years = max(YEARS) - registered["pv_year"].to_numpy() + 1
+    reg = registered.loc[registered.index.repeat(n_years)].reset_index(drop=True)
+    reg["year"] = reg["pv_year"] + (np.arange(len(reg)) - np.repeat(np.cumsum(n_years) - n_years, n_years))
+
+    check = rng.choice(3, size=len(registered), p=[0.05, 0.2, 0.75]).repeat(n_years)
+    account = reg["account"].to_numpy()
+    wkt = points_wkt(reg["lon"].to_numpy(), reg["lat"].to_numpy())
+    append_csv(pd.DataFrame({
+        "contract_account_hashed": account,
+        "year": reg["year"].to_numpy(),
+        "contract_account_hashed_right": account,
+        "installation_type": rng.choice(["roof", "ground"], len(reg), p=[0.95, 0.05]),
+        "fake": (rng.random(len(reg)) < 0.01).astype(int),
+        "total_capacity_va": rng.choice([3000, 4000, 5000, 6000, 8000, 10000], len(reg)),
+        "start_year": reg["pv_year"].to_numpy(),
+        "wkt": wkt,
+        "geometry": wkt,
+        "Did not build": (check == 0).astype(int),
+        "Built; NOT found by M2F": (check == 1).astype(int),
+        "Built; found by M2F": (check == 2).astype(int),
+        "Notes": "",
+        "area_m2": np.round(rng.lognormal(np.log(12), 0.5, len(reg)), 2),
+    }), os.path.join(root, REGISTRATIONS_FILE))
+    return len(reg)
+
+
+class BuildingWriter:
+    """Appends building polygons (id, WKB geometry) to one GeoParquet file, chunk by chunk."""
+
+    # GeoParquet metadata for the whole file (no bbox: chunks are written before the extent is known)
+    GEO_METADATA = {
+        "version": "1.0.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {
+            "encoding": "WKB",
+            "geometry_types": ["Polygon"],
+            "crs": pyproj.CRS("EPSG:4326").to_json_dict(),
+        }},
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self.schema = pa.schema([("id", pa.string()), ("geometry", pa.binary())],
+                                metadata={"geo": json.dumps(self.GEO_METADATA)})
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.rows = 0
+
+    def write(self, ids, geometry):
+        self.writer.write_table(pa.table([pa.array(ids, pa.string()), pa.array(shapely.to_wkb(geometry))],
+                                         schema=self.schema))
+        self.rows += len(ids)
+
+    def close(self):
+        self.writer.close()
+
+#######################################
+# MAIN
+
+def reset_outputs(root):
+    """Create the data folders and remove files left by a previous generation."""
+    for folder in [OLD_PREPAID_DIR, POSTPAID_DIR, PREPAID_DIR, LOCATIONS_DIR, "data/raw"]:
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    for folder in [OLD_PREPAID_DIR, POSTPAID_DIR, PREPAID_DIR, LOCATIONS_DIR]:
+        for f in glob.glob(os.path.join(root, folder, "*")):
+            os.remove(f)
+    for f in [DEVICES_FILE, BUILDINGS_FILE, REGISTRATIONS_FILE, BLOCKS_FILE, SCHEDULE_FILE] \
+            + [PREDICTIONS_FILE.format(year=y) for y in YEARS]:
+        if os.path.exists(os.path.join(root, f)):
+            os.remove(os.path.join(root, f))
+
+
+def generate(root, contracts, seed=0, chunk_contracts=CHUNK_CONTRACTS):
+    """Write every input for `contracts` households under root/data. Returns row counts per input."""
+    start = time.time()
+    reset_outputs(root)
+    rng = np.random.default_rng(seed)
+    suburbs = make_suburbs(rng)
+    write_blocks(root, rng)
+    counts = {"schedule": write_schedule(root, rng)}
+
+    buildings = BuildingWriter(os.path.join(root, BUILDINGS_FILE))
+    devices = []
+    for chunk, first in enumerate(range(0, contracts, chunk_contracts)):
+        chunk_rng = np.random.default_rng([seed, chunk])
+        ids = np.arange(first, min(first + chunk_contracts, contracts))
+        households = make_households(chunk_rng, suburbs, ids)
+
+        # Household buildings first (so a household's building is at building_offset + its row),
+        # then 20% extra buildings nearby (movers' new homes, non-household buildings)
+        building_offset = buildings.rows
+        n_extra = max(len(ids) // 5, 1)
+        extra_suburb = chunk_rng.choice(len(suburbs), size=n_extra, p=suburbs["weight"])
+        extra_lon = suburbs["lon"].to_numpy()[extra_suburb] + chunk_rng.normal(0, suburbs["spread"].to_numpy()[extra_suburb])
+        extra_lat = suburbs["lat"].to_numpy()[extra_suburb] + chunk_rng.normal(0, suburbs["spread"].to_numpy()[extra_suburb])
+        lon = np.r_[households["lon"].to_numpy(), extra_lon]
+        lat = np.r_[households["lat"].to_numpy(), extra_lat]
+        size = np.r_[households["half_size_m"].to_numpy(), chunk_rng.uniform(4, 20, n_extra)]
+        buildings.write(hashes("bldg", building_offset + np.arange(len(lon))), building_boxes(lon, lat, size))
+
+        new_rows, old_rows = write_prepaid(root, households, chunk_rng, chunk)
+        for name, n in {
+            "prepaid_new": new_rows,
+            "prepaid_old": old_rows,
+            "postpaid": write_postpaid(root, households, chunk_rng, chunk),
+            "locations": write_locations(root, households, extra_lon, extra_lat, chunk_rng, chunk),
+            "predictions": write_predictions(root, households, building_offset, chunk_rng, chunk),
+            "registrations": write_registrations(root, households, chunk_rng),
+        }.items():
+            counts[name] = counts.get(name, 0) + n
+        devices.append(pd.DataFrame({
+            "contract_account_hashed": households["account"].to_numpy(),
+            "device_serial_number_hashed": hashes("devc", ids),
+        }))
+        print(f" Chunk {chunk}: contracts {first:,} to {ids[-1]:,} ({time.time() - start:.1f}s)")
+
+    buildings.close()
+    counts["buildings"] = buildings.rows
+    pd.concat(devices, ignore_index=True).to_parquet(os.path.join(root, DEVICES_FILE), index=False)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic pipeline inputs.")
+    parser.add_argument("--contracts", type=int, default=10_000, help="number of households (10k to 5M)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--root", default="synthetic", help="folder to write data/ into")
+    parser.add_argument("--chunk", type=int, default=CHUNK_CONTRACTS, help="contracts generated at a time")
+    args = parser.parse_args()
+
+    start = time.time()
+    counts = generate(args.root, args.contracts, args.seed, args.chunk)
+    print(f"\n Synthetic inputs for {args.contracts:,} contracts written to {os.path.join(args.root, 'data')}")
+    for name, n in counts.items():
+        print(f"   🔹 {name}: {n:,} rows")
+    print(f"Total runtime: {time.time() - start:.1f}s")
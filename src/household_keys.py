@@ -0,0 +1,164 @@
+"""
+Household keys: the contract, account, device and meter identifiers of one
+household, linked across the data eras.
+
+Old postpaid bills are keyed by contract_hashed and prepaid purchases by
+contract_account_hashed. The location records (2a), the device list and the
+old prepaid purchases (1a) name several identifiers on one row. Each identifier
+is a node, each such row links its identifiers, and each connected component
+is a household. Components are found with a vectorized union-find: every round
+hooks the root of each link under the smaller root, then compresses the paths
+by pointer jumping, so a run takes a few passes over the links whatever the
+number of households.
+
+The key of a household is its smallest account id, or its smallest contract id
+when it has no account. A household that keeps its identifiers keeps its key
+from run to run, and a household with one account keeps the key it had as a
+contract_ID (account, else contract; see 2b).
+
+    keys = household_keys([
+        (locations, {"account": "contract_account_hashed", "contract": "contract_hashed"}),
+        (devices, {"account": "contract_account_hashed", "device": "device_serial_number_hashed"}),
+    ])
+    panel = with_household(panel, keys)     # adds household_ID
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import itertools
+
+import numpy as np
+import polars as pl
+
+# Identifier kinds, in order of preference for a household's key
+KINDS = ["account", "contract", "device", "meter"]
+
+# Serial numbers linked to more than this many identifiers of one other kind are
+# placeholders or shared equipment (e.g. an all-zero serial) and link nothing.
+# Accounts and contracts always link.
+EQUIPMENT_KINDS = ["device", "meter"]
+MAX_LINKS = 20
+
+HOUSEHOLD_KEY = "household_ID"
+
+#######################################
+# Union-find
+
+def connected_components(n_nodes, left, right):
+    """Label (smallest node number) of the component of each node 0..n_nodes-1, given links left[i]-right[i]."""
+    parent = np.arange(n_nodes, dtype=np.int64)
+    while True:
+        a, b = parent[left], parent[right]
+        low, high = np.minimum(a, b), np.maximum(a, b)
+        linked = low != high
+        if not linked.any():
+            return parent
+        # Union: hook the larger root of every link under the smallest root it is linked to
+        np.minimum.at(parent, high[linked], low[linked])
+        # Find: point every node at its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+#######################################
+# Links
+
+def _ids(frame, columns):
+    """Distinct rows of a frame's identifier columns, renamed to their kinds (as strings)."""
+    unknown = [kind for kind in columns if kind not in KINDS]
+    if unknown:
+        raise ValueError(f"Unknown identifier kinds {unknown} (known: {KINDS})")
+    return (
+        frame.lazy()
+        .select([pl.col(column).cast(pl.String).alias(kind) for kind, column in columns.items()])
+        .unique()
+        .collect()
+    )
+
+
+def _links(ids):
+    """(kind_a, id_a, kind_b, id_b) for every pair of identifiers named on one row."""
+    pairs = [
+        ids.select(pl.lit(a).alias("kind_a"), pl.col(a).alias("id_a"),
+                   pl.lit(b).alias("kind_b"), pl.col(b).alias("id_b"))
+        for a, b in itertools.combinations(ids.columns, 2)
+    ]
+    if not pairs:
+        return None
+    return pl.concat(pairs).filter(pl.col("id_a").is_not_null() & pl.col("id_b").is_not_null()).unique()
+
+
+def _hubs(links, max_links):
+    """(kind, id) of the serial numbers linked to more than max_links identifiers of one other kind."""
+    both_ways = pl.concat([
+        links.select(pl.col("kind_a").alias("kind"), pl.col("id_a").alias("id"), pl.col("kind_b").alias("other"),
+                     pl.col("id_b").alias("other_id")),
+        links.select(pl.col("kind_b").alias("kind"), pl.col("id_b").alias("id"), pl.col("kind_a").alias("other"),
+                     pl.col("id_a").alias("other_id")),
+    ])
+    return (
+        both_ways.group_by(["kind", "id", "other"]).agg(pl.col("other_id").n_unique().alias("n"))
+        .filter(pl.col("kind").is_in(EQUIPMENT_KINDS) & (pl.col("n") > max_links))
+        .select(["kind", "id"]).unique()
+    )
+
+#######################################
+# Keys
+
+def household_keys(sources, max_links=MAX_LINKS):
+    """
+    Household key of every identifier named in `sources`, a list of
+    (polars or pandas frame, {kind: column}). Returns a polars DataFrame with
+    columns kind, id and household_ID.
+    """
+    ids = [_ids(frame if isinstance(frame, (pl.DataFrame, pl.LazyFrame)) else pl.from_pandas(frame), columns)
+           for frame, columns in sources]
+
+    # Nodes, numbered in order of preference for the key (accounts first, then by id)
+    nodes = pl.concat([
+        frame.select(pl.lit(kind).alias("kind"), pl.col(kind).alias("id"))
+        for frame in ids for kind in frame.columns
+    ]).drop_nulls("id").unique()
+    nodes = (
+        nodes.with_columns(pl.col("kind").replace_strict(KINDS, list(range(len(KINDS)))).alias("rank"))
+        .sort(["rank", "id"])
+        .with_row_index("node")
+    )
+
+    links = [l for l in map(_links, ids) if l is not None]
+    links = pl.concat(links).unique() if links else None
+    n_links = n_hubs = 0
+    if links is not None and len(links):
+        hubs = _hubs(links, max_links)
+        n_hubs = len(hubs)
+        for end in ("a", "b"):
+            links = links.join(hubs, left_on=[f"kind_{end}", f"id_{end}"], right_on=["kind", "id"], how="anti")
+            links = links.join(nodes.select(pl.col("kind").alias(f"kind_{end}"), pl.col("id").alias(f"id_{end}"),
+                                            pl.col("node").alias(f"node_{end}")),
+                               on=[f"kind_{end}", f"id_{end}"], how="inner")
+        n_links = len(links)
+        left, right = links["node_a"].to_numpy(), links["node_b"].to_numpy()
+    else:
+        left = right = np.array([], dtype=np.int64)
+
+    label = connected_components(len(nodes), left.astype(np.int64), right.astype(np.int64))
+    keys = nodes.select(["kind", "id"]).with_columns(nodes["id"].gather(label).alias(HOUSEHOLD_KEY))
+    print(f"Household keys: {len(nodes):,} identifiers, {n_links:,} links, "
+          f"{keys[HOUSEHOLD_KEY].n_unique():,} households ({n_hubs:,} over-linked serial numbers ignored)")
+    return keys
+
+
+def with_household(frame, keys, account="contract_account_hashed", contract="contract_hashed"):
+    """A polars frame with the household_ID of each row's account (or, without one, its contract)."""
+    lookup = keys.filter(pl.col("kind").is_in(["account", "contract"]))
+    return (
+        frame.with_columns(
+            pl.when(pl.col(account).is_not_null()).then(pl.lit("account")).otherwise(pl.lit("contract")).alias("_kind"),
+            pl.coalesce(pl.col(account), pl.col(contract)).cast(pl.String).alias("_id"),
+        )
+        .join(lookup, left_on=["_kind", "_id"], right_on=["kind", "id"], how="left")
+        .drop(["_kind", "_id"])
+    )
@@ -0,0 +1,178 @@
+"""
+Contract-major time-series store: the monthly series of every contract as
+contiguous NumPy arrays, one slice per contract.
+
+    output/9_out/household_series/
+        contracts.npy      contract_ID of each contract (fixed-width bytes)
+        offsets.npy        rows of contract i are offsets[i]:offsets[i + 1]
+        month_idx.npy      one row per contract and month, sorted by month
+        kwh.npy            ...one file per column in SERIES_COLUMNS
+        _meta.json         columns, dtypes and counts
+
+Every file is a plain .npy array opened with memory mapping, so a series is read
+straight from the page cache and unread columns are never touched. Contracts are
+found through a dict built on the first lookup:
+
+    store = HouseholdSeries("output/9_out/household_series")
+    s = store["3f2a..."]                     # {"month_idx": array, "kwh": array, ...} (views)
+    offsets, batch = store.batch(ids)        # ragged batch: rows of ids[i] are offsets[i]:offsets[i + 1]
+    total_kwh = store.reduce("kwh")          # per-contract np.add.reduceat, no groupby
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import polars as pl
+
+# Columns of a series and their array dtypes (month_idx first)
+SERIES_COLUMNS = {
+    "month_idx": np.int16,
+    "kwh": np.float64,            # all tariffs of the month
+    "outage_min": np.float64,     # load shedding minutes of the contract's block (NaN: no block)
+    "has_shs": np.bool_,          # SHS present in the year (5b rules)
+    "pv": np.bool_,               # shs_label_edit == "PV_normal" (5c)
+    "watt": np.float64,           # PV capacity (NaN: none)
+}
+
+CONTRACTS_FILE = "contracts.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "_meta.json"
+
+#######################################
+# Contract-months
+
+def contract_months(frame):
+    """
+    One row per contract and month (SERIES_COLUMNS plus contract_ID) from the final
+    panel, sorted by contract and month. Rows repeated for several buildings or
+    blocks count once; the kWh of several tariffs in a month add up.
+    """
+    return (
+        frame.lazy()
+        .select("contract_ID", "month_idx", "trfname", "kwh", "total_duration_min", "has_shs",
+                "shs_label_edit", "Watt")
+        .with_columns(pl.col("contract_ID").cast(pl.String), pl.col("trfname").cast(pl.String),
+                      (pl.col("shs_label_edit").cast(pl.String) == "PV_normal").fill_null(False).alias("pv"))
+        .group_by("contract_ID", "month_idx")
+        .agg(
+            pl.col("kwh").filter(pl.struct("trfname", "kwh").is_first_distinct()).sum(),
+            pl.col("total_duration_min").max().alias("outage_min"),
+            pl.col("has_shs").fill_null(False).any(),
+            pl.col("pv").any(),
+            pl.col("Watt").max().alias("watt"),
+        )
+        .sort("contract_ID", "month_idx")
+        .collect()
+    )
+
+#######################################
+# Write
+
+def write_series(path, frames, n_rows, n_contracts):
+    """
+    Write the store from contract_months() frames (each contract in one frame),
+    given the total rows and contracts. The arrays are filled frame by frame,
+    so only one frame is in memory.
+    """
+    staging = path + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    columns = {c: np.lib.format.open_memmap(os.path.join(staging, f"{c}.npy"), mode="w+", dtype=dtype,
+                                            shape=(n_rows,))
+               for c, dtype in SERIES_COLUMNS.items()}
+    offsets = np.zeros(n_contracts + 1, dtype=np.int64)
+    contracts = []
+    row = contract = 0
+    for frame in frames:
+        id_column = frame["contract_ID"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, id_column[1:] != id_column[:-1]])   # first row of each contract
+        ids = id_column[starts]
+        offsets[contract + 1:contract + len(ids) + 1] = row + np.append(starts[1:], frame.height)
+        contracts.append(ids)
+        for c, dtype in SERIES_COLUMNS.items():
+            values = frame[c].fill_null(np.nan) if dtype == np.float64 else frame[c]
+            columns[c][row:row + frame.height] = values.to_numpy().astype(dtype, copy=False)
+        row, contract = row + frame.height, contract + len(ids)
+    if (row, contract) != (n_rows, n_contracts):
+        raise ValueError(f"Expected {n_rows:,} rows of {n_contracts:,} contracts, got {row:,} of {contract:,}")
+    for array in columns.values():
+        array.flush()
+    del columns
+
+    ids = np.concatenate(contracts) if contracts else np.array([], dtype=object)
+    np.save(os.path.join(staging, CONTRACTS_FILE), np.char.encode(ids.astype(str), "utf-8") if len(ids)
+            else np.array([], dtype="S1"))
+    np.save(os.path.join(staging, OFFSETS_FILE), offsets)
+    with open(os.path.join(staging, META_FILE), "w") as f:
+        json.dump({"columns": {c: np.dtype(d).name for c, d in SERIES_COLUMNS.items()},
+                   "rows": n_rows, "contracts": n_contracts}, f, indent=1)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+
+#######################################
+# Read
+
+class HouseholdSeries:
+    """Memory-mapped store written by write_series(); series are array views, found in O(1)."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.columns = {c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in self.meta["columns"]}
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.contracts = np.load(os.path.join(path, CONTRACTS_FILE), mmap_mode="r")
+        self._index = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, contract_id):
+        return self._key(contract_id) in self.index
+
+    def __getitem__(self, contract_id):
+        return self.series(contract_id)
+
+    @property
+    def index(self):
+        """contract_ID (bytes) -> position; built on first use."""
+        if self._index is None:
+            self._index = {c: i for i, c in enumerate(self.contracts.tolist())}
+        return self._index
+
+    @staticmethod
+    def _key(contract_id):
+        return contract_id if isinstance(contract_id, bytes) else str(contract_id).encode("utf-8")
+
+    def position(self, contract_id):
+        try:
+            return self.index[self._key(contract_id)]
+        except KeyError:
+            raise KeyError(f"Contract {contract_id!r} is not in the store") from None
+
+    def series(self, contract_id, columns=None):
+        """{column: array view} of one contract's months."""
+        i = self.position(contract_id)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {c: self.columns[c][start:end] for c in columns or self.columns}
+
+    def batch(self, contract_ids, columns=None):
+        """
+        Series of several contracts as (offsets, {column: array}): the rows of
+        contract_ids[i] are offsets[i]:offsets[i + 1] of each array (copies).
+        """
+        positions = np.array([self.position(c) for c in contract_ids], dtype=np.int64)
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        lengths = ends - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return offsets, {c: self.columns[c][rows] for c in columns or self.columns}
+
+    def reduce(self, column, ufunc=np.add):
+        """ufunc.reduceat of a column over every contract (contracts are never empty)."""
+        return ufunc.reduceat(self.columns[column], self.offsets[:-1]) if len(self) else np.array([])
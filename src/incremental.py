@@ -0,0 +1,172 @@
+"""
+Incremental runs of the bucketed stages (2b to 7) for a set of changed ("dirty") contracts.
+
+A stage normally rebuilds its whole output dataset. Given a dirty set of
+contract_IDs, it reads only the buckets holding those contracts, keeps only
+their rows, and replaces their rows in the existing output buckets; all other
+contracts are left as they are. It then records the set in its output folder,
+so the next stage picks it up:
+
+    PIPELINE_DIRTY_CONTRACTS=changed.csv python src/2b_Contract_with_location.py
+    python src/3_ContractLocation_with_building.py      # recomputes the contracts recorded by 2b
+    ...
+
+The dirty set of a stage is the set recorded in its input dataset plus the
+contracts listed in PIPELINE_DIRTY_CONTRACTS (one contract_ID per line, or a
+Parquet file with a contract_ID column), so a correction can also enter
+mid-pipeline (e.g. new rows in the registrations read by 5c). A full run
+records no set, so the stages after it run in full as well.
+
+Incremental runs assume the output was written by a full run with the same
+PIPELINE_N_BUCKETS.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from buckets import BUCKET_KEY, bucket_ids, bucket_path, contract_mask, list_buckets, reset_dataset
+from schema import to_categorical
+from settings import DIRTY_CONTRACTS
+from storage import INTERMEDIATE_FORMAT, extension, read_schema, read_table, with_sort_order, write_table
+
+DIRTY_FILE = "_dirty_contracts.parquet"
+
+#######################################
+# Dirty sets
+
+def read_contract_list(path):
+    """contract_IDs listed in a Parquet file (contract_ID column) or a text file (one per line)."""
+    if path.endswith(".parquet"):
+        return set(pd.read_parquet(path, columns=[BUCKET_KEY])[BUCKET_KEY].dropna().astype(str))
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip() and line.strip() != BUCKET_KEY}
+
+
+def dirty_contracts(input_dir=None):
+    """Dirty set of a stage reading `input_dir`, or None for a full run."""
+    sets = []
+    if input_dir is not None and os.path.exists(os.path.join(input_dir, DIRTY_FILE)):
+        sets.append(read_contract_list(os.path.join(input_dir, DIRTY_FILE)))
+    if DIRTY_CONTRACTS:
+        sets.append(read_contract_list(DIRTY_CONTRACTS))
+    return set().union(*sets) if sets else None
+
+
+def record_dirty(dataset_dir, contracts):
+    """Record the contracts rewritten in `dataset_dir` for the next stage (None = full run, no record)."""
+    path = os.path.join(dataset_dir, DIRTY_FILE)
+    if contracts is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    pd.DataFrame({BUCKET_KEY: sorted(contracts)}).to_parquet(path, index=False)
+
+
+def dirty_buckets(contracts):
+    """Sorted bucket numbers holding the given contracts."""
+    return sorted(int(b) for b in np.unique(bucket_ids(sorted(contracts))))
+
+
+def plan_buckets(input_dir, output_dir, dirty):
+    """
+    Buckets a stage processes: every input bucket for a full run (the output is
+    reset), otherwise only the input buckets holding dirty contracts.
+    """
+    buckets = list_buckets(input_dir)
+    if dirty is None:
+        reset_dataset(output_dir)
+        return buckets
+    os.makedirs(output_dir, exist_ok=True)
+    buckets = sorted(set(buckets) & set(dirty_buckets(dirty)))
+    print(f"Incremental run: {len(dirty):,} dirty contracts in {len(buckets)} buckets")
+    return buckets
+
+#######################################
+# Writing
+
+def _as_table(data):
+    if isinstance(data, pd.DataFrame):
+        return pa.Table.from_pandas(to_categorical(data), preserve_index=False)
+    return data
+
+
+def replace_contracts(data, dataset_dir, bucket, contracts, fmt=INTERMEDIATE_FORMAT):
+    """
+    Replace the rows of `contracts` in one bucket file with `data` (pandas or Arrow),
+    keeping every other row. New rows are cast to the existing file's schema.
+    The new rows go after the kept ones, so the file loses any recorded sort order.
+    """
+    table = _as_table(data)
+    path = bucket_path(dataset_dir, bucket)
+    if os.path.exists(path):
+        existing = read_table(path)
+        kept = existing.filter(pc.invert(contract_mask(existing, contracts)))
+        table = pa.concat_tables([kept, table.select(existing.schema.names).cast(existing.schema)])
+    elif not table.num_rows:
+        return
+
+    # Write next to the old file and swap, so a memory-mapped old file is never overwritten
+    target = bucket_path(dataset_dir, bucket, fmt)
+    write_table(with_sort_order(table, None), target + ".tmp", fmt)
+    os.replace(target + ".tmp", target)
+    if path != target and os.path.exists(path):
+        os.remove(path)
+
+
+def save_bucket(data, dataset_dir, bucket, dirty, fmt=INTERMEDIATE_FORMAT, sorted_by=None):
+    """
+    Write a bucket (full run) or replace the dirty contracts' rows in it (incremental run).
+    sorted_by: the sort order of `data`, recorded in a full run only.
+    """
+    if dirty is not None:
+        replace_contracts(data, dataset_dir, bucket, dirty, fmt)
+    else:
+        write_table(_as_table(data), bucket_path(dataset_dir, bucket, fmt), fmt, sorted_by=sorted_by)
+
+
+def save_empty_bucket(dataset_dir, bucket, dirty, fmt=INTERMEDIATE_FORMAT):
+    """
+    save_bucket for a bucket left with no rows. Buckets are planned by the hash of
+    the dirty contracts, not by their presence, so an incremental run can read none
+    of their rows from a bucket; their old rows are removed. A full run writes no file.
+    """
+    path = bucket_path(dataset_dir, bucket)
+    if dirty is not None and os.path.exists(path):
+        replace_contracts(read_schema(path).empty_table(), dataset_dir, bucket, dirty, fmt)
+
+
+def replace_buckets(df, dataset_dir, dirty, key=BUCKET_KEY):
+    """replace_contracts for a whole frame of dirty contracts, bucket by bucket (the incremental write_buckets)."""
+    os.makedirs(dataset_dir, exist_ok=True)
+    ids = bucket_ids(df[key])
+    for bucket in dirty_buckets(dirty):
+        replace_contracts(df[ids == bucket], dataset_dir, bucket, dirty)
+    return len(dirty_buckets(dirty))
+
+#######################################
+# Streaming stages (6, 7)
+
+def sink_path(dataset_dir, bucket, dirty, fmt=INTERMEDIATE_FORMAT):
+    """
+    File a streaming stage writes one bucket to: the bucket file itself, or in an
+    incremental run a staging file that merge_staged() folds into the bucket.
+    """
+    if dirty is None:
+        return bucket_path(dataset_dir, bucket, fmt)
+    return os.path.join(dataset_dir, f"staged-{bucket:05d}{extension(fmt)}")
+
+
+def merge_staged(dataset_dir, bucket, dirty, fmt=INTERMEDIATE_FORMAT):
+    """Fold the staging file of an incremental run into its bucket (no-op for a full run)."""
+    if dirty is None:
+        return
+    staged = sink_path(dataset_dir, bucket, dirty, fmt)
+    replace_contracts(read_table(staged), dataset_dir, bucket, dirty, fmt)
+    os.remove(staged)
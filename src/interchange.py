@@ -0,0 +1,157 @@
+"""
+Arrow hand-offs between pandas, polars and DuckDB.
+
+Stages pass Arrow tables between engines instead of converting frame to frame.
+Only some columns avoid a copy on the way:
+
+    numeric columns        shared in every direction
+    arrow → pandas         shared (ArrowDtype columns point at the Arrow buffers)
+    pandas → arrow         object (string) columns are copied
+    arrow ↔ polars         strings are copied (polars keeps them as string views)
+
+so a string-heavy frame is mostly copied when it enters and leaves polars.
+
+Each hand-off can be recorded in a CopyLedger, which counts the bytes of the
+result that do not live in the source's buffers (i.e. were copied). Stage 2b
+appends its counts to output/benchmarks/arrow_copies.csv.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+
+COPY_LOG = "output/benchmarks/arrow_copies.csv"
+
+#######################################
+# Buffer accounting
+
+def _arrow_ranges(data):
+    """(address, size) of every buffer of an Arrow table, record batch or array."""
+    if isinstance(data, (pa.Table, pa.RecordBatch)):
+        columns = data.columns
+    else:
+        columns = [data]
+    for column in columns:
+        chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+        for chunk in chunks:
+            if isinstance(chunk.type, pa.DictionaryType):
+                yield from _arrow_ranges(chunk.dictionary)
+            for buf in chunk.buffers():
+                if buf is not None and buf.size:
+                    yield buf.address, buf.size
+
+
+def _pandas_ranges(df):
+    """(address, size) of the memory behind each pandas column."""
+    for _, col in df.items():
+        values = col.array
+        if isinstance(col.dtype, pd.ArrowDtype):
+            yield from _arrow_ranges(values._pa_array)
+        else:
+            arr = np.asarray(values)
+            if arr.dtype != object and arr.nbytes:
+                yield arr.__array_interface__["data"][0], arr.nbytes
+            elif arr.nbytes:
+                # Object columns are always a fresh array of Python objects
+                yield -1, arr.nbytes
+
+
+def _ranges(data):
+    if isinstance(data, pd.DataFrame):
+        return list(_pandas_ranges(data))
+    if isinstance(data, pl.DataFrame):
+        # polars buffers are exported to Arrow without copying
+        return list(_arrow_ranges(data.to_arrow()))
+    return list(_arrow_ranges(data))
+
+
+def copied_bytes(source, result):
+    """Bytes of `result` whose buffers are not inside any buffer of `source`."""
+    source_ranges = sorted((a, a + n) for a, n in _ranges(source) if a >= 0)
+    starts = np.array([s for s, _ in source_ranges], dtype=np.int64)
+    ends = np.array([e for _, e in source_ranges], dtype=np.int64)
+    copied = 0
+    for address, size in _ranges(result):
+        i = np.searchsorted(starts, address, side="right") - 1
+        if address < 0 or i < 0 or address + size > ends[i]:
+            copied += size
+    return copied
+
+
+def nbytes(data):
+    return sum(n for _, n in _ranges(data))
+
+
+class CopyLedger:
+    """Per-stage record of hand-offs: bytes handed over and bytes copied."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.records = []
+
+    def record(self, handoff, source, result):
+        self.records.append({
+            "stage": self.stage,
+            "handoff": handoff,
+            "bytes_in": nbytes(source),
+            "bytes_copied": copied_bytes(source, result),
+        })
+        return result
+
+    def summary(self):
+        return pd.DataFrame(self.records, columns=["stage", "handoff", "bytes_in", "bytes_copied"])
+
+    def report(self):
+        summary = self.summary()
+        print(f"\n Arrow hand-offs in stage {self.stage}:")
+        for row in summary.itertuples():
+            print(f"   🔹 {row.handoff}: {row.bytes_in / 1e6:,.1f} MB handed over, "
+                  f"{row.bytes_copied / 1e6:,.1f} MB copied")
+
+    def save(self, path=COPY_LOG):
+        """Append this stage's records to the pipeline-wide copy log."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.summary().to_csv(path, mode="a", index=False, header=not os.path.exists(path))
+
+#######################################
+# Conversions
+
+def _record(ledger, handoff, source, result):
+    return ledger.record(handoff, source, result) if ledger is not None else result
+
+
+def _arrow_dtype(arrow_type):
+    # Dictionary columns become pandas categoricals (only the indices are copied);
+    # pandas' ArrowDtype cannot factorize unsigned dictionary indices
+    return None if pa.types.is_dictionary(arrow_type) else pd.ArrowDtype(arrow_type)
+
+
+def to_pandas(table, ledger=None):
+    """Arrow table → pandas with ArrowDtype columns (not copied) and categoricals for dictionary columns."""
+    return _record(ledger, "arrow→pandas", table, table.to_pandas(types_mapper=_arrow_dtype))
+
+
+def from_pandas(df, ledger=None):
+    """pandas → Arrow table (ArrowDtype and numeric columns are not copied; object columns are)."""
+    return _record(ledger, "pandas→arrow", df, pa.Table.from_pandas(df, preserve_index=False))
+
+
+def to_polars(table, ledger=None):
+    """Arrow table → polars DataFrame (numeric columns are not copied; strings are re-encoded as string views)."""
+    return _record(ledger, "arrow→polars", table, pl.from_arrow(table, rechunk=False))
+
+
+def from_polars(df, ledger=None):
+    """polars DataFrame → Arrow table (numeric columns are not copied; string views are copied to Arrow strings)."""
+    return _record(ledger, "polars→arrow", df, df.to_arrow())
+
+
+def duckdb_arrow(con, query):
+    """Run a DuckDB query and fetch the result as an Arrow table (no pandas conversion)."""
+    return con.execute(query).fetch_arrow_table()
@@ -0,0 +1,299 @@
+"""
+Compile the load shedding schedule into a per-area interval table.
+
+The schedule CSV is parsed once into outage intervals (area, start, end) sorted
+by area and start time, and duration totals per area and day / week / month are
+computed from it. All of these are cached as Parquet next to the stage outputs
+and reused until the CSV changes, so analyses at any resolution cost one cached
+read instead of re-parsing the CSV.
+
+Interval start: the 'Date' column (with its time of day, if any), or the day of
+'Date' at the time in a 'Start' column (HH:MM or HH:MM:SS) when the CSV has one
+and the row's Start parses. Interval end: start + 'Duration min'.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from months import month_index_of
+from schema import csv_columns, require_columns
+
+# Paths
+LOADSHED_FILE = "data/raw/Loadshedding_schedule.csv"
+CACHE_DIR = "output/loadshed_schedule"
+
+# Columns read from the schedule ('Start' is optional)
+schedule_columns = ["Date", "Stage", "Area", "Duration min"]
+optional_columns = ["Start"]
+
+# Bump when the compiled tables change shape, so old caches are rebuilt
+COMPILER_VERSION = "3"
+AREA_PATTERN = r"(?i)area\s*([0-9]+)"
+HOUR_MINUTE_PATTERN = r"^\d{1,2}:\d{2}$"
+AGGREGATES = {
+    "daily": "date",
+    "weekly": "week_start",
+    "monthly": "month_idx",
+}
+
+#######################################
+# Parsing
+
+def extract_area_numbers(area, stage):
+    """
+    Number following 'Area' in the Area column, or in the Stage column where the
+    Area column has none (vectorized; <NA> when neither has one).
+    """
+    from_area = pd.Series(area, dtype="string").str.extract(AREA_PATTERN, expand=False)
+    from_stage = pd.Series(stage, dtype="string").str.extract(AREA_PATTERN, expand=False)
+    return pd.to_numeric(from_area.fillna(from_stage), errors="coerce").astype("Int64")
+
+
+def parse_start_times(start):
+    """Time of day in the Start column as timedeltas (HH:MM or HH:MM:SS; NaT where it does not parse)."""
+    start = pd.Series(start, dtype="string").str.strip()
+    start = start.where(~start.str.match(HOUR_MINUTE_PATTERN, na=False), start + ":00")
+    return pd.to_timedelta(start, errors="coerce")
+
+
+def read_schedule(path=LOADSHED_FILE):
+    """Schedule CSV with stripped column names and only the columns used here."""
+    available = [c.strip() for c in csv_columns(path)]
+    require_columns(available, schedule_columns, path)
+    wanted = schedule_columns + [c for c in optional_columns if c in available]
+    df = pd.read_csv(path, usecols=lambda c: c.strip() in wanted)
+    df.columns = df.columns.str.strip()
+    return df
+
+
+def compile_intervals(shed_df):
+    """
+    Outage intervals sorted by (Area_number, start):
+    Area_number, Stage, start, end, duration_min.
+    Rows without an area number, date or duration are dropped; a Start that does
+    not parse falls back to the Date.
+    """
+    start = pd.to_datetime(shed_df["Date"], errors="coerce")
+    if "Start" in shed_df.columns:
+        start = (start.dt.normalize() + parse_start_times(shed_df["Start"])).fillna(start)
+    duration = pd.to_numeric(shed_df["Duration min"], errors="coerce")
+
+    intervals = pd.DataFrame({
+        "Area_number": extract_area_numbers(shed_df["Area"], shed_df["Stage"]),
+        "Stage": shed_df["Stage"].astype("string"),
+        "start": start,
+        "end": start + pd.to_timedelta(duration, unit="min"),
+        "duration_min": duration.astype("float64"),
+    })
+    intervals = intervals.dropna(subset=["Area_number", "start", "duration_min"])
+    return intervals.sort_values(["Area_number", "start"], kind="stable").reset_index(drop=True)
+
+
+def aggregate_durations(intervals, period):
+    """Total outage minutes per area and period ('daily', 'weekly' or 'monthly'), by interval start."""
+    start = intervals["start"]
+    key = {
+        "daily": lambda: start.dt.normalize(),
+        "weekly": lambda: (start - pd.to_timedelta(start.dt.weekday, unit="D")).dt.normalize(),
+        "monthly": lambda: month_index_of(start),
+    }[period]()
+    summary = (
+        intervals.assign(**{AGGREGATES[period]: key})
+        .groupby(["Area_number", AGGREGATES[period]], as_index=False)["duration_min"].sum()
+    )
+    return summary.rename(columns={"duration_min": "total_duration_min"})
+
+#######################################
+# Cache
+
+def source_fingerprint(path):
+    """Digest of the schedule file and compiler version; the cache is valid while it is unchanged."""
+    digest = hashlib.blake2b(COMPILER_VERSION.encode(), digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir, name):
+    return os.path.join(cache_dir, f"{name}.parquet")
+
+
+def _read_cached(cache_dir, name, fingerprint):
+    path = _cache_path(cache_dir, name)
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    if metadata.get(b"source_fingerprint") != fingerprint.encode():
+        return None
+    return pd.read_parquet(path)
+
+
+def _write_cached(df, cache_dir, name, fingerprint):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b"source_fingerprint": fingerprint.encode()}
+    # Write then rename, so stages compiling the schedule at the same time (7, 8)
+    # never read a half-written cache file
+    path = _cache_path(cache_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+    os.replace(tmp_path, path)
+
+
+class Schedule:
+    """Compiled schedule: the interval table, its aggregates and a per-area index."""
+
+    def __init__(self, intervals, aggregates):
+        self.intervals = intervals
+        self.daily = aggregates["daily"]
+        self.weekly = aggregates["weekly"]
+        self.monthly = aggregates["monthly"]
+        self._index = None
+
+    @property
+    def index(self):
+        """AreaIntervals over the interval table (built on first use)."""
+        if self._index is None:
+            self._index = AreaIntervals(self.intervals)
+        return self._index
+
+
+def load_schedule(path=LOADSHED_FILE, cache_dir=CACHE_DIR, rebuild=False):
+    """Compiled schedule, from the cache if it matches the CSV, otherwise compiled and cached."""
+    fingerprint = source_fingerprint(path)
+    names = ["intervals"] + list(AGGREGATES)
+
+    if not rebuild:
+        cached = {name: _read_cached(cache_dir, name, fingerprint) for name in names}
+        if all(df is not None for df in cached.values()):
+            print(f"Loaded compiled schedule from {cache_dir}")
+            return Schedule(cached.pop("intervals"), cached)
+
+    print(f"Compiling load shedding schedule: {path}")
+    intervals = compile_intervals(read_schedule(path))
+    aggregates = {period: aggregate_durations(intervals, period) for period in AGGREGATES}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, df in [("intervals", intervals), *aggregates.items()]:
+        _write_cached(df, cache_dir, name, fingerprint)
+    print(f"Cached {len(intervals):,} intervals and daily/weekly/monthly totals in {cache_dir}")
+    return Schedule(intervals, aggregates)
+
+#######################################
+# Per-area interval index
+
+SECOND_NS = 10**9
+
+
+class AreaIntervals:
+    """
+    Outage intervals per area in CSR layout: the intervals of area a are
+    start[offsets[i]:offsets[i + 1]] where areas[i] == a. Times are int64 seconds
+    since 1970-01-01. Overlapping or touching intervals of the same area are
+    merged, so each area's intervals are disjoint and sorted.
+    """
+
+    def __init__(self, intervals):
+        area = intervals["Area_number"].to_numpy(dtype=np.int64)
+        start = intervals["start"].to_numpy("datetime64[ns]").astype(np.int64) // SECOND_NS
+        end = intervals["end"].to_numpy("datetime64[ns]").astype(np.int64) // SECOND_NS
+
+        if not len(area):   # no intervals: every area is outage-free
+            self.start = self.end = self.areas = np.array([], dtype=np.int64)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+
+        order = np.lexsort((start, area))
+        area, start, end = area[order], start[order], end[order]
+
+        # Running max of end within each area (areas are offset so the max never
+        # carries over); a merged interval opens where the area changes or the
+        # start is past every earlier end of the same area
+        new_area = np.r_[True, area[1:] != area[:-1]]
+        group = np.cumsum(new_area) - 1
+        span = end.max() - end.min() + 1
+        shifted = end - end.min() + group * span
+        running_end = np.maximum.accumulate(shifted) - group * span + end.min()
+        opens = new_area.copy()
+        opens[1:] |= start[1:] > running_end[:-1]
+
+        merged = np.cumsum(opens) - 1
+        self.start = start[opens]
+        self.end = np.zeros(len(self.start), dtype=np.int64)
+        np.maximum.at(self.end, merged, end)
+        merged_area = area[opens]
+
+        self.areas, first = np.unique(merged_area, return_index=True)
+        self.offsets = np.r_[first, len(merged_area)].astype(np.int64)
+
+    def position(self, area):
+        """Row of each area in self.areas (-1 for areas without intervals)."""
+        area = np.asarray(area, dtype=np.int64)
+        if not len(self.areas):
+            return np.full(len(area), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.areas, area), len(self.areas) - 1)
+        return np.where(self.areas[pos] == area, pos, -1)
+
+    def of(self, area):
+        """(start, end) second arrays of one area's merged intervals."""
+        pos = self.position([area])[0]
+        if pos < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        sl = slice(self.offsets[pos], self.offsets[pos + 1])
+        return self.start[sl], self.end[sl]
+
+    def overlap(self, area, start, end):
+        """
+        Outage seconds and number of outage intervals overlapping each query [start, end)
+        of an area (times in seconds, as in self.start).
+
+        Each area's intervals are disjoint and sorted, so the overlapping ones are a
+        contiguous run found by binary search; prefix sums of their durations give
+        the overlap in O(log n) per query. All areas are searched at once on a
+        composite (area, time) key, so there is no loop over areas or queries.
+        """
+        area = np.asarray(area, dtype=np.int64)
+        start = np.asarray(start, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        seconds = np.zeros(len(area), dtype=np.int64)
+        count = np.zeros(len(area), dtype=np.int64)
+
+        pos = self.position(area)
+        valid = (pos >= 0) & (end > start)
+        if not valid.any():
+            return seconds, count
+        pos, qs, qe = pos[valid], start[valid], end[valid]
+
+        # Composite keys: area row * span + time offset; query times are clipped to
+        # just outside the area's range so they never reach a neighbouring area
+        t0 = self.start.min()
+        span = self.end.max() - t0 + 2
+        interval_pos = np.repeat(np.arange(len(self.areas)), np.diff(self.offsets))
+        start_key = interval_pos * span + (self.start - t0)
+        end_key = interval_pos * span + (self.end - t0)
+
+        def key(t):
+            return pos * span + np.clip(t - t0, -1, span - 1)
+
+        first = np.searchsorted(end_key, key(qs), side="right")    # first interval ending after the query starts
+        stop = np.searchsorted(start_key, key(qe), side="left")    # intervals starting before the query ends
+        n = np.maximum(stop - first, 0)
+
+        cum = np.r_[0, np.cumsum(self.end - self.start)]
+        total = cum[np.maximum(stop, first)] - cum[first]
+        hit = n > 0
+        # Trim the parts of the first and last interval outside the query
+        total[hit] -= np.maximum(qs[hit] - self.start[first[hit]], 0)
+        total[hit] -= np.maximum(self.end[stop[hit] - 1] - qe[hit], 0)
+
+        seconds[valid] = total
+        count[valid] = n
+        return seconds, count
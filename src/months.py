@@ -0,0 +1,68 @@
+"""
+Canonical month column for the pipeline: `month_idx`, an int16 count of months
+since 2000-01 (2000-01 = 0, 2021-04 = 255, ...).
+
+Stages produce it once from the raw dates and then sort, group and join on the
+integer. "YYYY-MM" strings are only made at export (stage 7), with month_string().
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+MONTH_COLUMN = "month_idx"
+MONTH_DTYPE = "Int16"   # nullable: invalid or missing dates stay <NA>
+BASE_YEAR = 2000
+
+# Offset from numpy's month epoch (1970-01) to 2000-01
+_EPOCH_OFFSET = (BASE_YEAR - 1970) * 12
+
+#######################################
+# pandas
+
+def month_index(year, month):
+    """Month index from year and month numbers (<NA> where either is missing or the month is not 1-12)."""
+    year = pd.to_numeric(pd.Series(year), errors="coerce")
+    month = pd.to_numeric(pd.Series(month), errors="coerce")
+    idx = (year - BASE_YEAR) * 12 + (month - 1)
+    return idx.where(month.between(1, 12)).astype(MONTH_DTYPE)
+
+
+def month_index_of(timestamps):
+    """Month index of each timestamp (<NA> for missing or unparseable values)."""
+    ts = pd.to_datetime(pd.Series(timestamps), errors="coerce")
+    return month_index(ts.dt.year, ts.dt.month)
+
+
+def month_parts(idx):
+    """(year, month) Int32 Series of each month index."""
+    idx = pd.Series(idx).astype("Int32")
+    return idx // 12 + BASE_YEAR, idx % 12 + 1
+
+
+def month_start(idx):
+    """First day of each month index as datetime64 (NaT for <NA>)."""
+    idx = pd.Series(idx).astype("Int32")
+    months = (idx.fillna(0).to_numpy(np.int64) + _EPOCH_OFFSET).astype("datetime64[M]")
+    return pd.Series(months.astype("datetime64[ns]"), index=idx.index).where(idx.notna())
+
+
+def month_string(idx):
+    """'YYYY-MM' of each month index, for export only (<NA> stays missing)."""
+    return month_start(idx).dt.strftime("%Y-%m")
+
+#######################################
+# polars
+
+def pl_month_index(timestamp):
+    """Polars expression: month index of a Date/Datetime expression."""
+    return ((timestamp.dt.year() - BASE_YEAR) * 12 + timestamp.dt.month() - 1).cast(pl.Int16)
+
+
+def pl_month_start(idx):
+    """Polars expression: first day (Date) of a month index expression."""
+    idx = idx.cast(pl.Int32)
+    return pl.date(idx // 12 + BASE_YEAR, idx % 12 + 1, 1)
@@ -0,0 +1,379 @@
+"""
+Run the numbered stage scripts as one pipeline.
+
+Each stage declares the paths it reads and writes and the settings its output
+depends on. Its fingerprint covers the script and the helper modules it imports,
+the contents of its inputs and those settings. A stage is skipped when its
+fingerprint matches its last successful run and its outputs still exist.
+Dependencies follow from the paths (a stage runs after the stages that write its
+inputs), and stages that do not depend on each other run at the same time.
+
+    python src/pipeline.py                  # every stage that is out of date
+    python src/pipeline.py 5c               # 5c and any out-of-date stage upstream of it
+    python src/pipeline.py 6 7 --only       # just these stages
+    python src/pipeline.py 5b --force       # re-run 5b even if it is up to date
+    python src/pipeline.py --dry-run        # show what would run
+
+Run from the repository root (stage paths are relative to it). The output of
+each stage goes to output/logs/<stage>.log.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import settings
+from telemetry import start_run
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = "output/.pipeline"
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+DIGEST_FILE = os.path.join(STATE_DIR, "digests.json")
+LOG_DIR = "output/logs"
+
+#######################################
+# Stages
+
+class Stage:
+    """One stage script: the paths it reads and writes (files, folders or globs) and the settings it uses."""
+
+    def __init__(self, name, script, inputs, outputs, params=()):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = list(params)
+
+
+# Paths mirror the constants at the top of each script
+STAGES = [
+    Stage("1a", "1a_Import_old_data.py",
+          inputs=["data/old_prepaid", "data/postpaid"],
+          outputs=["output/1_out/combined_electricity_data.parquet", "output/1_out/account_meters.parquet"],
+          params=["SAMPLE_FRACTION", "SAMPLE_SEED"]),
+    Stage("1b", "1b_Create_monthly_new_data.py",
+          inputs=["data/prepaid_parquet"],
+          outputs=["output/1_out/final_monthly_new.parquet", "output/1_out/transaction_intervals"],
+          params=["N_BUCKETS", "INTERMEDIATE_FORMAT", "SAMPLE_FRACTION", "SAMPLE_SEED"]),
+    Stage("1c", "1c_Create_monthly_old_data.py",
+          inputs=["output/1_out/combined_electricity_data.parquet"],
+          outputs=["output/1_out/final_monthly_old_efficient.parquet"]),
+    Stage("2a", "2a_ImportLocation.py",
+          inputs=["data/ContractLocations"],
+          outputs=["output/2a_out/new_location_total.parquet"],
+          params=["SAMPLE_FRACTION", "SAMPLE_SEED"]),
+    Stage("2b", "2b_Contract_with_location.py",
+          inputs=["output/2a_out/new_location_total.parquet", "output/1_out/final_monthly_new.parquet",
+                  "data/devices_total.parquet", "output/1_out/final_monthly_old_efficient.parquet",
+                  "output/1_out/account_meters.parquet"],
+          outputs=["output/2b_out/out_contract_with_location", "output/2b_out/household_keys.parquet"],
+          params=["N_BUCKETS", "INTERMEDIATE_FORMAT", "SAMPLE_FRACTION", "SAMPLE_SEED"]),
+    Stage("3", "3_ContractLocation_with_building.py",
+          inputs=["output/2b_out/out_contract_with_location", "data/capetown_buildings2.parquet"],
+          outputs=["output/3_out/out_contractlocation_with_building"],
+          params=["INTERMEDIATE_FORMAT", "CONTRACT_BUILDING_MAX_DISTANCE_M"]),
+    Stage("4", "4_Building_with_SHS.py",
+          inputs=[f"data/prediction_merged_{year}.csv" for year in range(2020, 2024)]
+                 + ["data/capetown_buildings2.parquet"],
+          outputs=["output/4_out"],
+          params=["SHS_MIN_AREA_M2", "SHS_BUILDING_MAX_DISTANCE_M"]),
+    Stage("5a", "5a_Contract_with_SHS.py",
+          inputs=["output/4_out/*.parquet", "output/3_out/out_contractlocation_with_building"],
+          outputs=["output/5a_out/merged_contract_SHS"],
+          params=["INTERMEDIATE_FORMAT"]),
+    Stage("5b", "5b_SHS_assumptions.py",
+          inputs=["output/5a_out/merged_contract_SHS"],
+          outputs=["output/5b_out/combined"],
+          params=["INTERMEDIATE_FORMAT", "SHS_YEAR_RULES"]),
+    Stage("5c", "5c_SSEGRegistration.py",
+          inputs=["output/5b_out/combined", "data/checked_01132026.csv"],
+          outputs=["output/5c_out/with_sseg_reg"],
+          params=["INTERMEDIATE_FORMAT", "SAMPLE_FRACTION", "SAMPLE_SEED", "PANEL_SIZE_M2", "WATT_PER_PANEL"]),
+    Stage("6", "6_Add_blocks.py",
+          inputs=["output/5c_out/with_sseg_reg", "data/Load_shedding_Blocks.geojson"],
+          outputs=["output/6_out/merged_with_blocks_combined"],
+          params=["INTERMEDIATE_FORMAT", "ROW_GROUP_SIZE"]),
+    Stage("7", "7_Add_loadshed.py",
+          inputs=["output/6_out/merged_with_blocks_combined", "data/raw/Loadshedding_schedule.csv"],
+          outputs=["output/7_out/combined_merged"],
+          params=["ROW_GROUP_SIZE"]),
+    Stage("8", "8_Outage_exposure.py",
+          inputs=["output/1_out/transaction_intervals", "output/6_out/merged_with_blocks_combined",
+                  "data/raw/Loadshedding_schedule.csv"],
+          outputs=["output/8_out/transaction_outages"]),
+    Stage("9", "9_Household_series.py",
+          inputs=["output/7_out/combined_merged"],
+          outputs=["output/9_out/household_series"]),
+    Stage("10", "10_SHS_adoption.py",
+          inputs=["output/9_out/household_series", "output/7_out/combined_merged"],
+          outputs=["output/10_out/shs_adoption.parquet"]),
+]
+
+
+def _base(path):
+    """Path up to the first glob component."""
+    parts = []
+    for part in path.split("/"):
+        if any(ch in part for ch in "*?["):
+            break
+        parts.append(part)
+    return "/".join(parts)
+
+
+def _overlaps(a, b):
+    a, b = _base(a).rstrip("/") + "/", _base(b).rstrip("/") + "/"
+    return a.startswith(b) or b.startswith(a)
+
+
+def dependencies(stages=STAGES):
+    """{stage name: names of the stages that write any of its inputs}."""
+    return {
+        stage.name: {
+            other.name for other in stages
+            if other is not stage and any(_overlaps(i, o) for i in stage.inputs for o in other.outputs)
+        }
+        for stage in stages
+    }
+
+
+def select(names, only=False, stages=STAGES):
+    """Stages to consider, in pipeline order: `names` plus (unless only) everything upstream of them."""
+    by_name = {s.name: s for s in stages}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown stages: {unknown} (known: {list(by_name)})")
+    if not names:
+        return list(stages)
+    deps = dependencies(stages)
+    wanted = set(names)
+    if not only:
+        todo = list(names)
+        while todo:
+            for dep in deps[todo.pop()] - wanted:
+                wanted.add(dep)
+                todo.append(dep)
+    return [s for s in stages if s.name in wanted]
+
+#######################################
+# Fingerprints
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+class DigestCache:
+    """Content digests of files, recomputed only when a file's size or modification time changes."""
+
+    def __init__(self, path=DIGEST_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry and entry["stat"] == key:
+            return entry["digest"]
+        digest = _hash_file(path)
+        with self.lock:
+            self.entries[path] = {"stat": key, "digest": digest}
+        return digest
+
+    def path_digest(self, path):
+        """Digest of a file, of every file under a folder, or of every file matching a glob."""
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if os.path.isdir(path):
+            files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+        else:
+            files = glob.glob(path, recursive=True)
+        files = sorted(f for f in files if os.path.isfile(f) and not os.path.basename(f).startswith("."))
+        if not files:
+            return "missing"
+        digest = hashlib.blake2b(digest_size=16)
+        for f in files:
+            digest.update(f"{os.path.relpath(f, _base(path))}:{self.file_digest(f)}\n".encode())
+        return digest.hexdigest()
+
+    def save(self):
+        with self.lock:
+            _write_json(self.entries, self.path)
+
+
+def _local_imports(path):
+    """Names of the modules in src/ imported by a script."""
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.add(node.module)
+    return {n for n in names if os.path.exists(os.path.join(SRC_DIR, f"{n}.py"))}
+
+
+def code_digest(script):
+    """Digest of a script and every helper module it imports (directly or through other helpers)."""
+    files, todo = set(), [os.path.join(SRC_DIR, script)]
+    while todo:
+        path = todo.pop()
+        if path in files:
+            continue
+        files.add(path)
+        todo.extend(os.path.join(SRC_DIR, f"{n}.py") for n in _local_imports(path))
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(files):
+        digest.update(f"{os.path.basename(path)}:{_hash_file(path)}\n".encode())
+    return digest.hexdigest()
+
+
+def fingerprint(stage, digests):
+    """Digest of everything a stage's output depends on: code, input contents and settings."""
+    payload = {
+        "code": code_digest(stage.script),
+        "inputs": {path: digests.path_digest(path) for path in stage.inputs},
+        "params": {name: getattr(settings, name) for name in stage.params},
+    }
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+#######################################
+# Run
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def up_to_date(stage, fp, state):
+    return (state.get(stage.name, {}).get("fingerprint") == fp
+            and all(os.path.exists(o) for o in stage.outputs))
+
+
+def run_stage(stage):
+    """Run one stage script in its own process, writing its output to the stage log. Returns success."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    with open(os.path.join(LOG_DIR, f"{stage.name}.log"), "w") as log:
+        proc = subprocess.run([sys.executable, os.path.join(SRC_DIR, stage.script)],
+                              stdout=log, stderr=subprocess.STDOUT)
+    return proc.returncode == 0
+
+
+def run(stages, force=(), jobs=settings.STAGE_JOBS, dry_run=False):
+    """
+    Run the out-of-date stages among `stages` (in dependency order, up to `jobs` at a time).
+    Returns the names of the stages that failed or could not run because an upstream stage failed.
+    """
+    names = {s.name for s in stages}
+    deps = {name: d & names for name, d in dependencies().items() if name in names}
+    state = load_state()
+    digests = DigestCache()
+
+    if dry_run:
+        will_run = set()
+        for stage in stages:
+            if stage.name in force or deps[stage.name] & will_run:
+                will_run.add(stage.name)
+                print(f"   🔹 {stage.name}: would run")
+            elif up_to_date(stage, fingerprint(stage, digests), state):
+                print(f"   🔹 {stage.name}: up to date")
+            else:
+                will_run.add(stage.name)
+                print(f"   🔹 {stage.name}: would run (inputs, code or settings changed)")
+        return set()
+
+    start_run()   # one telemetry run id for all stages of this run
+    pending = list(stages)
+    done, failed = set(), set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        while pending or running:
+            # Start (or skip) every stage whose dependencies have finished
+            started = True
+            while started:
+                started = False
+                for stage in list(pending):
+                    if deps[stage.name] & failed:
+                        pending.remove(stage)
+                        failed.add(stage.name)
+                        print(f"⏭️  {stage.name}: not run (upstream stage failed)")
+                        started = True
+                    elif deps[stage.name] <= done and len(running) < max(jobs, 1):
+                        pending.remove(stage)
+                        fp = fingerprint(stage, digests)
+                        if stage.name not in force and up_to_date(stage, fp, state):
+                            done.add(stage.name)
+                            print(f"✅ {stage.name}: up to date, skipped")
+                        else:
+                            print(f"▶️  {stage.name}: running {stage.script}")
+                            running[pool.submit(run_stage, stage)] = (stage, fp, time.time())
+                        started = True
+            digests.save()
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, fp, start = running.pop(future)
+                seconds = time.time() - start
+                if future.result():
+                    done.add(stage.name)
+                    state[stage.name] = {"fingerprint": fp, "seconds": round(seconds, 1),
+                                         "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+                    _write_json(state, STATE_FILE)
+                    print(f"✅ {stage.name}: finished in {seconds:.1f}s")
+                else:
+                    failed.add(stage.name)
+                    print(f"❌ {stage.name}: failed after {seconds:.1f}s, see {os.path.join(LOG_DIR, stage.name + '.log')}")
+    return failed
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline stages that are out of date.")
+    parser.add_argument("stages", nargs="*", help="stages to run (default: all), e.g. 2b 5c")
+    parser.add_argument("--only", action="store_true", help="do not include upstream stages")
+    parser.add_argument("--force", action="store_true", help="re-run the named stages even if up to date")
+    parser.add_argument("--jobs", type=int, default=settings.STAGE_JOBS, help="stages run at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="only show which stages would run")
+    args = parser.parse_args()
+
+    stages = select(args.stages, only=args.only)
+    force = set(args.stages if args.stages else [s.name for s in stages]) if args.force else set()
+    print(f"\n Pipeline: {', '.join(s.name for s in stages)}")
+
+    start = time.time()
+    failed = run(stages, force=force, jobs=args.jobs, dry_run=args.dry_run)
+    if not args.dry_run:
+        print(f"Total runtime: {time.time() - start:.1f}s")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,141 @@
+"""
+Semi-join prefilters: read only the rows that can match something.
+
+    key_filter       Parquet read filter keeping rows whose key columns hold a
+                     key present on the other side of a join (2b: locations of
+                     the accounts and contracts in the panels). The filter is
+                     applied while scanning, so row groups without a match are
+                     skipped and other rows are never converted.
+    OccupancyGrid    coarse lon/lat grid of the cells within a search distance
+                     of at least one point (contracts in 3, PV predictions in 4).
+    read_buildings   buildings whose bounding box touches an occupied cell. The
+                     geometries are decoded one batch at a time and only the
+                     buildings kept go into the GeoDataFrame (and its spatial
+                     index), with their row labels from the full file.
+
+A building within the search distance of a point always touches an occupied
+cell, so the joins (within and nearest within the distance) find the same
+buildings as with every building loaded.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import json
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
+from pyproj import CRS
+
+# Set up
+MAX_CELLS = 20_000_000      # the grid cells grow when far-off points would make it larger
+BATCH_ROWS = 500_000        # buildings decoded at a time
+
+#######################################
+# Keys
+
+def key_filter(**keys):
+    """
+    pyarrow read filter (for pd.read_parquet(..., filters=...)) keeping rows where any
+    of the given columns holds one of its keys, e.g. key_filter(contract_hashed=contracts).
+    """
+    return [[(column, "in", pd.Series(values, dtype="string").dropna().unique().tolist())]
+            for column, values in keys.items()]
+
+#######################################
+# Points
+
+class OccupancyGrid:
+    """Cells of a lon/lat grid that are within `margin_deg` of at least one point (degrees)."""
+
+    def __init__(self, lon, lat, margin_deg):
+        lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
+        valid = np.isfinite(lon) & np.isfinite(lat)
+        lon, lat = lon[valid], lat[valid]
+        self.n_points = len(lon)
+        if not self.n_points:
+            self.cell, self.x0, self.y0, self.counts = margin_deg, 0.0, 0.0, np.zeros((1, 1), dtype=np.int64)
+            return
+
+        # Cells at least margin_deg wide, so a point's margin is inside its cell and the 8 around it
+        width, height = np.ptp(lon), np.ptp(lat)
+        self.cell = max(margin_deg, np.sqrt((width + 4 * margin_deg) * (height + 4 * margin_deg) / MAX_CELLS))
+        self.x0, self.y0 = lon.min() - self.cell, lat.min() - self.cell
+        nx = int((lon.max() - self.x0) / self.cell) + 2
+        ny = int((lat.max() - self.y0) / self.cell) + 2
+        points = np.zeros((ny, nx), dtype=bool)
+        points[((lat - self.y0) / self.cell).astype(np.int64), ((lon - self.x0) / self.cell).astype(np.int64)] = True
+
+        occupied = points.copy()
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                occupied |= np.roll(np.roll(points, dy, axis=0), dx, axis=1)   # edges stay empty (1-cell border)
+
+        # Summed-area table: occupied cells in any rectangle of cells in four lookups
+        self.counts = np.zeros((ny + 1, nx + 1), dtype=np.int64)
+        self.counts[1:, 1:] = occupied.cumsum(axis=0).cumsum(axis=1)
+
+    @property
+    def share_occupied(self):
+        return self.counts[-1, -1] / max((self.counts.shape[0] - 1) * (self.counts.shape[1] - 1), 1)
+
+    def touches(self, minx, miny, maxx, maxy):
+        """Boolean mask of the bounding boxes (arrays) that touch an occupied cell."""
+        ny, nx = self.counts.shape[0] - 1, self.counts.shape[1] - 1
+        x0 = np.floor((np.asarray(minx) - self.x0) / self.cell)
+        x1 = np.floor((np.asarray(maxx) - self.x0) / self.cell)
+        y0 = np.floor((np.asarray(miny) - self.y0) / self.cell)
+        y1 = np.floor((np.asarray(maxy) - self.y0) / self.cell)
+        inside = (x1 >= 0) & (x0 < nx) & (y1 >= 0) & (y0 < ny)   # NaN bounds (empty geometries) are never inside
+        x0, x1 = np.clip(np.nan_to_num(x0), 0, nx - 1).astype(np.int64), np.clip(np.nan_to_num(x1), 0, nx - 1).astype(np.int64)
+        y0, y1 = np.clip(np.nan_to_num(y0), 0, ny - 1).astype(np.int64), np.clip(np.nan_to_num(y1), 0, ny - 1).astype(np.int64)
+        c = self.counts
+        n = c[y1 + 1, x1 + 1] - c[y0, x1 + 1] - c[y1 + 1, x0] + c[y0, x0]
+        return inside & (n > 0)
+
+
+def wkt_points(wkt):
+    """(lon, lat) arrays of WKT points (invalid or missing WKT is skipped)."""
+    wkt = pd.Series(wkt, dtype="string").dropna().unique()
+    geoms = shapely.from_wkt(np.asarray(wkt, dtype=object), on_invalid="ignore")
+    coords = shapely.get_coordinates(geoms[~shapely.is_missing(geoms)])
+    return coords[:, 0], coords[:, 1]
+
+#######################################
+# Buildings
+
+def _file_crs(path):
+    """CRS of a GeoParquet file's primary geometry column (OGC:CRS84 when the metadata gives none)."""
+    geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+    column = geo["primary_column"]
+    crs = geo["columns"][column].get("crs", "OGC:CRS84")
+    return column, CRS.from_user_input(crs) if crs is not None else None
+
+
+def read_buildings(path, grid, batch_rows=BATCH_ROWS):
+    """
+    Buildings of a GeoParquet file whose bounding box touches an occupied cell of
+    `grid`, as gpd.read_parquet would load them (same CRS, columns and row labels).
+    """
+    column, crs = _file_crs(path)
+    lonlat = crs is None or crs.equals(CRS.from_epsg(4326), ignore_axis_order=True)
+    kept, offset = [], 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+        geoms = gpd.GeoSeries(shapely.from_wkb(batch.column(column).to_numpy(zero_copy_only=False)), crs=crs)
+        bounds = (geoms if lonlat else geoms.to_crs(4326)).bounds
+        keep = grid.touches(bounds["minx"].to_numpy(), bounds["miny"].to_numpy(),
+                            bounds["maxx"].to_numpy(), bounds["maxy"].to_numpy())
+        df = batch.drop_columns([column]).to_pandas()
+        if isinstance(df.index, pd.RangeIndex):
+            df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        part = df[keep]
+        kept.append(gpd.GeoDataFrame(part, geometry=gpd.GeoSeries(geoms.values[keep], index=part.index, crs=crs),
+                                     crs=crs))
+    if not kept:   # no rows at all
+        return gpd.read_parquet(path)
+    buildings = pd.concat(kept)
+    return buildings.rename_geometry(column) if column != "geometry" else buildings
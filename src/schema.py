@@ -0,0 +1,105 @@
+"""
+Column declarations and checks shared by the stage scripts.
+
+Each stage declares the columns it reads and writes as constants at the top of
+its script. The helpers here push those projections down into the Parquet /
+CSV readers and stop the stage early when a declared column is missing.
+
+The type registry declares the low-cardinality text columns, which are kept as
+categorical (pandas), Categorical (polars) and dictionary (Arrow / Parquet)
+columns across every stage and engine boundary.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from storage import read_schema
+
+# Low-cardinality text columns (a handful to a few hundred distinct values)
+CATEGORICAL_COLUMNS = ["Type", "trfname", "rate_category", "shs_label", "shs_label_edit", "shs_source",
+                       "match_type", "ward2021", "official_suburb"]
+DICTIONARY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+#######################################
+# Checks
+
+def require_columns(available, required, source):
+    """Raise a ValueError naming every required column that `source` does not have."""
+    missing = [c for c in required if c not in set(available)]
+    if missing:
+        raise ValueError(f"{source} is missing required columns: {missing}")
+
+
+def parquet_columns(path):
+    """Column names of a Parquet file, read from the footer only."""
+    return pq.read_schema(path).names
+
+
+def file_columns(path):
+    """Column names of a Parquet or Arrow IPC file (e.g. a bucket in either format)."""
+    return read_schema(path).names
+
+
+def csv_columns(path):
+    """Column names of a CSV file, read from the header only."""
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+#######################################
+# Projections
+
+def project_columns(path, columns=None, exclude=None):
+    """
+    Columns to read from a Parquet or Arrow IPC file.
+    columns: read exactly these (all must exist); None = all columns in the file.
+    exclude: columns to skip if present (e.g. a geometry column that is never used).
+    """
+    available = file_columns(path)
+    if columns is not None:
+        require_columns(available, columns, path)
+        selected = list(columns)
+    else:
+        selected = list(available)
+    if exclude:
+        selected = [c for c in selected if c not in exclude]
+    return selected
+
+
+def select_columns(df, columns, source):
+    """Return df restricted to the declared output columns, failing if any is missing."""
+    require_columns(df.columns, columns, source)
+    return df[list(columns)]
+
+#######################################
+# Types
+
+def to_categorical(df, columns=CATEGORICAL_COLUMNS):
+    """df with the registry's categorical columns (those present) converted to pandas categoricals."""
+    converted = {
+        c: df[c].astype("category") for c in columns
+        if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)
+    }
+    return df.assign(**converted) if converted else df
+
+
+def pl_categorical(frame, columns=CATEGORICAL_COLUMNS):
+    """Polars DataFrame/LazyFrame with the registry's columns (those present) cast to Categorical."""
+    present = [c for c in columns if c in frame.collect_schema().names()]
+    return frame.with_columns(pl.col(present).cast(pl.Utf8).cast(pl.Categorical)) if present else frame
+
+
+def pl_text(frame, columns=CATEGORICAL_COLUMNS):
+    """Polars frame with the registry's columns cast back to plain strings (for string expressions)."""
+    present = [c for c in columns if c in frame.collect_schema().names()]
+    return frame.with_columns(pl.col(present).cast(pl.Utf8)) if present else frame
+
+
+def arrow_categorical(schema, columns=CATEGORICAL_COLUMNS):
+    """Arrow schema with the registry's columns (those present) as dictionary-encoded strings."""
+    return pa.schema([
+        pa.field(f.name, DICTIONARY_TYPE) if f.name in columns else f for f in schema
+    ])
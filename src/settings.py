@@ -0,0 +1,91 @@
+"""
+Pipeline-wide settings shared by the numbered stage scripts.
+
+Values are read from environment variables so a run can be tuned
+(e.g. for a smaller node) without editing the scripts.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+
+#######################################
+# Partitioning
+
+# Number of contract_ID hash buckets the intermediate datasets (2b to 7) are split into.
+# More buckets = less memory per bucket. 64 buckets fit city scale on a 64 GB node.
+N_BUCKETS = int(os.environ.get("PIPELINE_N_BUCKETS", 64))
+
+# Worker processes used by per-bucket stages (1 = plain sequential loop)
+N_WORKERS = int(os.environ.get("PIPELINE_WORKERS", 1))
+
+#######################################
+# Chunked stages (1a, 2a, 4, 6, 7)
+
+# Memory budget (MB) of a stage run, shared by its bucket workers; chunk sizes are
+# planned to fit it (chunking.py). 0 = half of the node's physical memory.
+MEMORY_BUDGET_MB = int(os.environ.get("PIPELINE_MEMORY_BUDGET_MB", 0))
+
+# Threads processing chunks of one bucket at a time (1 = sequential)
+CHUNK_WORKERS = int(os.environ.get("PIPELINE_CHUNK_WORKERS", 2))
+
+# Rows per Parquet row group written by the streaming sinks
+ROW_GROUP_SIZE = int(os.environ.get("PIPELINE_ROW_GROUP_SIZE", 100_000))
+
+#######################################
+# Storage
+
+# File format of intermediate bucket datasets: "parquet", "arrow" (uncompressed
+# Arrow IPC, memory mapped on read) or "arrow-lz4". Final outputs are always zstd Parquet.
+INTERMEDIATE_FORMAT = os.environ.get("PIPELINE_INTERMEDIATE_FORMAT", "parquet")
+
+#######################################
+# Pipeline runner (pipeline.py)
+
+# Stage scripts run at the same time when they do not depend on each other
+STAGE_JOBS = int(os.environ.get("PIPELINE_STAGE_JOBS", 2))
+
+#######################################
+# Incremental runs (incremental.py)
+
+# File listing changed contract_IDs (one per line, or Parquet with a contract_ID column).
+# When set, the bucketed stages recompute only these contracts. Unset = full run.
+DIRTY_CONTRACTS = os.environ.get("PIPELINE_DIRTY_CONTRACTS") or None
+
+#######################################
+# Telemetry (telemetry.py)
+
+# JSON lines file the stages append their step measurements to ("" = off)
+TELEMETRY_FILE = os.environ.get("PIPELINE_TELEMETRY_FILE", "output/logs/telemetry.jsonl")
+
+#######################################
+# Fast runs (sampling.py)
+
+# Fraction of contracts kept from ingest on (1 = all). The contracts are chosen by a
+# fixed hash of their id, so every stage and every run keeps the same ones.
+SAMPLE_FRACTION = float(os.environ.get("PIPELINE_SAMPLE_FRACTION", 1))
+
+# Changes which contracts are drawn (same fraction)
+SAMPLE_SEED = int(os.environ.get("PIPELINE_SAMPLE_SEED", 0))
+
+#######################################
+# Matching and SHS assumptions (varied by sweep.py)
+
+# 3: contracts outside every building go to the nearest building within this distance (m)
+CONTRACT_BUILDING_MAX_DISTANCE_M = float(os.environ.get("PIPELINE_CONTRACT_BUILDING_MAX_DISTANCE_M", 100))
+
+# 4: smallest predicted panel area kept (m²), and the nearest-building distance (m)
+# for panels outside every building
+SHS_MIN_AREA_M2 = float(os.environ.get("PIPELINE_SHS_MIN_AREA_M2", 1.7))
+SHS_BUILDING_MAX_DISTANCE_M = float(os.environ.get("PIPELINE_SHS_BUILDING_MAX_DISTANCE_M", 100))
+
+# 5b: rules applied to each contract's observed SHS years (comma-separated, "" = none):
+# drop_isolated (a single observed year other than the last is dropped), fill_gaps
+# (years between observed years), forward_extend (into the last year)
+SHS_YEAR_RULES = tuple(r for r in os.environ.get(
+    "PIPELINE_SHS_YEAR_RULES", "drop_isolated,fill_gaps,forward_extend").split(",") if r)
+
+# 5c: panel area (m²) and rating (W) turning a predicted SHS area into capacity
+PANEL_SIZE_M2 = float(os.environ.get("PIPELINE_PANEL_SIZE_M2", 1.7))
+WATT_PER_PANEL = float(os.environ.get("PIPELINE_WATT_PER_PANEL", 400))
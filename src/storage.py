@@ -0,0 +1,176 @@
+"""
+File formats of the bucket datasets.
+
+Intermediate datasets (2b to 6, and the transaction intervals from 1b) are
+written in settings.INTERMEDIATE_FORMAT:
+
+    parquet     Parquet (snappy), decoded on every read
+    arrow       uncompressed Arrow IPC (Feather v2), opened with memory mapping:
+                reading a column maps its pages instead of decoding them
+    arrow-lz4   LZ4-compressed Arrow IPC: smaller files, decompressed on read
+
+Final deliverables (7, 8) are always written as zstd Parquet (FINAL_FORMAT).
+Readers take the format from the file extension, so a stage reads its input in
+whatever format the previous stage wrote it.
+
+A writer that knows its rows are sorted records the sort keys in the file's
+schema metadata (sorted_by=[...]; Parquet also gets the standard sorting_columns
+of each row group). Readers check is_sorted_by() and skip their own sort, so a
+bucket is sorted by contract_ID and month once (2b, 5a) instead of in every
+stage. Files written without sorted_by carry no order, and a reader sorts.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import json
+
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from settings import INTERMEDIATE_FORMAT
+
+IPC_EXTENSION = ".arrow"
+FORMATS = {
+    "parquet": {"extension": ".parquet", "compression": "snappy"},
+    "arrow": {"extension": IPC_EXTENSION, "compression": "uncompressed"},
+    "arrow-lz4": {"extension": IPC_EXTENSION, "compression": "lz4"},
+    "parquet-zstd": {"extension": ".parquet", "compression": "zstd"},
+}
+FINAL_FORMAT = "parquet-zstd"
+
+# Schema metadata key holding the columns a file is sorted by (JSON list, ascending)
+SORT_ORDER_KEY = b"pipeline.sorted_by"
+
+if INTERMEDIATE_FORMAT not in FORMATS:
+    raise ValueError(f"PIPELINE_INTERMEDIATE_FORMAT must be one of {list(FORMATS)}, got {INTERMEDIATE_FORMAT!r}")
+
+
+def extension(fmt=INTERMEDIATE_FORMAT):
+    return FORMATS[fmt]["extension"]
+
+
+def compression(fmt=INTERMEDIATE_FORMAT):
+    return FORMATS[fmt]["compression"]
+
+
+def is_ipc(path):
+    return str(path).endswith(IPC_EXTENSION)
+
+#######################################
+# Arrow
+
+def read_schema(path):
+    """Arrow schema of a Parquet or Arrow IPC file (footer only)."""
+    if is_ipc(path):
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema
+    return pq.read_schema(path)
+
+
+def read_table(path, columns=None):
+    """Arrow table of a Parquet or Arrow IPC file (IPC files are memory mapped)."""
+    if is_ipc(path):
+        return feather.read_table(path, columns=columns, memory_map=True)
+    return pq.read_table(path, columns=columns)
+
+
+def iter_batches(path, batch_size, columns=None):
+    """Record batches of at most batch_size rows."""
+    if is_ipc(path):
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            yield from pa.Table.from_batches([batch]).to_batches(max_chunksize=batch_size)
+    else:
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def write_table(table, path, fmt=INTERMEDIATE_FORMAT, sorted_by=None):
+    """Write an Arrow table; sorted_by: the columns its rows are sorted by (recorded, not checked)."""
+    table = with_sort_order(table, sorted_by)
+    if is_ipc(extension(fmt)):
+        feather.write_feather(valid_dictionary_indices(table), path, compression=compression(fmt))
+    else:
+        sorting = [pq.SortingColumn(table.schema.get_field_index(c)) for c in sorted_by or []]
+        pq.write_table(table, path, compression=compression(fmt), sorting_columns=sorting or None)
+
+
+def write_frame(df, path, fmt=INTERMEDIATE_FORMAT, sorted_by=None):
+    """Write a pandas DataFrame (without its index)."""
+    write_table(pa.Table.from_pandas(df, preserve_index=False), path, fmt, sorted_by=sorted_by)
+
+def valid_dictionary_indices(table):
+    """
+    Table whose dictionary (categorical) columns hold index 0 under their nulls.
+    pandas leaves its -1 category code in the null slots, which polars' IPC
+    reader rejects even though the slot is null.
+    """
+    for i, field in enumerate(table.schema):
+        column = table.column(i)
+        if not pa.types.is_dictionary(field.type) or not column.null_count:
+            continue
+        chunks = [pa.DictionaryArray.from_arrays(pc.fill_null(chunk.indices, 0).to_numpy(), chunk.dictionary,
+                                                 mask=chunk.indices.is_null().to_numpy(zero_copy_only=False),
+                                                 ordered=field.type.ordered)
+                  for chunk in column.chunks]
+        table = table.set_column(i, field, pa.chunked_array(chunks, field.type))
+    return table
+
+#######################################
+# Sort order
+
+def with_sort_order(table, sorted_by):
+    """Arrow table with `sorted_by` recorded as its sort order (None: no recorded order)."""
+    metadata = {k: v for k, v in (table.schema.metadata or {}).items() if k != SORT_ORDER_KEY}
+    if sorted_by:
+        missing = [c for c in sorted_by if c not in table.column_names]
+        if missing:
+            raise ValueError(f"Sort columns {missing} are not in the table")
+        metadata[SORT_ORDER_KEY] = json.dumps(list(sorted_by)).encode()
+    return table.replace_schema_metadata(metadata or None)
+
+
+def sort_order(path):
+    """Columns a Parquet or Arrow IPC file was recorded as sorted by ([] when unknown)."""
+    metadata = read_schema(path).metadata or {}
+    return json.loads(metadata[SORT_ORDER_KEY]) if SORT_ORDER_KEY in metadata else []
+
+
+def is_sorted_by(path, keys):
+    """True when the file's rows are recorded as sorted by `keys` (or by keys that start with them)."""
+    return sort_order(path)[:len(keys)] == list(keys)
+
+#######################################
+# polars
+
+# Arrow IPC from polars uses plain (large) strings rather than string views,
+# which pyarrow's compute kernels (filter, take) do not all support
+IPC_COMPAT = pl.CompatLevel.oldest()
+
+
+def pl_scan(path):
+    """LazyFrame over a Parquet or Arrow IPC file."""
+    return pl.scan_ipc(path) if is_ipc(path) else pl.scan_parquet(path)
+
+
+def pl_write(df, path, fmt=INTERMEDIATE_FORMAT, sorted_by=None):
+    if sorted_by:   # polars writers take no schema metadata for IPC; go through Arrow
+        write_table(df.to_arrow(compat_level=IPC_COMPAT), path, fmt, sorted_by=sorted_by)
+    elif is_ipc(extension(fmt)):
+        df.write_ipc(path, compression=compression(fmt), compat_level=IPC_COMPAT)
+    else:
+        df.write_parquet(path, compression=compression(fmt))
+
+
+def pl_sink(frame, path, fmt=INTERMEDIATE_FORMAT):
+    """Stream a LazyFrame to a file without collecting it."""
+    if is_ipc(extension(fmt)):
+        frame.sink_ipc(path, compression=compression(fmt), compat_level=IPC_COMPAT)
+    else:
+        frame.sink_parquet(path, compression=compression(fmt))
@@ -0,0 +1,122 @@
+"""
+Streaming output for chunked stages: chunks are processed in parallel with a
+bounded number in flight and written to Parquet or Arrow IPC as soon as they are
+ready, so a stage never holds its whole output in memory.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from schema import arrow_categorical
+from settings import CHUNK_WORKERS, ROW_GROUP_SIZE
+from storage import INTERMEDIATE_FORMAT, compression, extension, is_ipc, valid_dictionary_indices
+
+#######################################
+# Schema
+
+def output_schema(base, changes=None, drop=None):
+    """
+    Fixed output schema: `base` fields (e.g. the input file's schema) minus `drop`,
+    with `changes` ({name: arrow type}) replacing or appending fields.
+    """
+    changes = changes or {}
+    drop = set(drop or [])
+    fields = [pa.field(f.name, changes.get(f.name, f.type)) for f in base if f.name not in drop]
+    names = {f.name for f in fields}
+    fields += [pa.field(name, t) for name, t in changes.items() if name not in names]
+    return pa.schema(fields)
+
+#######################################
+# Sinks
+
+class ParquetSink:
+    """
+    Parquet writer with a fixed schema and row-group size.
+    Every chunk is cast to the schema, so all chunks (and buckets) share one schema.
+    Registry categorical columns are always written as dictionary-encoded strings.
+    """
+
+    def __init__(self, path, schema, row_group_size=ROW_GROUP_SIZE, compression="snappy"):
+        self.path = path
+        self.schema = arrow_categorical(schema)
+        self.row_group_size = row_group_size
+        self.rows = 0
+        self.writer = self._open(compression)
+
+    def _open(self, compression):
+        return pq.ParquetWriter(self.path, self.schema, compression=compression)
+
+    def _table(self, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        return table.select(self.schema.names).cast(self.schema)
+
+    def write(self, df):
+        table = self._table(df)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.rows += len(table)
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close()
+        # A file cut short by an error would read as a complete (smaller) bucket
+        if exc_type is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ArrowSink(ParquetSink):
+    """ParquetSink writing an Arrow IPC file instead (one record batch per row group)."""
+
+    def _open(self, compression):
+        options = pa.ipc.IpcWriteOptions(compression=None if compression == "uncompressed" else compression)
+        return pa.ipc.new_file(self.path, self.schema, options=options)
+
+    def write(self, df):
+        table = valid_dictionary_indices(self._table(df))
+        self.writer.write_table(table, max_chunksize=self.row_group_size)
+        self.rows += len(table)
+
+
+def open_sink(path, schema, fmt=INTERMEDIATE_FORMAT, row_group_size=ROW_GROUP_SIZE):
+    """Sink for a bucket file in `fmt` (see storage.FORMATS)."""
+    sink = ArrowSink if is_ipc(extension(fmt)) else ParquetSink
+    return sink(path, schema, row_group_size=row_group_size, compression=compression(fmt))
+
+#######################################
+# Parallel chunks
+
+# Chunks held in memory at once by map_chunks (for chunking.ChunkPlanner)
+CHUNKS_IN_FLIGHT = 2 * CHUNK_WORKERS if CHUNK_WORKERS > 1 else 1
+
+
+def map_chunks(func, chunks, workers=CHUNK_WORKERS, max_pending=None):
+    """
+    Yield func(chunk) for each chunk, in input order.
+    With workers > 1, chunks run in a thread pool with at most `max_pending`
+    (default 2 per worker) read but not yet written, which bounds memory.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield func(chunk)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(func, chunk))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,355 @@
+"""
+Sensitivity runs over the matching and SHS assumptions (settings.py).
+
+A sweep takes a grid of values for some of the stage settings (e.g. the panel
+area filter of 4 and the year rules of 5b) and runs every combination. Stages
+whose output does not depend on a swept setting run once, through pipeline.py,
+in the repository folder as usual. Only the stages that use a swept setting,
+and the stages downstream of them, run per combination, each in its own folder
+under sweeps/cache/ with links to the data and to the outputs it reads.
+Combinations share a job whenever its code, settings and inputs are the same
+(5a runs once per value of the 4 settings, not once per combination), jobs that
+do not depend on each other run at the same time, and finished jobs are reused
+by later sweeps.
+
+    python src/sweep.py --set SHS_MIN_AREA_M2 1.0 1.7 2.5 --set PANEL_SIZE_M2 1.6 1.7
+    python src/sweep.py --set SHS_YEAR_RULES fill_gaps,forward_extend drop_isolated,fill_gaps,forward_extend --until 5c
+    python src/sweep.py --grid grid.json --name area_rules --jobs 4
+
+A grid file maps setting names to lists of values ({"SHS_MIN_AREA_M2": [1, 1.7]};
+lists of rules may also be given as lists). The results of all combinations go
+to one tidy table, sweeps/<name>/comparison.csv: one row per variant, setting
+and metric (contracts with a building, panels kept, PV contracts and
+capacity, ...).
+
+Run from the repository root. Job logs are in sweeps/cache/<job>/output/logs/.
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+import settings
+from buckets import list_buckets, read_bucket
+from incremental import DIRTY_FILE
+from pipeline import SRC_DIR, STAGES, DigestCache, _base, _overlaps, code_digest, dependencies, load_state, run, select
+from telemetry import start_run
+
+# Paths
+SWEEP_DIR = "sweeps"
+CACHE_DIR = os.path.join(SWEEP_DIR, "cache")
+DONE_FILE = ".done"
+
+SWEEPABLE = sorted({p for s in STAGES for p in s.params})
+
+#######################################
+# Grid
+
+def _value(value):
+    """A grid value as the string its PIPELINE_ variable takes (lists are joined with commas)."""
+    if isinstance(value, (list, tuple)):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def read_grid(path=None, sets=()):
+    """{setting: [values]} from a JSON grid file and --set NAME VALUE... arguments."""
+    grid = {}
+    if path:
+        with open(path) as f:
+            grid.update({name: [_value(v) for v in values] for name, values in json.load(f).items()})
+    for name, *values in sets:
+        grid[name] = [_value(v) for v in values]
+    unknown = [name for name in grid if name not in SWEEPABLE]
+    if unknown:
+        raise SystemExit(f"Not stage settings: {unknown} (known: {SWEEPABLE})")
+    empty = [name for name, values in grid.items() if not values]
+    if not grid or empty:
+        raise SystemExit("Give at least one value for each swept setting (--set NAME VALUE... or --grid FILE)")
+    return grid
+
+
+def variants(grid):
+    """Every combination of the grid values, as [(variant name, {setting: value})]."""
+    names = list(grid)
+    combos = list(itertools.product(*(grid[n] for n in names)))
+    width = len(str(len(combos)))
+    return [(f"v{i + 1:0{width}d}", dict(zip(names, combo))) for i, combo in enumerate(combos)]
+
+#######################################
+# Stages
+
+def plan_stages(grid, until=None):
+    """
+    (base stages, swept stages): the swept stages use a swept setting or are
+    downstream of one that does (up to `until`), the base stages are the others
+    they read from.
+    """
+    deps = dependencies()
+    swept = set()
+    for stage in STAGES:   # pipeline order, so upstream stages are classified first
+        if set(stage.params) & set(grid) or deps[stage.name] & swept:
+            swept.add(stage.name)
+    if until:
+        swept &= {s.name for s in select(until)}
+    if not swept:
+        raise SystemExit("No stage depends on the swept settings" + (f" up to {until}" if until else ""))
+    base = [s for s in select(sorted(swept)) if s.name not in swept]
+    return base, [s for s in STAGES if s.name in swept]
+
+#######################################
+# Jobs
+
+class Job:
+    """One run of a swept stage, for the settings of one or more variants."""
+
+    def __init__(self, stage, env, upstream, key):
+        self.stage = stage
+        self.env = env                 # {PIPELINE_ variable: value} of the swept settings it uses
+        self.upstream = upstream       # {stage name: Job} of the swept stages it reads from
+        self.key = key
+        self.dir = os.path.join(CACHE_DIR, f"{stage.name}-{key}")
+
+    @property
+    def done(self):
+        return os.path.exists(os.path.join(self.dir, DONE_FILE))
+
+
+def plan_jobs(swept_stages, all_variants, state):
+    """{variant: {stage name: Job}}, with one Job object per distinct key."""
+    deps = dependencies()
+    digests = DigestCache()
+    jobs, plans = {}, {}
+    for variant, values in all_variants:
+        plan = {}
+        for stage in swept_stages:
+            env = {f"PIPELINE_{name}": values[name] for name in stage.params if name in values}
+            upstream = {name: plan[name] for name in sorted(deps[stage.name]) if name in plan}
+            payload = {
+                "stage": stage.name,
+                "code": code_digest(stage.script),
+                "params": {name: values.get(name, _value(getattr(settings, name))) for name in stage.params},
+                "upstream": {name: job.key for name, job in upstream.items()},
+                "base": {name: state.get(name, {}).get("fingerprint") for name in sorted(deps[stage.name] - set(upstream))},
+                "data": {path: digests.path_digest(path) for path in stage.inputs if not path.startswith("output/")},
+            }
+            key = hashlib.blake2b(json.dumps(payload, sort_keys=True).encode(), digest_size=8).hexdigest()
+            plan[stage.name] = jobs.setdefault(key, Job(stage, env, upstream, key))
+        plans[variant] = plan
+    digests.save()
+    return plans
+
+
+def _link(target, link):
+    os.makedirs(os.path.dirname(link) or ".", exist_ok=True)
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.abspath(target), link)
+
+
+def incremental_inputs(swept_stages):
+    """Base outputs read by the swept stages that hold an incremental update (jobs are full runs)."""
+    written = [o for s in swept_stages for o in s.outputs]
+    return sorted({
+        _base(path) for s in swept_stages for path in s.inputs
+        if not any(_overlaps(path, o) for o in written) and os.path.exists(os.path.join(_base(path), DIRTY_FILE))
+    })
+
+
+def prepare(job):
+    """Fresh job folder: links to data/, to the base outputs and to the outputs of the upstream jobs."""
+    if os.path.exists(job.dir):
+        shutil.rmtree(job.dir)
+    os.makedirs(job.dir)
+    _link("data", os.path.join(job.dir, "data"))
+    for path in job.stage.inputs:
+        base = _base(path).rstrip("/")
+        if not base.startswith("output/"):
+            continue
+        source = next((u.dir for u in job.upstream.values()
+                       if any(_overlaps(path, o) for o in u.stage.outputs)), None)
+        _link(os.path.join(source, base) if source else base, os.path.join(job.dir, base))
+
+
+def run_job(job):
+    """Run a job's stage script in its folder, with its settings. Returns success."""
+    prepare(job)
+    env = dict(os.environ, **job.env)
+    env.pop("PIPELINE_DIRTY_CONTRACTS", None)   # jobs are full runs
+    env["PIPELINE_TELEMETRY_FILE"] = os.path.abspath(settings.TELEMETRY_FILE)
+    log_dir = os.path.join(job.dir, "output", "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(log_dir, f"{job.stage.name}.log"), "w") as log:
+        proc = subprocess.run([sys.executable, os.path.join(SRC_DIR, job.stage.script)],
+                              cwd=job.dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if proc.returncode == 0:
+        with open(os.path.join(job.dir, DONE_FILE), "w") as f:
+            json.dump({"stage": job.stage.name, "env": job.env,
+                       "finished": time.strftime("%Y-%m-%d %H:%M:%S")}, f)
+    return proc.returncode == 0
+
+
+def run_jobs(jobs, n_jobs=settings.STAGE_JOBS):
+    """Run the jobs not done yet (upstream first, up to n_jobs at a time). Returns the keys of the failed jobs."""
+    pending = [job for job in jobs if not job.done]
+    print(f"\n {len(jobs)} jobs, {len(jobs) - len(pending)} cached, {len(pending)} to run")
+    finished, failed = {job.key for job in jobs if job.done}, set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(n_jobs, 1)) as pool:
+        while pending or running:
+            for job in list(pending):
+                upstream = {u.key for u in job.upstream.values()}
+                if upstream & failed:
+                    pending.remove(job)
+                    failed.add(job.key)
+                    print(f"⏭️  {job.stage.name} [{job.key}]: not run (upstream job failed)")
+                elif upstream <= finished and len(running) < max(n_jobs, 1):
+                    pending.remove(job)
+                    print(f"▶️  {job.stage.name} [{job.key}]: running {job.stage.script} {job.env or ''}")
+                    running[pool.submit(run_job, job)] = (job, time.time())
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, start = running.pop(future)
+                seconds = time.time() - start
+                if future.result():
+                    finished.add(job.key)
+                    print(f"✅ {job.stage.name} [{job.key}]: finished in {seconds:.1f}s")
+                else:
+                    failed.add(job.key)
+                    print(f"❌ {job.stage.name} [{job.key}]: failed after {seconds:.1f}s, "
+                          f"see {os.path.join(job.dir, 'output', 'logs', job.stage.name + '.log')}")
+    return failed
+
+#######################################
+# Metrics (per swept stage, from its outputs)
+
+def _sum_buckets(dataset_dir, columns, func):
+    """Sum of func(bucket DataFrame) over the buckets of a dataset (contracts never span buckets)."""
+    totals = {}
+    for bucket in list_buckets(dataset_dir):
+        for metric, value in func(read_bucket(dataset_dir, bucket, columns=columns)).items():
+            totals[metric] = totals.get(metric, 0) + value
+    return totals
+
+
+def metrics_3(job_dir):
+    return _sum_buckets(
+        os.path.join(job_dir, "output/3_out/out_contractlocation_with_building"), ["contract_ID", "id"],
+        lambda df: {"contracts": df["contract_ID"].nunique(),
+                    "contracts_with_building": df.loc[df["id"].notna(), "contract_ID"].nunique()})
+
+
+def metrics_4(job_dir):
+    panels = matched = 0
+    for path in sorted(os.listdir(os.path.join(job_dir, "output/4_out"))):
+        if path.endswith(".parquet"):
+            matches = pq.read_table(os.path.join(job_dir, "output/4_out", path), columns=["index_right"])
+            panels += matches.num_rows
+            matched += matches.num_rows - matches.column("index_right").null_count
+    return {"panels": panels, "panels_on_building": matched}
+
+
+def _metrics_5b(df):
+    years = df.drop_duplicates(["contract_ID", "year"])
+    counts = {"pv_contracts": df.loc[df["has_shs"].fillna(False).astype(bool), "contract_ID"].nunique()}
+    for source, n in years["shs_source"].value_counts().items():
+        counts[f"contract_years_{source}"] = int(n)
+    return counts
+
+
+def metrics_5b(job_dir):
+    return _sum_buckets(os.path.join(job_dir, "output/5b_out/combined"),
+                        ["contract_ID", "year", "has_shs", "shs_source"], _metrics_5b)
+
+
+def _metrics_5c(df):
+    pv = df[(df["shs_label_edit"] == "PV_normal") & (df["year"] == df["year"].max())]
+    capacity = pv.groupby("contract_ID")["Watt"].max()
+    return {"pv_contracts_last_year": len(capacity), "capacity_kw_last_year": float(np.nansum(capacity)) / 1000}
+
+
+def metrics_5c(job_dir):
+    return _sum_buckets(os.path.join(job_dir, "output/5c_out/with_sseg_reg"),
+                        ["contract_ID", "year", "shs_label_edit", "Watt"], _metrics_5c)
+
+
+METRICS = {"3": metrics_3, "4": metrics_4, "5b": metrics_5b, "5c": metrics_5c}
+
+
+def comparison(plans, all_variants, failed):
+    """Tidy table: variant, swept settings, stage, metric, value."""
+    rows = []
+    for variant, values in all_variants:
+        for name, job in plans[variant].items():
+            if name not in METRICS or job.key in failed:
+                continue
+            for metric, value in METRICS[name](job.dir).items():
+                rows.append({"variant": variant, **values, "stage": name, "job": job.key,
+                             "metric": metric, "value": value})
+    return pd.DataFrame(rows)
+
+#######################################
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline for a grid of stage settings and compare the results.")
+    parser.add_argument("--set", nargs="+", action="append", default=[], metavar=("NAME", "VALUE"),
+                        help="a setting and the values to sweep, e.g. --set SHS_MIN_AREA_M2 1.0 1.7 2.5")
+    parser.add_argument("--grid", help="JSON file mapping settings to lists of values")
+    parser.add_argument("--until", nargs="+", help="last stages to run per variant (default: all downstream stages)")
+    parser.add_argument("--name", default=None, help="name of the sweep (default: the swept settings)")
+    parser.add_argument("--jobs", type=int, default=settings.STAGE_JOBS, help="jobs run at the same time")
+    args = parser.parse_args()
+
+    grid = read_grid(args.grid, args.set)
+    all_variants = variants(grid)
+    base, swept = plan_stages(grid, args.until)
+    name = args.name or "-".join(sorted(grid))
+    print(f"\n Sweep {name}: {len(all_variants)} variants of {', '.join(f'{k} ({len(v)})' for k, v in grid.items())}")
+    print(f"   🔹 Shared stages: {', '.join(s.name for s in base) or 'none'}")
+    print(f"   🔹 Per variant: {', '.join(s.name for s in swept)}")
+
+    start = time.time()
+    start_run()   # one telemetry run id for the shared stages and all jobs
+    if base and run(base, jobs=args.jobs):
+        raise SystemExit("❌ Shared stages failed, see output/logs/")
+    partial = incremental_inputs(swept)
+    if partial:
+        raise SystemExit(f"❌ {', '.join(partial)} hold incremental updates; rerun the shared stages in full first")
+
+    plans = plan_jobs(swept, all_variants, load_state())
+    jobs = list({job.key: job for plan in plans.values() for job in plan.values()}.values())
+    failed = run_jobs(jobs, args.jobs)
+
+    table = comparison(plans, all_variants, failed)
+    out_dir = os.path.join(SWEEP_DIR, name)
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "comparison.csv")
+    table.to_csv(out_file, index=False)
+    variant_table = pd.DataFrame([{"variant": v, **values} for v, values in all_variants])
+    variant_table.to_csv(os.path.join(out_dir, "variants.csv"), index=False)
+
+    if not table.empty:
+        wide = table.pivot_table(index=["stage", "metric"], columns="variant", values="value", sort=False)
+        with pd.option_context("display.width", 200, "display.max_columns", 20):
+            print(variant_table.to_string(index=False))
+            print(wide.to_string(float_format=lambda x: f"{x:,.1f}" if x % 1 else f"{x:,.0f}"))
+    print(f"\n Saved comparison of {len(all_variants)} variants to {out_file}")
+    print(f"Total runtime: {time.time() - start:.1f}s")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,224 @@
+"""
+Structured per-stage telemetry: wall time, CPU time, peak RSS, rows and bytes
+of every stage and of its named steps (load, join, fill, save, ...), written as
+JSON lines to settings.TELEMETRY_FILE.
+
+    telemetry = Telemetry("5b")
+
+    with telemetry.step("load") as step:         # a block of code
+        df = ...
+        step.rows_out = len(df)
+
+    @telemetry.timed("bucket")                   # every call of a function (e.g. process_bucket)
+    def process_bucket(bucket): ...
+
+    telemetry.lap("join", rows_out=len(df))      # everything since the previous lap (flat scripts)
+    telemetry.log("Dropped 12 rows")             # a message, printed and recorded
+    telemetry.finish(rows_out=n)                 # the stage total, with a one-line summary
+
+Each record holds the run id, stage, step, process id, wall and CPU seconds,
+the process' peak RSS and how much the step raised it, bytes read and written
+(from /proc/self/io, so memory-mapped reads are not counted; in threaded steps
+the counts cover the whole process), and the rows and counts given. Bucket
+workers spawned by map_buckets inherit the run id, so their records join the
+stage's, as do those of all stages started by one pipeline.py run. Summarize a run with pandas.read_json(TELEMETRY_FILE, lines=True).
+
+Author: Elizabeth Yoder
+Date: October 2026
+"""
+
+import functools
+import inspect
+import json
+import os
+import resource
+import time
+import uuid
+from contextlib import contextmanager
+
+from settings import TELEMETRY_FILE
+
+RUN_ID_VARIABLE = "PIPELINE_RUN_ID"
+
+#######################################
+# Runs
+
+def start_run():
+    """Give the stage scripts started from here (by pipeline.py or the benchmark) one shared run id."""
+    os.environ[RUN_ID_VARIABLE] = uuid.uuid4().hex[:12]
+    return os.environ[RUN_ID_VARIABLE]
+
+#######################################
+# Measurements
+
+def _io_bytes():
+    """(bytes read, bytes written) by this process so far, or (None, None) where /proc is not available."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _peak_rss_mb(children=False):
+    """Peak RSS of this process (or of its largest finished child process) in MB."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    return usage.ru_maxrss / 1024
+
+
+def _cpu_seconds():
+    """User + system CPU time of this process and its finished child processes."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class _Snapshot:
+    def __init__(self):
+        self.wall = time.perf_counter()
+        self.cpu = _cpu_seconds()
+        self.peak_rss_mb = _peak_rss_mb()
+        self.bytes_read, self.bytes_written = _io_bytes()
+
+
+def _delta(after, before):
+    return None if after is None or before is None else after - before
+
+#######################################
+# Steps
+
+class Step:
+    """One measured step. rows_in, rows_out and count() can be set while it runs."""
+
+    def __init__(self, telemetry, name, **fields):
+        self.telemetry = telemetry
+        self.name = name
+        self.rows_in = fields.pop("rows_in", None)
+        self.rows_out = fields.pop("rows_out", None)
+        self.fields = fields
+        self.start = _Snapshot()
+
+    def count(self, **counts):
+        """Attach counts (or other values) to the step's record."""
+        self.fields.update(counts)
+
+    def record(self, status="ok"):
+        end = _Snapshot()
+        record = {
+            "run_id": self.telemetry.run_id,
+            "stage": self.telemetry.stage,
+            "step": self.name,
+            "pid": os.getpid(),
+            "status": status,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_s": round(end.wall - self.start.wall, 4),
+            "cpu_s": round(end.cpu - self.start.cpu, 4),
+            "peak_rss_mb": round(end.peak_rss_mb, 1),
+            "rss_growth_mb": round(end.peak_rss_mb - self.start.peak_rss_mb, 1),
+            "bytes_read": _delta(end.bytes_read, self.start.bytes_read),
+            "bytes_written": _delta(end.bytes_written, self.start.bytes_written),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            **self.telemetry.context,
+            **self.fields,
+        }
+        self.telemetry.write(record)
+        return record
+
+#######################################
+# Per-stage recorder
+
+class Telemetry:
+    """Telemetry of one stage script (and of the bucket workers it spawns)."""
+
+    def __init__(self, stage, path=TELEMETRY_FILE):
+        self.stage = stage
+        self.path = path
+        # Spawned workers inherit the environment, and with it the run id
+        self.run_id = os.environ.setdefault(RUN_ID_VARIABLE, uuid.uuid4().hex[:12])
+        self.context = {}   # fields added to every record (the bucket inside a timed bucket function)
+        self._total = Step(self, "total")
+        self._lap = Step(self, "")
+
+    def write(self, record):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # One line per write in append mode, so concurrent workers do not interleave records
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    @contextmanager
+    def step(self, name, **fields):
+        """Measure a block of code; the record is written when the block exits (status 'failed' on an exception)."""
+        step = Step(self, name, **fields)
+        try:
+            yield step
+        except BaseException:
+            step.record("failed")
+            raise
+        step.record()
+
+    def timed(self, name):
+        """
+        Decorator measuring every call of a function. A `bucket` argument is added to
+        this record and to the laps inside the call (which start with the call), and a
+        returned dict of counts is attached to the record.
+        """
+        def decorate(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                arguments = signature.bind(*args, **kwargs).arguments
+                previous = self.context
+                if "bucket" in arguments:
+                    self.context = {**previous, "bucket": arguments["bucket"]}
+                self._lap = Step(self, "")
+                try:
+                    with self.step(name) as step:
+                        result = func(*args, **kwargs)
+                        if isinstance(result, dict):
+                            step.count(**{k: v for k, v in result.items() if isinstance(v, (int, float, str))})
+                finally:
+                    self.context = previous
+                return result
+            return wrapper
+        return decorate
+
+    def lap(self, name, **fields):
+        """Record everything since the previous lap (or since the stage started) as step `name`."""
+        step = self._lap
+        step.name = name
+        step.rows_in = fields.pop("rows_in", None)
+        step.rows_out = fields.pop("rows_out", None)
+        step.fields = fields
+        record = step.record()
+        self._lap = Step(self, "")
+        return record
+
+    def log(self, message, **fields):
+        """Print a message and record it (with any counts) as an event."""
+        print(message)
+        self.write({
+            "run_id": self.run_id,
+            "stage": self.stage,
+            "step": "log",
+            "pid": os.getpid(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "message": message.strip(),
+            **self.context,
+            **fields,
+        })
+
+    def finish(self, **fields):
+        """Record the stage total (peak RSS over the script and its finished workers) and print a summary."""
+        self._total.count(**fields)
+        self._total.rows_in = self._total.fields.pop("rows_in", None)
+        self._total.rows_out = self._total.fields.pop("rows_out", None)
+        self._total.fields["workers_peak_rss_mb"] = round(_peak_rss_mb(children=True), 1)
+        record = self._total.record()
+        print(f"⏱️ Stage {self.stage}: {record['wall_s']:.1f}s wall, {record['cpu_s']:.1f}s CPU, "
+              f"peak RSS {max(record['peak_rss_mb'], record['workers_peak_rss_mb']):,.0f} MB "
+              f"(telemetry in {self.path})")
+        return record